@@ -12,9 +12,15 @@ from WebStreamer import bot_loop, utils
 from WebStreamer import StreamBot
 from WebStreamer.server import web_server
 from WebStreamer.bot.clients import initialize_clients
-from WebStreamer.bot import cached_bot_info
+from WebStreamer.bot import cached_bot_info, multi_clients
 from WebStreamer.utils import upload_to_github, download_from_github
 from WebStreamer.bot import session_name as bot_session_name
+from WebStreamer.utils.metadata import warm_metadata_cache
+from WebStreamer.utils.metadata_store import metadata_store
+from WebStreamer.utils.peer_cache import peer_cache
+from WebStreamer.utils.chunk_cache import chunk_cache
+from WebStreamer.utils.prefetch import prefetch_jobs
+from WebStreamer.server.stream_routes import get_streamer
 
 logging.basicConfig(
     level=logging.INFO,
@@ -288,18 +294,34 @@ async def start_services():
         logging.info("---------------------- Initializing Clients ----------------------")
         await initialize_clients()
         logging.info("------------------------------ DONE ------------------------------")
+
+        logging.info("------------------- Opening Metadata Store -------------------")
+        await metadata_store.start()
+        asyncio.create_task(warm_metadata_cache())
+        logging.info("------------------------------ DONE ------------------------------")
+        
+        logging.info("-------------------- Indexing Chunk Cache --------------------")
+        try:
+            await chunk_cache.load()
+        except Exception as e:
+            logging.error(f"Failed to index the chunk cache, continuing without it: {e}")
+            chunk_cache.max_bytes = 0
+        await prefetch_jobs.start(get_streamer)
+        logging.info("------------------------------ DONE ------------------------------")
         
-        # Pre-cache BIN_CHANNEL peer to avoid "Peer id invalid" errors
-        if Var.BIN_CHANNEL:
-            logging.info("------------------ Pre-caching BIN_CHANNEL Peer ------------------")
-            try:
-                # Get the BIN_CHANNEL chat to cache it (bot-compatible method)
-                chat = await StreamBot.get_chat(Var.BIN_CHANNEL)
-                logging.info(f"Successfully cached BIN_CHANNEL: {chat.title if hasattr(chat, 'title') else Var.BIN_CHANNEL}")
+        # Pre-resolve BIN_CHANNEL and every stored channel for every client to avoid "Peer id invalid" errors
+        logging.info("------------------- Pre-resolving Channel Peers -------------------")
+        try:
+            channel_ids = [Var.BIN_CHANNEL] + await metadata_store.channel_ids()
+            prewarm = asyncio.create_task(peer_cache.prewarm(list(multi_clients.values()), channel_ids))
+            done, _ = await asyncio.wait({prewarm}, timeout=Var.PEER_PREWARM_TIMEOUT)
+            if done:
                 logging.info("------------------------------ DONE ------------------------------")
-            except Exception as e:
-                logging.error(f"Failed to pre-cache BIN_CHANNEL: {e}")
-                logging.info("--------------------------- FAILED ------------------------------")
+            else:
+                logging.info("------------------ CONTINUING IN BACKGROUND ------------------")
+        except Exception as e:
+            logging.error(f"Failed to pre-resolve channel peers: {e}")
+            logging.info("--------------------------- FAILED ------------------------------")
         if Var.ON_HEROKU:
             logging.info("------------------ Starting Keep Alive Service ------------------")
             logging.info("")
@@ -328,6 +350,11 @@ async def cleanup():
         await server.cleanup()
     except Exception as e:
         logging.error(f"Error during server cleanup: {e}")
+
+    try:
+        await metadata_store.close()
+    except Exception as e:
+        logging.error(f"Error closing metadata store: {e}")
     
     try:
         # Check if StreamBot is already stopped before attempting to stop
@@ -2,12 +2,16 @@
 import logging
 import time
 import asyncio
-import urllib.parse
 from pyrogram import filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, Video, Audio
 from WebStreamer.bot import StreamBot
 from WebStreamer.vars import Var
 from pyrogram.file_id import FileId
+from WebStreamer.utils.metadata import remember_file_id, alias_metadata
+from WebStreamer.utils.peer_cache import peer_cache
+from WebStreamer.utils.file_properties import get_download_link
+from WebStreamer.utils.warmup import warmup_queue
+from WebStreamer.utils.dedup import dedup_index, CanonicalFile
 
 # Media types we want to track
 MEDIA_FILTER = (
@@ -137,6 +141,48 @@ async def get_bot_user_id(client) -> int:
         # Return a fallback based on client id (not ideal but prevents crash)
         return client_id
 
+def index_media(client, message: Message, media) -> None:
+    """Record a posted file in the shared metadata cache and the persistent store"""
+    try:
+        file_id = FileId.decode(media.file_id)
+        setattr(file_id, "file_size", getattr(media, 'file_size', 0))
+        setattr(file_id, "mime_type", getattr(media, 'mime_type', ""))
+        setattr(file_id, "file_name", getattr(media, 'file_name', ""))
+        setattr(file_id, "unique_id", media.file_unique_id)
+        setattr(file_id, "file_id", media.file_id)
+        remember_file_id(message.chat.id, message.id, client.name, file_id)
+        # The update itself proves this client can address the channel
+        peer_cache.mark_seen(client, message.chat.id)
+    except Exception as e:
+        logging.warning(f"Failed to index media of message {message.id}: {e}")
+
+def warm_up_media(client, media) -> None:
+    """Queue the head and tail of a new video or audio file for the chunk cache"""
+    if not warmup_queue.enabled:
+        return
+    mime_type = getattr(media, 'mime_type', None) or ""
+    if not isinstance(media, (Video, Audio)) and not mime_type.startswith(("video/", "audio/")):
+        return
+    try:
+        from WebStreamer.bot import multi_clients
+        from WebStreamer.server.stream_routes import get_streamer
+        index = next((i for i, c in multi_clients.items() if c is client), None)
+        if index is None:
+            return
+        file_id = FileId.decode(media.file_id)
+        setattr(file_id, "file_size", getattr(media, 'file_size', 0))
+        warmup_queue.enqueue(file_id, get_streamer(index), index)
+    except Exception as e:
+        logging.warning(f"Failed to queue warm-up of {media.file_unique_id}: {e}")
+
+async def dedup_media(message: Message, media) -> CanonicalFile:
+    """Map a posted file onto the first message that posted the same file, links point there"""
+    posted = CanonicalFile.from_message(message, media)
+    canonical = await dedup_index.claim("unique", media.file_unique_id, posted)
+    if canonical.locator != posted.locator:
+        alias_metadata(message.chat.id, message.id, canonical.channel_id, canonical.message_id, canonical.file_name)
+    return canonical
+
 async def store_and_reply_to_media(client, message: Message):
     """
     Store media file and reply with DL Link button
@@ -146,6 +192,13 @@ async def store_and_reply_to_media(client, message: Message):
         message: Message containing media
     """
     try:
+        media = message.video or message.audio or message.document
+        canonical = None
+        if media and message.chat:
+            index_media(client, message, media)
+            warm_up_media(client, media)
+            canonical = await dedup_media(message, media)
+        
         # Check if sending links to channels is enabled
         if not Var.SEND_LINKS_TO_CHANNELS:
             logging.debug(f"Skipping link reply - SEND_LINKS_TO_CHANNELS is disabled")
@@ -157,7 +210,6 @@ async def store_and_reply_to_media(client, message: Message):
             return
         
         unique_file_id = media.file_unique_id
-        file_id = media.file_id
         file_name = getattr(media, 'file_name', None) or f"file_{unique_file_id}"
         file_size = getattr(media, 'file_size', 0)
         
@@ -188,13 +240,11 @@ async def store_and_reply_to_media(client, message: Message):
         logging.info(f"Processing {file_type}: {unique_file_id} - Bot {bot_user_id}")
         
         # Generate download link with new format: /dl/unique_file_id/file_id/size/filename
-        fqdn = Var.FQDN
-        if not fqdn:
-            fqdn = "your-domain.com"
-        
-        # URL encode the filename for safe URL usage
-        safe_filename = urllib.parse.quote(file_name, safe='')
-        download_url = f"https://{fqdn}/dl/{unique_file_id}/{file_id}/{file_size}/{safe_filename}"
+        # A duplicate gets the link of its canonical file
+        if canonical is not None:
+            download_url = get_download_link(canonical, canonical.channel_id, canonical.message_id)
+        else:
+            download_url = get_download_link(media, channel_id, message_id)
         
         # Check if message already has buttons (from other bot instances)
         existing_buttons = []
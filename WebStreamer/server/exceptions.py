@@ -3,4 +3,7 @@ class InvalidHash(Exception):
     message = "Invalid hash"
 
 class FileNotFound(Exception):
-    message = "File not found"
\ No newline at end of file
+    message = "File not found"
+
+class PeerIdInvalid(Exception):
+    message = "Peer id invalid"
\ No newline at end of file
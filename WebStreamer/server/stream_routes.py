@@ -1,17 +1,42 @@
 # Simplified streaming routes - no database, no auth, no R2
+import os
 import re
+import json
 import time
+import asyncio
 import math
 import logging
 import secrets
+import hmac
+import hashlib
 import mimetypes
 from aiohttp import web
 from aiohttp.http_exceptions import BadStatusLine
+from pyrogram.errors import LocationInvalid
+from pyrogram.file_id import FileId
 from WebStreamer import bot_loop
-from functools import partial
+from functools import partial, wraps
+from typing import Dict, List, Optional, Tuple
 from WebStreamer.bot import multi_clients, work_loads
 from WebStreamer.server.exceptions import FileNotFound, InvalidHash
 from WebStreamer import Var, utils, StartTime, __version__, StreamBot
+from WebStreamer.utils.metadata import file_metadata, lookup_by_unique_id
+from WebStreamer.utils.cache import LRUCache
+from WebStreamer.utils.chunk_cache import chunk_cache, cache_key
+from WebStreamer.utils.rate_limit import RouteLimiter, dl_limiter, link_limiter, get_client_ip
+from WebStreamer.utils.scheduler import INTERACTIVE, BULK
+from WebStreamer.utils.hedging import hedge_policy
+from WebStreamer.utils.readahead import readahead
+from WebStreamer.utils.warmup import warmup_queue
+from WebStreamer.utils.zipstream import ZipBundle, crc_cache
+from WebStreamer.utils.prefetch import prefetch_jobs
+from WebStreamer.utils.uploader import upload_stream, UploadError, UPLOAD_PART_SIZE
+from WebStreamer.utils.ingest import ingest_jobs
+from WebStreamer.utils.dedup import dedup_index, CanonicalFile
+from WebStreamer.utils.thumbnails import thumbnail_cache, thumbnail_file_id, image_type, MAX_THUMBNAIL_SIZE
+from WebStreamer.utils.media_index import (
+    MediaIndex, buffered_reader, load_media_index, media_indexes, unique_id_of
+)
 from concurrent.futures import ThreadPoolExecutor
 import urllib.parse
 
@@ -100,10 +125,42 @@ async def favicon_handler(_):
     </svg>'''
     return web.Response(body=favicon_svg, content_type="image/svg+xml")
 
+@routes.get("/stats", allow_head=True)
+async def stats_route_handler(request: web.Request):
+    """Expose load and cache statistics as JSON, disabled unless STATS_SECRET is set (sent as a Bearer token)"""
+    denied = bearer_auth_response(request, Var.STATS_SECRET, 'Stats are disabled')
+    if denied:
+        return denied
+    return web.json_response({
+        'version': __version__,
+        'uptime': utils.get_readable_time(time.time() - StartTime),
+        'loads': {f"bot{index + 1}": load for index, load in work_loads.items()},
+        'metadata_cache': file_metadata.stats(),
+        'dl_descriptors': dl_descriptors.stats(),
+        'message_batcher': utils.file_properties.message_batcher.stats(),
+        'peer_cache': utils.peer_cache.peer_cache.stats(),
+        'chunk_cache': chunk_cache.stats(),
+        'rate_limits': {'dl': dl_limiter.stats(), 'link': link_limiter.stats()},
+        'schedulers': {client.name: streamer.scheduler.stats() for client, streamer in class_cache.items()},
+        'hedging': hedge_policy.stats(),
+        'readahead': readahead.stats(),
+        'media_indexes': media_indexes.stats(),
+        'thumbnails': thumbnail_cache.stats(),
+        'bundles': {**bundle_stats, 'crc_cache': crc_cache.stats()},
+        'prefetch': prefetch_jobs.stats(),
+        'ingest': ingest_jobs.stats(),
+        'dedup': dedup_index.stats(),
+        'warmup': warmup_queue.stats(),
+        'streams': stream_stats,
+    })
+
 # Public API to generate download link from channel/message
 @routes.get("/link/{path:.*}", allow_head=True)
 async def link_route_handler(request: web.Request):
     """Generate download link for a file from channel_id/message_id - No auth, no expiry"""
+    limited = rate_limited_response(link_limiter, request, as_json=True)
+    if limited:
+        return limited
     try:
         # eg. path is /link/channelid/messageid
         parts = request.match_info['path'].split("/")
@@ -133,28 +190,9 @@ async def link_route_handler(request: web.Request):
         logging.debug(f"Getting file properties for message {message_id} in channel {channel_id}")
         file_id = await tg_connect.get_file_properties(int(message_id), int(channel_id))
         
-        # Extract file information
-        unique_file_id = file_id.unique_id
-        telegram_file_id = file_id.file_id
-        file_name = file_id.file_name
-        file_size = file_id.file_size
-        mime_type = file_id.mime_type
-        
-        # Build permanent download URL with new format
-        fqdn = Var.FQDN
-        safe_filename = urllib.parse.quote(file_name or 'file', safe='')
-        download_url = f"https://{fqdn}/dl/{unique_file_id}/{telegram_file_id}/{file_size}/{safe_filename}"
-        
         return web.json_response({
             'success': True,
-            'download_url': download_url,
-            'file_info': {
-                'unique_file_id': unique_file_id,
-                'file_name': file_name,
-                'file_size': file_size,
-                'file_size_formatted': str(await formatFileSize(file_size)),
-                'mime_type': mime_type
-            }
+            **await build_link_payload(file_id, channel_id, message_id),
         })
         
     except FileNotFoundError as e:
@@ -172,6 +210,152 @@ async def link_route_handler(request: web.Request):
             'message': error_message
         }, status=500)
 
+@routes.post("/link/batch")
+async def batch_link_route_handler(request: web.Request):
+    """
+    Generate download links for many messages in one call, streamed back as NDJSON.
+    Body is either {"items": [[channel_id, message_id], ...]}
+    or {"channel_id": ..., "start": first_message_id, "end": last_message_id}.
+    """
+    limited = rate_limited_response(link_limiter, request, as_json=True)
+    if limited:
+        return limited
+    try:
+        payload = await request.json()
+        groups = parse_batch_payload(payload)
+    except Exception as e:
+        return web.json_response({
+            'success': False,
+            'error': 'Invalid batch request',
+            'message': str(e)
+        }, status=400)
+
+    total = sum(len(message_ids) for message_ids in groups.values())
+    if total > Var.BATCH_LINK_MAX_ITEMS:
+        return web.json_response({
+            'success': False,
+            'error': f'Too many items ({total}), the limit is {Var.BATCH_LINK_MAX_ITEMS}'
+        }, status=413)
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    for channel_id, message_ids in groups.items():
+        index = min(work_loads, key=work_loads.get)
+        tg_connect = get_streamer(index)
+        try:
+            async for message_id, file_id in tg_connect.iter_file_properties(channel_id, message_ids):
+                if file_id is None:
+                    line = {'channel_id': channel_id, 'message_id': message_id,
+                            'success': False, 'error': 'File not found'}
+                else:
+                    line = {'channel_id': channel_id, 'message_id': message_id,
+                            'success': True, **await build_link_payload(file_id, channel_id, message_id)}
+                await response.write(json.dumps(line).encode() + b"\n")
+        except (ConnectionResetError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            logging.error(f"Error generating batch links for channel {channel_id}: {e}", exc_info=True)
+            line = {'channel_id': channel_id, 'success': False,
+                    'error': 'Internal server error', 'message': str(e)}
+            await response.write(json.dumps(line).encode() + b"\n")
+    await response.write_eof()
+    return response
+
+def parse_batch_payload(payload) -> Dict[int, List[int]]:
+    """Group the (channel, message) pairs of a batch request by channel, keeping their order"""
+    groups: Dict[int, List[int]] = {}
+    if isinstance(payload, dict) and "items" not in payload:
+        channel_id, start, end = int(payload["channel_id"]), int(payload["start"]), int(payload["end"])
+        if end < start:
+            raise ValueError("end must not be smaller than start")
+        if end - start >= Var.BATCH_LINK_MAX_ITEMS:
+            raise ValueError(f"Range is larger than {Var.BATCH_LINK_MAX_ITEMS} messages")
+        groups[channel_id] = list(range(start, end + 1))
+        return groups
+    items = payload["items"] if isinstance(payload, dict) else payload
+    for item in items:
+        if isinstance(item, dict):
+            channel_id, message_id = item["channel_id"], item["message_id"]
+        else:
+            channel_id, message_id = item
+        message_ids = groups.setdefault(int(channel_id), [])
+        if int(message_id) not in message_ids:
+            message_ids.append(int(message_id))
+    return groups
+
+async def build_link_payload(file_id, channel_id=None, message_id=None) -> dict:
+    """Build the download URLs and file info returned by the link APIs"""
+    # Extract file information
+    unique_file_id = file_id.unique_id
+    telegram_file_id = file_id.file_id
+    file_name = file_id.file_name
+    file_size = file_id.file_size
+    mime_type = file_id.mime_type
+    
+    # Build permanent download URL with new format
+    fqdn = Var.FQDN
+    safe_filename = urllib.parse.quote(file_name or 'file', safe='')
+    download_url = f"https://{fqdn}/dl/{unique_file_id}/{telegram_file_id}/{file_size}/{safe_filename}"
+    
+    signed_url = utils.get_token_link(
+        file_id, file_name, file_size, mime_type, channel_id, message_id
+    )
+    
+    return {
+        'download_url': signed_url if Var.SIGNED_LINKS else download_url,
+        'legacy_url': download_url,
+        'signed_url': signed_url,
+        'file_info': {
+            'unique_file_id': unique_file_id,
+            'file_name': file_name,
+            'file_size': file_size,
+            'file_size_formatted': str(await formatFileSize(file_size)),
+            'mime_type': mime_type
+        }
+    }
+
+def rate_limited_response(limiter: RouteLimiter, request: web.Request, as_json: bool = False) -> Optional[web.Response]:
+    """Return a 429 response with Retry-After if the client is over the route's limits, otherwise None"""
+    retry_after = limiter.check(get_client_ip(request))
+    if not retry_after:
+        return None
+    return too_many_requests_response(retry_after, as_json)
+
+def too_many_requests_response(retry_after: float, as_json: bool = False) -> web.Response:
+    """429 response telling the client to retry after `retry_after` seconds"""
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+    if as_json:
+        return web.json_response({
+            'success': False,
+            'error': 'Too many requests'
+        }, status=429, headers=headers)
+    error_page = get_error_page("Rate Limit Exceeded", "Too Many Requests")
+    return web.Response(text=error_page, content_type="text/html", status=429, headers=headers)
+
+def stream_admission(limiter: RouteLimiter):
+    """
+    Decorator for streaming routes: answers 429 while the client is over the route's limits, otherwise
+    holds one of its stream slots until the response is sent. Chunk cache files are sent after the
+    handler returns, so their response takes the slot over and releases it once sent.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request: web.Request):
+            retry_after, slot = limiter.admit(get_client_ip(request))
+            if retry_after:
+                return too_many_requests_response(retry_after)
+            handed_over = False
+            try:
+                response = await handler(request)
+                if isinstance(response, CachedFileResponse):
+                    response.stream_slot, handed_over = slot, True
+                return response
+            finally:
+                if not handed_over:
+                    slot.release()
+        return wrapper
+    return decorator
+
 def get_error_page(error_title, error_message):
     """Generate styled error page matching the home page design"""
     html_content = f'''<html>
@@ -224,176 +408,812 @@ async def safe_yield_file(generator):
         # Connection will be closed and client will see incomplete download
         raise
 
+class DownloadDescriptor:
+    """
+    Parsed form of a /dl URL, cached so Range requests for the same file skip the parsing.
+    attributes:
+        file_id: the decoded FileId with file_size, file_name and mime_type attached.
+        file_name, file_size, mime_type: sanitized file properties.
+        disposition: "inline" for playable media, "attachment" otherwise.
+        headers: prebuilt response headers, without the per-range ones.
+    """
+    __slots__ = ("file_id", "file_name", "file_size", "mime_type", "disposition", "headers")
+
+    def __init__(self, file_id, file_name: str, file_size: int, mime_type: str):
+        # Sanitize header values to prevent HTTP header injection
+        self.mime_type = sanitize_header_value(mime_type) if mime_type else "application/octet-stream"
+        self.file_name = sanitize_header_value(file_name) if file_name else "file"
+        self.file_size = file_size
+        self.file_id = file_id
+        self.disposition = "attachment"
+        if "video/" in self.mime_type or "audio/" in self.mime_type or "/html" in self.mime_type:
+            self.disposition = "inline"
+        self.headers = {
+            "Content-Type": f"{self.mime_type}",
+            "Content-Disposition": f'{self.disposition}; filename="{self.file_name}"',
+            "Accept-Ranges": "bytes",
+        }
+
+# Parsed /dl URLs keyed by their raw path
+dl_descriptors = LRUCache(max_size=Var.DL_DESCRIPTOR_CACHE_SIZE)
+
+async def build_dl_descriptor(request: web.Request):
+    """
+    Parse a /dl URL into a DownloadDescriptor.
+    Returns (descriptor, cacheable), descriptors of files whose size isn't known aren't cacheable.
+    """
+    unique_file_id = request.match_info['unique_file_id']
+    file_id = request.match_info['file_id']
+    size_str = request.match_info['size']
+    filename_encoded = request.match_info['filename']
+    
+    # Decode filename from URL encoding
+    file_name = urllib.parse.unquote(filename_encoded)
+    file_size = int(size_str) if size_str.isdigit() else 0
+    cacheable = True
+    
+    # Decode file_id to get file properties
+    from pyrogram.file_id import FileId
+    file_id_obj = FileId.decode(file_id)
+    
+    # Use metadata from URL path
+    setattr(file_id_obj, "file_size", file_size)
+    setattr(file_id_obj, "file_name", file_name)
+    
+    # Guess mime type from filename
+    mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    setattr(file_id_obj, "mime_type", mime_type)
+    
+    logging.debug(f"Using URL metadata: {file_name} ({file_size} bytes)")
+    
+    # If file_size is 0, resolve the real properties once from the metadata index
+    if file_size == 0:
+        metadata = await lookup_by_unique_id(unique_file_id)
+        if metadata is not None:
+            file_size = metadata.file_size
+            setattr(file_id_obj, "file_size", file_size)
+            if metadata.file_name:
+                file_name = metadata.file_name
+                setattr(file_id_obj, "file_name", file_name)
+            if metadata.mime_type:
+                mime_type = metadata.mime_type
+                setattr(file_id_obj, "mime_type", mime_type)
+            logging.debug(f"Resolved size of {unique_file_id} from the metadata index: {file_size}")
+    
+    # Still unknown: the URL has no message to read it from, so serve up to a default size
+    # and don't cache the descriptor, the index may know the file by the next request
+    if file_size == 0:
+        logging.warning(f"Size of {unique_file_id} is unknown, serving up to the default size")
+        file_size = 1024 * 1024 * 1024  # 1GB default
+        setattr(file_id_obj, "file_size", file_size)
+        cacheable = False
+    
+    return DownloadDescriptor(file_id_obj, file_name, file_size, mime_type), cacheable
+
+async def resolve_descriptor(request: web.Request):
+    """
+    Return the DownloadDescriptor of a /dl or /seek URL, in either form (URL metadata or signed token),
+    or an error response.
+    """
+    if 'token' in request.match_info:
+        try:
+            token = utils.decode_link_token(request.match_info['token'])
+        except InvalidHash:
+            error_page = get_error_page("Invalid or Expired Token", "Link Expired")
+            return web.Response(text=error_page, content_type="text/html", status=410)
+        
+        file_name = urllib.parse.unquote(request.match_info['filename'])
+        mime_type = token.mime_type or mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        setattr(token.file_id, "file_size", token.file_size)
+        return DownloadDescriptor(token.file_id, file_name, token.file_size, mime_type)
+    
+    # /dl and /seek URLs of the same file share the entry
+    cache_key = request.rel_url.raw_path.split("/", 2)[-1]
+    descriptor = dl_descriptors.get(cache_key)
+    if descriptor is None:
+        descriptor, cacheable = await build_dl_descriptor(request)
+        if cacheable:
+            dl_descriptors.set(cache_key, descriptor)
+    return descriptor
+
 @routes.get("/dl/{unique_file_id}/{file_id}/{size}/{filename}", allow_head=True)
+@stream_admission(dl_limiter)
 async def direct_download(request: web.Request):
     """Stream file directly using file_id - metadata from URL path"""
     try:
-        unique_file_id = request.match_info['unique_file_id']
-        file_id = request.match_info['file_id']
-        size_str = request.match_info['size']
-        filename_encoded = request.match_info['filename']
-        
-        # Decode filename from URL encoding
-        file_name = urllib.parse.unquote(filename_encoded)
-        file_size = int(size_str) if size_str.isdigit() else 0
-        
-        logging.debug(f"Download request: {unique_file_id} - {file_name}")
-        
         # Get a client to stream with
         index = min(work_loads, key=work_loads.get)
-        faster_client = multi_clients[index]
-        
-        if faster_client in class_cache:
-            tg_connect = class_cache[faster_client]
-        else:
-            tg_connect = utils.ByteStreamer(faster_client)
-            class_cache[faster_client] = tg_connect
+        descriptor = await resolve_descriptor(request)
+        if isinstance(descriptor, web.Response):
+            return descriptor
         
-        # Decode file_id to get file properties
-        from pyrogram.file_id import FileId
-        file_id_obj = FileId.decode(file_id)
+        logging.debug(f"Download request: {descriptor.file_name} ({descriptor.file_size} bytes)")
+        return await stream_descriptor(request, descriptor, index, get_streamer(index))
         
-        # Use metadata from URL path
-        setattr(file_id_obj, "file_size", file_size)
-        setattr(file_id_obj, "file_name", file_name)
+    except Exception as e:
+        return download_error_response(e)
+
+@routes.get("/dl/{token}/{filename}", allow_head=True)
+@stream_admission(dl_limiter)
+async def token_download(request: web.Request):
+    """Stream file from a signed link token - no FileId decoding or Telegram lookups"""
+    try:
+        # Get a client to stream with
+        index = min(work_loads, key=work_loads.get)
+        descriptor = await resolve_descriptor(request)
+        if isinstance(descriptor, web.Response):
+            return descriptor
+        return await stream_descriptor(request, descriptor, index, get_streamer(index))
         
-        # Guess mime type from filename
-        mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
-        setattr(file_id_obj, "mime_type", mime_type)
+    except Exception as e:
+        return download_error_response(e)
+
+async def get_media_index(descriptor: DownloadDescriptor, index: int, tg_connect) -> MediaIndex:
+    """Return the seek index of a file, parsing its container headers on first use"""
+    file_id = descriptor.file_id
+    
+    async def read(offset: int, length: int) -> bytes:
+        return await tg_connect.read_range(file_id, index, offset, length)
+    
+    return await load_media_index(
+        unique_id_of(file_id), buffered_reader(read), descriptor.file_size, Var.MEDIA_INDEX_MAX_SIZE * 1024 * 1024
+    )
+
+def parse_seek_time(request: web.Request) -> Optional[float]:
+    """The ?t= query parameter in seconds, None if it's missing or invalid"""
+    try:
+        seconds = float(request.query.get("t", ""))
+    except ValueError:
+        return None
+    return seconds if math.isfinite(seconds) and seconds >= 0 else None
+
+@routes.get("/seek/{unique_file_id}/{file_id}/{size}/{filename}")
+@routes.get("/seek/{token}/{filename}")
+async def seek_route_handler(request: web.Request):
+    """Map ?t=seconds to the byte offset of the keyframe at or before it (MP4 and Matroska)"""
+    limited = rate_limited_response(link_limiter, request, as_json=True)
+    if limited:
+        return limited
+    seconds = parse_seek_time(request)
+    if seconds is None:
+        return web.json_response({
+            'success': False,
+            'error': 'Missing or invalid t parameter, use ?t=seconds'
+        }, status=400)
+    try:
+        index = min(work_loads, key=work_loads.get)
+        tg_connect = get_streamer(index)
+        descriptor = await resolve_descriptor(request)
+        if isinstance(descriptor, web.Response):
+            return web.json_response({
+                'success': False,
+                'error': 'Link expired'
+            }, status=descriptor.status)
         
-        logging.debug(f"Using URL metadata: {file_name} ({file_size} bytes)")
+        media_index = await get_media_index(descriptor, index, tg_connect)
+        if not media_index:
+            return web.json_response({
+                'success': False,
+                'error': 'File has no seek index (only MP4 and Matroska files are supported)'
+            }, status=422)
         
-        # If file_size is 0, we need to get it from Telegram
-        if file_size == 0:
-            try:
-                message = await faster_client.get_messages(file_id_obj.chat_id, file_id_obj.message_id)
-                media = message.video or message.audio or message.document
-                if media:
-                    file_size = media.file_size
-                    setattr(file_id_obj, "file_size", file_size)
-                    if hasattr(media, 'file_name') and media.file_name:
-                        setattr(file_id_obj, "file_name", media.file_name)
-                        file_name = media.file_name
-                    if hasattr(media, 'mime_type') and media.mime_type:
-                        setattr(file_id_obj, "mime_type", media.mime_type)
-                        mime_type = media.mime_type
-            except Exception as tg_error:
-                error_str = str(tg_error)
-                logging.warning(f"Failed to get file info from Telegram: {error_str}")
-                
-                # Check for specific Telegram errors
-                if "FILE_REFERENCE" in error_str and "EXPIRED" in error_str:
-                    error_page = get_error_page("File Reference Expired", "Link Expired")
-                    return web.Response(text=error_page, content_type="text/html", status=410)
-                elif "FLOOD_WAIT" in error_str:
-                    error_page = get_error_page("Rate Limit Exceeded", "Too Many Requests")
-                    return web.Response(text=error_page, content_type="text/html", status=429)
-                elif "FILE_ID_INVALID" in error_str or "FILE_REFERENCE_INVALID" in error_str:
-                    error_page = get_error_page("Invalid File Reference", "Link Expired")
-                    return web.Response(text=error_page, content_type="text/html", status=410)
-                
-                # For other errors, use default size
-                file_size = 1024 * 1024 * 1024  # 1GB default
-                setattr(file_id_obj, "file_size", file_size)
+        keyframe, offset = media_index.seek(seconds)
+        return web.json_response({
+            'success': True,
+            **media_index.to_dict(),
+            'time': keyframe,
+            'offset': offset,
+            'range': f"bytes={offset}-",
+            'url': f"/dl/{request.rel_url.raw_path.split('/', 2)[-1]}?t={seconds:g}",
+        })
         
-        # Handle range requests
-        range_header = request.headers.get("Range", 0)
-        if range_header:
-            from_bytes, until_bytes = range_header.replace("bytes=", "").split("-")
-            from_bytes = int(from_bytes)
-            until_bytes = int(until_bytes) if until_bytes else file_size - 1
+    except Exception as e:
+        error_message = str(e)
+        logging.error(f"Error seeking: {error_message}", exc_info=True)
+        return web.json_response({
+            'success': False,
+            'error': 'Internal server error',
+            'message': error_message
+        }, status=500)
+
+@routes.get("/thumb/{unique_file_id}/{file_id}", allow_head=True)
+@routes.get("/thumb/{token}", allow_head=True)
+async def thumbnail_handler(request: web.Request):
+    """Serve the Telegram thumbnail of a media file, ?size= picks the thumbnail (default m, 320px)"""
+    size = request.query.get("size", "m")
+    try:
+        if 'token' in request.match_info:
+            file_id = utils.decode_link_token(request.match_info['token']).file_id
         else:
-            from_bytes = request.http_range.start or 0
-            until_bytes = (request.http_range.stop or file_size) - 1
-        
-        if (until_bytes > file_size) or (from_bytes < 0) or (until_bytes < from_bytes):
-            error_page = get_error_page("Range Not Satisfiable", "Invalid Request Range")
-            return web.Response(
-                text=error_page,
-                content_type="text/html",
-                status=416,
-                headers={"Content-Range": f"bytes */{file_size}"},
-            )
-        
-        chunk_size = 1024 * 1024
-        until_bytes = min(until_bytes, file_size - 1)
-        
-        offset = from_bytes - (from_bytes % chunk_size)
-        first_part_cut = from_bytes - offset
-        last_part_cut = until_bytes % chunk_size + 1
-        
-        req_length = until_bytes - from_bytes + 1
-        part_count = math.ceil(until_bytes / chunk_size) - math.floor(offset / chunk_size)
-        
-        # Skip pre-validation - file info (fileId, name, size) is already in URL path
-        # Validation will happen during actual streaming, errors are handled in safe_yield_file
-        logging.debug(f"Starting stream for file: {file_name} (size: {file_size})")
-        
-        # Get the file generator
-        file_generator = tg_connect.yield_file(
-            file_id_obj, index, offset, first_part_cut, last_part_cut, part_count, chunk_size
-        )
-        
-        # Wrap it with error handling
-        body = safe_yield_file(file_generator)
-        
-        disposition = "attachment"
-        
-        # Sanitize header values to prevent HTTP header injection
-        mime_type = sanitize_header_value(mime_type) if mime_type else "application/octet-stream"
-        file_name = sanitize_header_value(file_name) if file_name else "file"
+            file_id = FileId.decode(request.match_info['file_id'])
+    except InvalidHash:
+        error_page = get_error_page("Invalid or Expired Token", "Link Expired")
+        return web.Response(text=error_page, content_type="text/html", status=410)
+    except Exception:
+        error_page = get_error_page("Invalid File ID", "Invalid Request")
+        return web.Response(text=error_page, content_type="text/html", status=400)
+    
+    thumbnail_id = thumbnail_file_id(file_id, size)
+    if thumbnail_id is None:
+        error_page = get_error_page("Invalid Thumbnail Size", "Invalid Request")
+        return web.Response(text=error_page, content_type="text/html", status=400)
+    
+    # A thumbnail never changes, so browsers and CDNs may keep it forever
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{file_id.dc_id}-{file_id.media_id}-{size}"',
+    }
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        return web.Response(status=304, headers=headers)
+    
+    try:
+        index = min(work_loads, key=work_loads.get)
+        tg_connect = get_streamer(index)
         
-        if "video/" in mime_type or "audio/" in mime_type or "/html" in mime_type:
-            disposition = "inline"
+        async def fetch() -> bytes:
+            try:
+                return await tg_connect.read_range(thumbnail_id, index, 0, MAX_THUMBNAIL_SIZE, INTERACTIVE)
+            except LocationInvalid:
+                # The file has no thumbnail of this size, remembered as an empty entry
+                return b""
         
-        logging.debug(f"Streaming: {file_name}")
+        data = await thumbnail_cache.get_or_fetch((file_id.dc_id, file_id.media_id, size), fetch)
+        if not data:
+            error_page = get_error_page("Thumbnail Not Found", "No Preview Available")
+            return web.Response(text=error_page, content_type="text/html", status=404)
+        return web.Response(body=data, content_type=image_type(data), headers=headers)
         
+    except Exception as e:
+        return download_error_response(e)
+
+def parse_link_items(items) -> List[Tuple[str, str]]:
+    """
+    (token, file name) pairs of a bundle or prefetch request. An item is a signed /dl URL,
+    "token/filename", or {"token": ..., "name": ...}.
+    """
+    pairs = []
+    for item in items:
+        if isinstance(item, dict):
+            token, name = item["token"], item.get("name") or "file"
+        else:
+            path = urllib.parse.urlsplit(str(item)).path.strip("/").split("/")
+            token, name = (path[-2], path[-1]) if len(path) >= 2 else (path[-1], "file")
+        pairs.append((str(token), urllib.parse.unquote(str(name))))
+    return pairs
+
+@routes.get("/bundle/{name}", allow_head=True)
+@routes.post("/bundle/{name}")
+@stream_admission(dl_limiter)
+async def bundle_handler(request: web.Request):
+    """
+    Stream several files as one stored ZIP64 archive, with an exact Content-Length and Range support.
+    Files are passed as repeated ?f=token/filename parameters, or as {"files": [...]} in a POST body.
+    """
+    try:
+        if request.method == "POST":
+            payload = await request.json()
+            items = payload.get("files", []) if isinstance(payload, dict) else payload
+        else:
+            items = request.query.getall("f", [])
+        pairs = parse_link_items(items)
+    except Exception:
+        error_page = get_error_page("Invalid Bundle Request", "Invalid Request")
+        return web.Response(text=error_page, content_type="text/html", status=400)
+    if not pairs or len(pairs) > Var.BUNDLE_MAX_FILES:
+        error_page = get_error_page(f"A bundle holds 1 to {Var.BUNDLE_MAX_FILES} files", "Invalid Request")
+        return web.Response(text=error_page, content_type="text/html", status=400)
+    
+    files = []
+    for token_string, file_name in pairs:
+        try:
+            token = utils.decode_link_token(token_string)
+        except InvalidHash:
+            error_page = get_error_page("Invalid or Expired Token", "Link Expired")
+            return web.Response(text=error_page, content_type="text/html", status=410)
+        setattr(token.file_id, "file_size", token.file_size)
+        files.append((file_name, token.file_id, token.file_size))
+    bundle = ZipBundle(files)
+    
+    # The archive is the same bytes on every request, so its layout identifies it for If-Range
+    layout = "\n".join(f"{e.file_id.dc_id}:{e.file_id.media_id}:{e.size}:{e.name}" for e in bundle.entries)
+    etag = f'"{hashlib.sha256(layout.encode()).hexdigest()[:32]}"'
+    range_header = request.headers.get("Range")
+    if range_header and request.headers.get("If-Range", etag) != etag:
+        range_header = None
+    from_bytes, until_bytes = 0, bundle.size - 1
+    if range_header:
+        try:
+            http_range = request.http_range
+        except ValueError:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{bundle.size}"})
+        from_bytes = http_range.start or 0
+        if from_bytes < 0:
+            from_bytes = max(0, bundle.size + from_bytes)
+        until_bytes = min(bundle.size, http_range.stop or bundle.size) - 1
+        if from_bytes > until_bytes:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{bundle.size}"})
+    
+    bundle_name = sanitize_header_value(urllib.parse.unquote(request.match_info['name'])) or "bundle"
+    if not bundle_name.lower().endswith(".zip"):
+        bundle_name += ".zip"
+    headers = {
+        "Content-Type": "application/zip",
+        "Content-Disposition": f'attachment; filename="{bundle_name}"',
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(until_bytes - from_bytes + 1),
+        "ETag": etag,
+    }
+    if range_header:
+        headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{bundle.size}"
+    response = web.StreamResponse(status=206 if range_header else 200, headers=headers)
+    await response.prepare(request)
+    if request.method == "HEAD":
+        return response
+    
+    index = min(work_loads, key=work_loads.get)
+    tg_connect = get_streamer(index)
+    
+    def read(file_id, start: int, end: int):
+        return tg_connect.yield_file(file_id, index, start, end, BULK)
+    
+    body = dl_limiter.throttle(bundle.stream(from_bytes, until_bytes, read))
+    try:
+        async for chunk in body:
+            await response.write(chunk)
+        bundle_stats["completed"] += 1
+    except (ConnectionResetError, asyncio.CancelledError):
+        bundle_stats["disconnected"] += 1
+        raise
+    except Exception as e:
+        # Headers are out already, the client sees a truncated download
+        bundle_stats["failed"] += 1
+        logging.error(f"Error streaming bundle {bundle_name}: {e}", exc_info=True)
+        response.force_close()
+    finally:
+        await body.aclose()
+    return response
+
+def has_bearer_token(request: web.Request, secret: str) -> bool:
+    """True if the request carries "Authorization: Bearer <secret>" """
+    authorization = request.headers.get("Authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), secret.encode())
+
+def bearer_auth_response(request: web.Request, secret: str, disabled: str) -> Optional[web.Response]:
+    """Error response if the route is disabled (no secret configured) or the request lacks the Bearer token"""
+    if not secret:
+        return web.json_response({'success': False, 'error': disabled}, status=404)
+    if not has_bearer_token(request, secret):
+        return web.json_response({'success': False, 'error': 'Unauthorized'}, status=401)
+    return None
+
+@routes.post("/prefetch")
+async def prefetch_submit_handler(request: web.Request):
+    """
+    Queue signed links to be pulled whole into the chunk cache, disabled unless PREFETCH_SECRET is set.
+    Body is {"files": [...]} with items as in /bundle, or a single {"token": ..., "name": ...}.
+    """
+    denied = bearer_auth_response(request, Var.PREFETCH_SECRET, 'Prefetch is disabled')
+    if denied:
+        return denied
+    limited = rate_limited_response(link_limiter, request, as_json=True)
+    if limited:
+        return limited
+    try:
+        payload = await request.json()
+        items = payload.get("files", [payload]) if isinstance(payload, dict) else payload
+        pairs = parse_link_items(items)
+    except Exception as e:
+        return web.json_response({
+            'success': False,
+            'error': 'Invalid prefetch request',
+            'message': str(e)
+        }, status=400)
+    
+    jobs = []
+    for token_string, file_name in pairs:
+        try:
+            token = utils.decode_link_token(token_string)
+            setattr(token.file_id, "file_size", token.file_size)
+            job = prefetch_jobs.submit(token.file_id, file_name)
+        except InvalidHash:
+            return web.json_response({'success': False, 'error': 'Invalid or expired token'}, status=410)
+        except RuntimeError as e:
+            return web.json_response({'success': False, 'error': str(e)}, status=503)
+        except ValueError as e:
+            return web.json_response({'success': False, 'error': str(e)}, status=400)
+        jobs.append({**job.status(), 'status_url': f"/prefetch/{job.job_id}"})
+    return web.json_response({'success': True, 'jobs': jobs}, status=202)
+
+@routes.get("/prefetch/{job_id}", allow_head=True)
+async def prefetch_status_handler(request: web.Request):
+    """Progress of a prefetch job"""
+    job = prefetch_jobs.get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({'success': False, 'error': 'Job not found'}, status=404)
+    return web.json_response({'success': True, **job.status()})
+
+def upload_auth_response(request: web.Request) -> Optional[web.Response]:
+    """Error response if uploads are disabled or the request lacks the UPLOAD_SECRET Bearer token"""
+    return bearer_auth_response(request, Var.UPLOAD_SECRET, 'Uploads are disabled')
+
+async def multipart_file(request: web.Request):
+    """First file field of a multipart form, with its name and content type"""
+    reader = await request.multipart()
+    while True:
+        field = await reader.next()
+        if field is None:
+            raise ValueError("The form has no file")
+        if field.filename:
+            return field, field.filename, field.headers.get("Content-Type", "")
+
+async def iter_field(field):
+    while True:
+        chunk = await field.read_chunk(UPLOAD_PART_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+@routes.post("/upload")
+async def upload_handler(request: web.Request):
+    """
+    Upload a file into BIN_CHANNEL and return its DL link. The body is streamed to Telegram as it arrives.
+    It is either the raw file, named by ?name= or X-File-Name, or a multipart form with one file field.
+    A file already uploaded before gets the link of the first copy. If the request announces the SHA-256
+    of a known file in X-Content-SHA256, the body is only hashed to check it and isn't uploaded again.
+    """
+    denied = upload_auth_response(request)
+    if denied:
+        return denied
+    started = time.time()
+    announced_sha256 = request.headers.get("X-Content-SHA256", "").strip().lower()
+    known = None
+    if re.fullmatch(r"[0-9a-f]{64}", announced_sha256):
+        known = await dedup_index.lookup("sha256", announced_sha256)
+    max_size = Var.UPLOAD_MAX_SIZE * 1024 * 1024
+    try:
+        if request.content_type.startswith("multipart/"):
+            field, file_name, mime_type = await multipart_file(request)
+            chunks, file_size = iter_field(field), None
+        else:
+            file_name = request.query.get("name") or request.headers.get("X-File-Name", "")
+            mime_type = request.content_type if request.content_type != "application/octet-stream" else ""
+            chunks, file_size = request.content.iter_chunked(UPLOAD_PART_SIZE), request.content_length
+        file_name = os.path.basename(urllib.parse.unquote(file_name)).strip()
+        if not file_name:
+            raise ValueError("The file name is missing")
+        if file_size == 0:
+            raise ValueError("The file is empty")
+    except ValueError as e:
+        return web.json_response({'success': False, 'error': str(e)}, status=400)
+    if file_size is not None and file_size > max_size:
+        return web.json_response({'success': False, 'error': 'File too large'}, status=413)
+    mime_type = mime_type or mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+
+    content_hash = hashlib.sha256()
+
+    async def limited(chunks):
+        received = 0
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > max_size:
+                raise UploadError("File too large")
+            content_hash.update(chunk)
+            yield chunk
+
+    if known is not None:
+        # Answering with the known file needs proof that the uploader has its bytes
+        try:
+            async for _ in limited(chunks):
+                pass
+        except UploadError as e:
+            return web.json_response({'success': False, 'error': str(e)}, status=413)
+        if not hmac.compare_digest(content_hash.hexdigest(), announced_sha256):
+            return web.json_response({'success': False, 'error': "X-Content-SHA256 doesn't match the file"}, status=400)
+        return upload_response(known, announced_sha256, True, started)
+
+    try:
+        message = await upload_stream(limited(chunks), file_name, file_size, mime_type)
+    except UploadError as e:
+        logging.warning(f"Upload of {file_name} failed: {e}")
+        return web.json_response({'success': False, 'error': str(e)}, status=413 if str(e) == "File too large" else 400)
+    except Exception as e:
+        logging.error(f"Upload of {file_name} failed: {e}", exc_info=True)
+        return web.json_response({'success': False, 'error': 'Upload failed', 'message': str(e)}, status=502)
+    uploaded = CanonicalFile.from_message(message)
+    sha256 = content_hash.hexdigest()
+    canonical = await dedup_index.claim("sha256", sha256, uploaded)
+    return upload_response(canonical, sha256, canonical.locator != uploaded.locator, started)
+
+def upload_response(canonical: CanonicalFile, sha256: str, duplicate: bool, started: float) -> web.Response:
+    return web.json_response({
+        'success': True,
+        'link': utils.get_download_link(canonical, canonical.channel_id, canonical.message_id),
+        'file_name': canonical.file_name,
+        'file_size': canonical.file_size,
+        'mime_type': canonical.mime_type,
+        'unique_id': canonical.file_unique_id,
+        'message_id': canonical.message_id,
+        'sha256': sha256,
+        'duplicate': duplicate,
+        'upload_time': round(time.time() - started, 2),
+    })
+
+@routes.post("/ingest")
+async def ingest_submit_handler(request: web.Request):
+    """Mirror a remote URL into BIN_CHANNEL in the background, body is {"url": ..., "name": optional}"""
+    denied = upload_auth_response(request)
+    if denied:
+        return denied
+    try:
+        payload = await request.json()
+        job = ingest_jobs.submit(str(payload["url"]), str(payload.get("name") or ""))
+    except (ValueError, KeyError, TypeError) as e:
+        return web.json_response({
+            'success': False,
+            'error': 'Invalid ingest request',
+            'message': str(e)
+        }, status=400)
+    return web.json_response({'success': True, **job.status(), 'status_url': f"/ingest/{job.job_id}"}, status=202)
+
+@routes.get("/ingest/{job_id}", allow_head=True)
+async def ingest_status_handler(request: web.Request):
+    """Progress of an ingest job, with the DL link once it's done"""
+    job = ingest_jobs.get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({'success': False, 'error': 'Job not found'}, status=404)
+    return web.json_response({'success': True, **job.status()})
+
+@routes.post("/ingest/{job_id}/resume")
+async def ingest_resume_handler(request: web.Request):
+    """Retry a failed ingest job after its last acknowledged part"""
+    denied = upload_auth_response(request)
+    if denied:
+        return denied
+    try:
+        job = ingest_jobs.resume(request.match_info['job_id'])
+    except KeyError:
+        return web.json_response({'success': False, 'error': 'Job not found'}, status=404)
+    except ValueError as e:
+        return web.json_response({'success': False, 'error': str(e)}, status=409)
+    return web.json_response({'success': True, **job.status()}, status=202)
+
+async def stream_descriptor(request: web.Request, descriptor: DownloadDescriptor, index: int, tg_connect):
+    """Answer a (Range) request for a resolved file"""
+    file_size = descriptor.file_size
+    
+    # Handle range requests
+    range_header = request.headers.get("Range", 0)
+    if range_header:
+        from_bytes, until_bytes = range_header.replace("bytes=", "").split("-")
+        from_bytes = int(from_bytes)
+        until_bytes = int(until_bytes) if until_bytes else file_size - 1
+    else:
+        from_bytes = request.http_range.start or 0
+        until_bytes = (request.http_range.stop or file_size) - 1
+    
+    if (until_bytes > file_size) or (from_bytes < 0) or (until_bytes < from_bytes):
+        error_page = get_error_page("Range Not Satisfiable", "Invalid Request Range")
         return web.Response(
-            status=206 if range_header else 200,
-            body=body,
-            headers={
-                "Content-Type": f"{mime_type}",
-                "Content-Range": f"bytes {from_bytes}-{until_bytes}/{file_size}",
-                "Content-Length": str(req_length),
-                "Content-Disposition": f'{disposition}; filename="{file_name}"',
-                "Accept-Ranges": "bytes",
-            },
+            text=error_page,
+            content_type="text/html",
+            status=416,
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+    
+    until_bytes = min(until_bytes, file_size - 1)
+    
+    # ?t=seconds starts at the keyframe at or before that time, for players that can't seek by bytes
+    seek_time = parse_seek_time(request) if not range_header else None
+    if seek_time is not None:
+        media_index = await get_media_index(descriptor, index, tg_connect)
+        if media_index:
+            from_bytes = min(media_index.seek(seek_time)[1], until_bytes)
+        else:
+            seek_time = None
+    req_length = until_bytes - from_bytes + 1
+    
+    # Sequential players get their next parts fetched into the chunk cache while this one is sent
+    if request.method != "HEAD":
+        readahead.observe(
+            get_client_ip(request), descriptor.file_id, file_size, from_bytes, until_bytes, tg_connect, index
+        )
+    
+    # Ranges that are fully on local disk never go through Python (the file response only knows the Range header).
+    # With a bandwidth ceiling they're streamed below instead, yield_file reads their parts from the cache
+    cached_path = None
+    if seek_time is None and not dl_limiter.bandwidth:
+        cached_path = chunk_cache.covered_path(descriptor.file_id, file_size, from_bytes, until_bytes)
+    if cached_path:
+        return serve_cached_file(descriptor, cached_path)
+    
+    # Skip pre-validation - file info (fileId, name, size) is already in URL path
+    # Validation will happen during actual streaming, errors are handled in safe_yield_file
+    logging.debug(f"Starting stream for file: {descriptor.file_name} (size: {file_size})")
+    
+    headers = dict(descriptor.headers)
+    headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
+    headers["Content-Length"] = str(req_length)
+    
+    response = web.StreamResponse(status=206 if range_header or seek_time is not None else 200, headers=headers)
+    await response.prepare(request)
+    if request.method == "HEAD":
+        return response
+    
+    # Get the file generator, inline playback goes ahead of attachment downloads for GetFile slots
+    priority = INTERACTIVE if descriptor.disposition == "inline" else BULK
+    file_generator = tg_connect.yield_file(descriptor.file_id, index, from_bytes, until_bytes, priority)
+    
+    # Readers that drain slower than SLOW_READER_RATE are moved off the live generator (and out of
+    # work_loads) onto the chunk cache, which a background task fills at full speed
+    slow_reader = {"detected": False}
+    
+    async def source():
+        position = from_bytes
+        async for chunk in file_generator:
+            yield chunk
+            position += len(chunk)
+            if slow_reader["detected"]:
+                break
+        else:
+            return
+        await file_generator.aclose()
+        stream_stats["slow_readers"] += 1
+        logging.debug(f"Slow reader on {descriptor.file_name}, serving it from the chunk cache")
+        buffered = tg_connect.yield_buffered(
+            descriptor.file_id, index, position, until_bytes, Var.SLOW_READER_WINDOW, priority
         )
-        
-    except Exception as e:
-        error_str = str(e)
-        logging.error(f"Error in direct_download: {error_str}", exc_info=True)
-        
-        # Handle specific Telegram errors with styled pages
         try:
-            # Check for pyrogram errors
-            if hasattr(e, '__class__') and hasattr(e.__class__, '__name__'):
-                error_class = e.__class__.__name__
-                
-                if "FileReferenceExpired" in error_class or "FILE_REFERENCE" in error_str:
-                    error_page = get_error_page("File Reference Expired", "Link Expired")
-                    return web.Response(text=error_page, content_type="text/html", status=410)
-                elif "FloodWait" in error_class or "FLOOD_WAIT" in error_str:
-                    error_page = get_error_page("Rate Limit Exceeded", "Too Many Requests")
-                    return web.Response(text=error_page, content_type="text/html", status=429)
-                elif "FileIdInvalid" in error_class or "FILE_ID_INVALID" in error_str:
-                    error_page = get_error_page("Invalid File ID", "Link Expired")
-                    return web.Response(text=error_page, content_type="text/html", status=410)
-                elif "ChannelPrivate" in error_class or "CHANNEL_PRIVATE" in error_str:
-                    error_page = get_error_page("Access Denied", "File Not Available")
-                    return web.Response(text=error_page, content_type="text/html", status=403)
-                elif "MessageIdInvalid" in error_class or "MESSAGE_ID_INVALID" in error_str:
-                    error_page = get_error_page("Message Not Found", "Link Expired")
-                    return web.Response(text=error_page, content_type="text/html", status=410)
-        except:
-            pass
-        
-        # Generic error page for other exceptions
-        error_page = get_error_page("Service Error", "Failed to Stream File")
-        return web.Response(text=error_page, content_type="text/html", status=500)
+            async for chunk in buffered:
+                yield chunk
+        finally:
+            await buffered.aclose()
+    
+    # Wrap it with error handling and the bandwidth ceiling
+    switchable = source()
+    guarded = safe_yield_file(switchable)
+    body = dl_limiter.throttle(guarded)
+    
+    async def pump():
+        sent = 0
+        write_time = 0.0
+        detect = Var.SLOW_READER_RATE > 0 and chunk_cache.enabled
+        async for chunk in body:
+            if not detect:
+                await response.write(chunk)
+                continue
+            # Written in slices, a whole part sitting in the send buffer would hide a slow client for minutes
+            for start in range(0, len(chunk), SLOW_READER_SLICE):
+                piece = chunk[start:start + SLOW_READER_SLICE]
+                started = time.monotonic()
+                await response.write(piece)
+                write_time += time.monotonic() - started
+                sent += len(piece)
+                # Only time spent waiting for the client to drain counts, not waiting on Telegram
+                if detect and write_time >= Var.SLOW_READER_GRACE and sent / write_time < Var.SLOW_READER_RATE * 1024:
+                    slow_reader["detected"] = True
+                    detect = False
+    
+    pump_task = asyncio.ensure_future(pump())
+    try:
+        # aiohttp doesn't cancel handlers when the client goes away, so watch the transport
+        # and cancel the in-flight GetFile (and its hedge) as soon as the viewer disconnects
+        while not pump_task.done():
+            await asyncio.wait({pump_task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if not pump_task.done() and client_disconnected(request):
+                pump_task.cancel()
+                await asyncio.wait({pump_task})
+        pump_task.result()
+        await response.write_eof()
+        stream_stats["completed"] += 1
+    except (ConnectionResetError, asyncio.CancelledError) as e:
+        handler_cancelled = isinstance(e, asyncio.CancelledError) and not pump_task.cancelled()
+        if not handler_cancelled or client_disconnected(request):
+            stream_stats["disconnected"] += 1
+            logging.debug(f"Client disconnected while streaming {descriptor.file_name}")
+            readahead.cancel(get_client_ip(request), descriptor.file_id)
+        if handler_cancelled:
+            # aiohttp cancelled the handler itself (lost connection or shutdown)
+            raise
+        response.force_close()
+    except Exception:
+        # Already logged by safe_yield_file, the headers are out so the connection can only be dropped
+        stream_stats["failed"] += 1
+        response.force_close()
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+            await asyncio.wait({pump_task})
+        # Close the generators now instead of whenever they're garbage collected, so
+        # work_loads is released immediately
+        for generator in (body, guarded, switchable, file_generator):
+            await generator.aclose()
+    return response
+
+def client_disconnected(request: web.Request) -> bool:
+    transport = request.transport
+    return transport is None or transport.is_closing()
+
+class CachedFileResponse(web.FileResponse):
+    """
+    File response for a chunk cache data file, the file can't be evicted while it's being opened and sent.
+    The client's stream slot, handed over by stream_admission, is held until then as well.
+    """
+
+    def __init__(self, key: str, path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        self.cache_key = key
+        self.stream_slot = None
+
+    async def prepare(self, request: web.BaseRequest):
+        try:
+            with chunk_cache.pinned(self.cache_key):
+                return await super().prepare(request)
+        finally:
+            if self.stream_slot is not None:
+                self.stream_slot.release()
+
+def serve_cached_file(descriptor: DownloadDescriptor, path: str) -> web.StreamResponse:
+    """
+    Answer a request from the chunk cache with sendfile, or hand it to nginx with
+    X-Accel-Redirect when ACCEL_REDIRECT_PREFIX is set. Both handle the Range header themselves.
+    """
+    logging.debug(f"Serving {descriptor.file_name} from the chunk cache")
+    if Var.ACCEL_REDIRECT_PREFIX:
+        headers = dict(descriptor.headers)
+        headers["X-Accel-Redirect"] = Var.ACCEL_REDIRECT_PREFIX + os.path.basename(path)
+        return web.Response(headers=headers)
+    return CachedFileResponse(cache_key(descriptor.file_id), path, headers=descriptor.headers)
+
+def download_error_response(e: Exception) -> web.Response:
+    """Map an exception raised while preparing a download to a styled error page"""
+    error_str = str(e)
+    logging.error(f"Error in download: {error_str}", exc_info=True)
+    
+    # Handle specific Telegram errors with styled pages
+    try:
+        # Check for pyrogram errors
+        if hasattr(e, '__class__') and hasattr(e.__class__, '__name__'):
+            error_class = e.__class__.__name__
+            
+            if "FileReferenceExpired" in error_class or "FILE_REFERENCE" in error_str:
+                error_page = get_error_page("File Reference Expired", "Link Expired")
+                return web.Response(text=error_page, content_type="text/html", status=410)
+            elif "FloodWait" in error_class or "FLOOD_WAIT" in error_str:
+                error_page = get_error_page("Rate Limit Exceeded", "Too Many Requests")
+                return web.Response(text=error_page, content_type="text/html", status=429)
+            elif "FileIdInvalid" in error_class or "FILE_ID_INVALID" in error_str:
+                error_page = get_error_page("Invalid File ID", "Link Expired")
+                return web.Response(text=error_page, content_type="text/html", status=410)
+            elif "ChannelPrivate" in error_class or "CHANNEL_PRIVATE" in error_str:
+                error_page = get_error_page("Access Denied", "File Not Available")
+                return web.Response(text=error_page, content_type="text/html", status=403)
+            elif "MessageIdInvalid" in error_class or "MESSAGE_ID_INVALID" in error_str:
+                error_page = get_error_page("Message Not Found", "Link Expired")
+                return web.Response(text=error_page, content_type="text/html", status=410)
+    except:
+        pass
+    
+    # Generic error page for other exceptions
+    error_page = get_error_page("Service Error", "Failed to Stream File")
+    return web.Response(text=error_page, content_type="text/html", status=500)
 
 class_cache = {}
 
+# How often a stream waiting on Telegram checks whether its client is still connected (seconds)
+DISCONNECT_POLL_INTERVAL = 1.0
+stream_stats = {"completed": 0, "disconnected": 0, "failed": 0, "slow_readers": 0}
+bundle_stats = {"completed": 0, "disconnected": 0, "failed": 0}
+# Bytes written at a time while a stream's drain rate is being measured
+SLOW_READER_SLICE = 64 * 1024
+
+def get_streamer(index: int) -> "utils.ByteStreamer":
+    """Return the cached ByteStreamer of a client, creating it on first use"""
+    client = multi_clients[index]
+    if client not in class_cache:
+        class_cache[client] = utils.ByteStreamer(client)
+    return class_cache[client]
+
 async def formatFileSize(bytes_size: int) -> str:
     """Format file size in human readable format"""
     if bytes_size == 0:
@@ -4,7 +4,7 @@
 from .keepalive import ping_server
 from .config_parser import TokenParser
 from .time_format import get_readable_time
-from .file_properties import get_hash, get_name
+from .file_properties import get_hash, get_name, get_download_link
 from .custom_dl import ByteStreamer
-from .cryptography import verify_sha256_key, decrypt
+from .cryptography import verify_sha256_key, decrypt, encode_link_token, decode_link_token, get_token_link
 from .github_utils import upload_to_github, download_from_github
@@ -0,0 +1,220 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A bounded LRU cache with an optional per-entry TTL.
+
+    attributes:
+        max_size: maximum number of entries kept before the least recently used one is evicted.
+        ttl: seconds an entry stays fresh (0 disables expiry).
+
+    Entries that are past their TTL are treated as misses and dropped on access.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 0):
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, list]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._is_expired(entry)
+
+    def _is_expired(self, entry: list, now: Optional[float] = None) -> bool:
+        if not self.ttl:
+            return False
+        return (now or time.monotonic()) - entry[1] > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or self._is_expired(entry):
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Returns an entry without touching its recency or the statistics."""
+        entry = self._data.get(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = [value, time.monotonic()]
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class MetadataCache(LRUCache):
+    """
+    LRU+TTL cache for file metadata with stale-while-revalidate refresh.
+
+    attributes:
+        max_size: maximum number of entries.
+        ttl: seconds an entry is served as fresh.
+        stale_ttl: extra seconds an expired entry may still be served while it's refreshed in the background.
+
+    functions:
+        get_or_load: returns the cached value or awaits the loader, refreshing stale entries in the background.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 1800, stale_ttl: float = 600):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.stale_ttl = stale_ttl
+        self.stale_hits = 0
+        self.refreshes = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def _age(self, entry: list) -> float:
+        return time.monotonic() - entry[1]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        # Plain lookups also honour the stale window, refreshing is left to get_or_load
+        entry = self._data.get(key)
+        if entry is None or (self.ttl and self._age(entry) > self.ttl + self.stale_ttl):
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the value for key, calling loader on a miss.
+        Concurrent misses for the same key share a single loader call, and entries
+        inside the stale window are returned immediately while a refresh runs in the background.
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            age = self._age(entry)
+            if not self.ttl or age <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if age <= self.ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self.refreshes += 1
+                    self._start_load(key, loader).add_done_callback(self._consume_result)
+                return entry[0]
+            del self._data[key]
+
+        self.misses += 1
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._start_load(key, loader)
+        return await asyncio.shield(future)
+
+    def _start_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        future = asyncio.ensure_future(loader())
+        self._inflight[key] = future
+
+        def _store(fut: asyncio.Future):
+            self._inflight.pop(key, None)
+            if not fut.cancelled() and fut.exception() is None and fut.result() is not None:
+                self.set(key, fut.result())
+
+        future.add_done_callback(_store)
+        return future
+
+    @staticmethod
+    def _consume_result(fut: asyncio.Future) -> None:
+        # Background refreshes keep serving the stale value if they fail
+        if not fut.cancelled() and fut.exception() is not None:
+            logging.debug(f"Background metadata refresh failed: {fut.exception()}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({
+            "stale_hits": self.stale_hits,
+            "refreshes": self.refreshes,
+            "inflight": len(self._inflight),
+        })
+        return stats
+
+
+class ByteLRUCache(LRUCache):
+    """
+    LRU cache of bytes values bounded by their total size instead of the number of entries.
+
+    attributes:
+        max_bytes: total size of the values kept, 0 keeps nothing.
+        total_bytes: current total size of the values.
+
+    Values larger than a quarter of max_bytes aren't cached, so one of them can't flush everything else.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 0):
+        super().__init__(max_size=1 << 62, ttl=ttl)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+
+    def set(self, key: Hashable, value: bytes) -> None:
+        self.pop(key)
+        if len(value) > self.max_bytes // 4:
+            return
+        self._data[key] = [value, time.monotonic()]
+        self.total_bytes += len(value)
+        while self.total_bytes > self.max_bytes:
+            _, (evicted, _) = self._data.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is not None and self._is_expired(entry):
+            self.pop(key)
+        return super().get(key, default)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self.total_bytes -= len(entry[0])
+        return entry[0]
+
+    def clear(self) -> None:
+        super().clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.pop("max_size")
+        stats.update({"bytes": self.total_bytes, "max_bytes": self.max_bytes})
+        return stats
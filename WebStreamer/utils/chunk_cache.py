@@ -0,0 +1,339 @@
+# Local disk cache of streamed file parts
+# Every file is kept as a sparse data file of its full size plus a bitmap of the 1 MiB parts
+# that are present, so fully cached ranges can be served straight from disk with sendfile
+
+import os
+import struct
+import asyncio
+import logging
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.vars import Var
+
+PART_SIZE = 1024 * 1024
+_BITMAP_HEADER = struct.Struct(">Q")  # file size
+
+
+def cache_key(file_id: FileId) -> Optional[str]:
+    """Disk cache key of a media file, None for files that aren't cached (chat photos)"""
+    if file_id.file_type == FileType.CHAT_PHOTO or not getattr(file_id, "media_id", 0):
+        return None
+    key = f"{file_id.dc_id}_{file_id.media_id}"
+    thumbnail_size = "".join(c for c in (file_id.thumbnail_size or "") if c.isalnum())
+    if thumbnail_size:
+        key += f"_{thumbnail_size}"
+    return key
+
+
+class CachedFile:
+    """
+    A file in the chunk cache.
+    attributes:
+        key: cache key of the file, also the name of its data and bitmap files.
+        file_size: full size of the file.
+        parts: bitmap of the 1 MiB parts that are on disk.
+        stored_bytes: bytes of the parts that are on disk.
+    """
+    __slots__ = ("key", "file_size", "part_count", "parts", "stored_bytes")
+
+    def __init__(self, key: str, file_size: int, parts: Optional[bytearray] = None):
+        self.key = key
+        self.file_size = file_size
+        self.part_count = (file_size + PART_SIZE - 1) // PART_SIZE
+        self.parts = parts if parts is not None else bytearray((self.part_count + 7) // 8)
+        self.stored_bytes = sum(self.part_length(i) for i in range(self.part_count) if self.has(i))
+
+    def has(self, index: int) -> bool:
+        return 0 <= index < self.part_count and bool(self.parts[index >> 3] & (1 << (index & 7)))
+
+    def part_length(self, index: int) -> int:
+        return min(PART_SIZE, self.file_size - index * PART_SIZE)
+
+    def covers(self, start: int, end: int) -> bool:
+        """True if every byte of the inclusive range start-end is on disk"""
+        return all(self.has(i) for i in range(start // PART_SIZE, end // PART_SIZE + 1))
+
+    def bitmap_with(self, index: int) -> bytes:
+        parts = bytearray(self.parts)
+        parts[index >> 3] |= 1 << (index & 7)
+        return _BITMAP_HEADER.pack(self.file_size) + bytes(parts)
+
+    def mark(self, index: int) -> None:
+        if not self.has(index):
+            self.parts[index >> 3] |= 1 << (index & 7)
+            self.stored_bytes += self.part_length(index)
+
+
+class ChunkCache:
+    """
+    Size-bounded disk cache of 1 MiB file parts, least recently used files are evicted first.
+    attributes:
+        directory: where the data and bitmap files are kept.
+        max_bytes: disk budget, 0 disables the cache.
+
+    functions:
+        load: indexes the files left by a previous run.
+        read_part: returns a cached part or None.
+        write_part: stores a complete part fetched from Telegram.
+        covered_path: returns the data file if a whole range is cached, for sendfile.
+        track_fill/pending_fill: register and look up background fetches of parts, so streams wait for them
+            instead of fetching the same part again.
+        pinned: keeps a file from being evicted while it's written or served.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chunk_cache_")
+        self._files: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._fills: Dict[Tuple[str, int], asyncio.Future] = {}
+        # Writes of one file are serialized, so every bitmap written holds the parts of the writes before it
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._pins: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.sendfile_responses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def data_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _bitmap_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.parts")
+
+    async def load(self) -> None:
+        if not self.enabled:
+            logging.info("Chunk cache disabled (CHUNK_CACHE_SIZE is 0)")
+            return
+        for _, entry in sorted(await self._run(self._scan), key=lambda item: item[0]):
+            self._files[entry.key] = entry
+            self.total_bytes += entry.stored_bytes
+        await self._evict()
+        logging.info(f"Chunk cache at {self.directory}: {len(self._files)} files, {self.total_bytes} bytes")
+
+    def _scan(self) -> List[Tuple[float, CachedFile]]:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".parts"):
+                continue
+            key = name[:-len(".parts")]
+            try:
+                with open(self._bitmap_path(key), "rb") as f:
+                    raw_bitmap = f.read()
+                file_size, = _BITMAP_HEADER.unpack_from(raw_bitmap)
+                entry = CachedFile(key, file_size, bytearray(raw_bitmap[_BITMAP_HEADER.size:]))
+                if len(entry.parts) != (entry.part_count + 7) // 8:
+                    raise ValueError("bitmap size mismatch")
+                last_used = os.stat(self.data_path(key)).st_mtime
+            except (OSError, ValueError, struct.error) as e:
+                logging.debug(f"Dropping unreadable chunk cache entry {key}: {e}")
+                self._unlink(key)
+                continue
+            entries.append((last_used, entry))
+        return entries
+
+    def _lookup(self, file_id: FileId, file_size: int) -> Optional[CachedFile]:
+        if not self.enabled:
+            return None
+        key = cache_key(file_id)
+        entry = self._files.get(key) if key else None
+        if entry is None or entry.file_size != file_size:
+            return None
+        self._files.move_to_end(key)
+        return entry
+
+    def has_part(self, file_id: FileId, file_size: int, index: int) -> bool:
+        entry = self._lookup(file_id, file_size)
+        return entry is not None and entry.has(index)
+
+    def covered_path(self, file_id: FileId, file_size: int, start: int, end: int) -> Optional[str]:
+        """Returns the data file of a file if the inclusive range start-end is fully cached"""
+        entry = self._lookup(file_id, file_size)
+        if entry is None or not entry.covers(start, end):
+            return None
+        self.sendfile_responses += 1
+        return self.data_path(entry.key)
+
+    def track_fill(self, file_id: FileId, index: int, fill: asyncio.Future) -> None:
+        """Registers a background fetch of part `index` until it's done"""
+        key = cache_key(file_id)
+        if key is None:
+            return
+        self._fills[(key, index)] = fill
+
+        def _untrack(_):
+            if self._fills.get((key, index)) is fill:
+                del self._fills[(key, index)]
+
+        fill.add_done_callback(_untrack)
+
+    def pending_fill(self, file_id: FileId, index: int) -> Optional[asyncio.Future]:
+        key = cache_key(file_id)
+        return self._fills.get((key, index)) if key else None
+
+    def _pread(self, key: str, offset: int, length: int) -> bytes:
+        fd = os.open(self.data_path(key), os.O_RDONLY)
+        try:
+            return os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+
+    async def read_part(self, file_id: FileId, file_size: int, index: int) -> Optional[bytes]:
+        """Returns part `index` (1 MiB aligned) of a file if it's cached, otherwise None"""
+        entry = self._lookup(file_id, file_size)
+        if entry is None or not entry.has(index):
+            if self.enabled:
+                self.misses += 1
+            return None
+        try:
+            data = await self._run(self._pread, entry.key, index * PART_SIZE, entry.part_length(index))
+        except OSError as e:
+            logging.warning(f"Failed to read cached part {index} of {entry.key}: {e}")
+            await self._drop(entry)
+            return None
+        if len(data) != entry.part_length(index):
+            await self._drop(entry)
+            return None
+        self.hits += 1
+        return data
+
+    @contextlib.contextmanager
+    def pinned(self, key: str):
+        self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            self._pins[key] -= 1
+            if not self._pins[key]:
+                del self._pins[key]
+
+    @contextlib.asynccontextmanager
+    async def _key_lock(self, key: str):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    def _write(self, entry: CachedFile, index: int, data: bytes, bitmap: bytes) -> None:
+        fd = os.open(self.data_path(entry.key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != entry.file_size:
+                os.ftruncate(fd, entry.file_size)
+            os.pwrite(fd, data, index * PART_SIZE)
+        finally:
+            os.close(fd)
+        temp_path = f"{self._bitmap_path(entry.key)}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(bitmap)
+        os.replace(temp_path, self._bitmap_path(entry.key))
+
+    async def write_part(self, file_id: FileId, file_size: int, index: int, data: bytes) -> None:
+        """
+        Stores part `index` of a file. Only complete parts of files with a known size are kept,
+        anything else is ignored.
+        """
+        if not self.enabled or not file_size or not data:
+            return
+        key = cache_key(file_id)
+        if key is None:
+            return
+        entry = self._files.get(key)
+        if entry is not None and entry.file_size != file_size:
+            # The size from an older link was wrong, start over
+            await self._drop(entry)
+            entry = None
+        if entry is None:
+            entry = CachedFile(key, file_size)
+            self._files[key] = entry
+        if index >= entry.part_count or entry.has(index) or len(data) != entry.part_length(index):
+            return
+        if entry.stored_bytes + len(data) > self.max_bytes:
+            return
+        with self.pinned(key):
+            async with self._key_lock(key):
+                if self._files.get(key) is not entry or entry.has(index):
+                    return
+                try:
+                    # The bitmap is taken inside the lock, after the parts marked by earlier writes
+                    await self._run(self._write, entry, index, data, entry.bitmap_with(index))
+                except OSError as e:
+                    # The bitmap on disk still lists the earlier parts, only this one is lost
+                    logging.warning(f"Failed to cache part {index} of {key}: {e}")
+                    return
+                if self._files.get(key) is not entry:
+                    # Dropped while the part was written, the files it recreated aren't in the budget
+                    if key not in self._files:
+                        await self._run(self._unlink, key)
+                    return
+                before = entry.stored_bytes
+                entry.mark(index)
+                self.total_bytes += entry.stored_bytes - before
+                self.stores += 1
+        self._files.move_to_end(key)
+        await self._evict(keep=key)
+
+    def _unlink(self, key: str) -> None:
+        for path in (self.data_path(key), self._bitmap_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def _drop(self, entry: CachedFile) -> None:
+        if self._files.get(entry.key) is entry:
+            del self._files[entry.key]
+            self.total_bytes -= entry.stored_bytes
+        try:
+            await self._run(self._unlink, entry.key)
+        except OSError as e:
+            logging.warning(f"Failed to remove cached file {entry.key}: {e}")
+
+    async def _evict(self, keep: Optional[str] = None) -> None:
+        while self.total_bytes > self.max_bytes:
+            # Files being written or served stay, the budget is caught up with once they're released
+            key = next((k for k in self._files if k != keep and k not in self._pins), None)
+            if key is None:
+                break
+            self.evictions += 1
+            await self._drop(self._files[key])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "files": len(self._files),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "part_hits": self.hits,
+            "part_misses": self.misses,
+            "part_stores": self.stores,
+            "evictions": self.evictions,
+            "sendfile_responses": self.sendfile_responses,
+            "pending_fills": len(self._fills),
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+chunk_cache = ChunkCache(Var.CHUNK_CACHE_DIR, Var.CHUNK_CACHE_SIZE * 1024 * 1024)
@@ -1,8 +1,15 @@
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 
+import hmac
+import time
 import base64
+import struct
+import urllib.parse
 from hashlib import sha256
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.vars import Var
+from WebStreamer.server.exceptions import InvalidHash
 
 key = 'BHADOO9854752658'
 iv =  'CLOUD54158954721'.encode('utf-8')
@@ -28,3 +35,130 @@ def decrypt(enc, key, iv):
     decrypted_str = decrypted.decode('utf-8')
     channel_id, message_id, expiration_time = decrypted_str.split('|')
     return channel_id, message_id, int(expiration_time)
+
+
+# Compact signed link tokens
+# Layout (big-endian): version | flags | file_type | dc_id | media_id | access_hash | file_size
+#   | mime_class | thumb_size | [expires_at] | [channel_id | message_id] | ref_len | file_reference | mac
+TOKEN_VERSION = 1
+TOKEN_MAC_SIZE = 16
+TOKEN_HAS_EXPIRY = 0x01
+TOKEN_HAS_LOCATOR = 0x02
+_TOKEN_HEADER = struct.Struct(">BBBBqqQBB")
+_TOKEN_EXPIRY = struct.Struct(">I")
+_TOKEN_LOCATOR = struct.Struct(">qI")
+_TOKEN_KEY = sha256(f"link-token|{Var.DOWNLOAD_SECRET_KEY}".encode('utf-8')).digest()
+
+# Mime types that fit in one byte, 0 means "guess from the file name"
+MIME_CLASSES = (
+    None,
+    "video/mp4", "video/x-matroska", "video/webm", "video/quicktime", "video/x-msvideo",
+    "video/mp2t", "video/3gpp", "video/x-flv", "audio/mpeg", "audio/mp4",
+    "audio/ogg", "audio/flac", "audio/x-wav", "audio/aac", "audio/opus",
+    "image/jpeg", "image/png", "image/gif", "image/webp", "application/pdf",
+    "application/zip", "application/x-rar-compressed", "application/x-7z-compressed",
+    "application/vnd.android.package-archive", "application/x-bittorrent",
+    "application/octet-stream", "text/plain", "application/json",
+)
+_MIME_CLASS_IDS = {mime: i for i, mime in enumerate(MIME_CLASSES) if mime}
+
+
+class LinkToken:
+    """
+    The decoded contents of a signed link token.
+    attributes:
+        file_id: a FileId built from the token, ready to be streamed.
+        file_size: size of the file in bytes.
+        mime_type: the mime type, None if it has to be guessed from the file name.
+        expires_at: unix time after which the token is rejected, 0 for no expiry.
+        channel_id, message_id: the source message, None if the token has no locator.
+    """
+    __slots__ = ("file_id", "file_size", "mime_type", "expires_at", "channel_id", "message_id")
+
+    def __init__(self, file_id, file_size, mime_type, expires_at=0, channel_id=None, message_id=None):
+        self.file_id = file_id
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.expires_at = expires_at
+        self.channel_id = channel_id
+        self.message_id = message_id
+
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(_TOKEN_KEY, payload, sha256).digest()[:TOKEN_MAC_SIZE]
+
+
+def encode_link_token(file_id, file_size, mime_type=None, channel_id=None, message_id=None, expires_at=0) -> str:
+    """
+    Pack everything needed to stream a file into a URL-safe token signed with DOWNLOAD_SECRET_KEY.
+    """
+    flags = 0
+    thumb_size = file_id.thumbnail_size or ""
+    payload = bytearray(_TOKEN_HEADER.pack(
+        TOKEN_VERSION, 0, int(file_id.file_type), file_id.dc_id,
+        file_id.media_id, file_id.access_hash, file_size or 0,
+        _MIME_CLASS_IDS.get(mime_type or "", 0), ord(thumb_size[:1]) if thumb_size else 0,
+    ))
+    if expires_at:
+        flags |= TOKEN_HAS_EXPIRY
+        payload += _TOKEN_EXPIRY.pack(int(expires_at))
+    if channel_id is not None and message_id is not None:
+        flags |= TOKEN_HAS_LOCATOR
+        payload += _TOKEN_LOCATOR.pack(int(channel_id), int(message_id))
+    reference = file_id.file_reference or b""
+    payload += bytes([len(reference)]) + reference
+    payload[1] = flags
+    payload += _sign(bytes(payload))
+    return base64.urlsafe_b64encode(bytes(payload)).rstrip(b"=").decode('ascii')
+
+
+def decode_link_token(token: str) -> LinkToken:
+    """
+    Verify and unpack a link token.
+    Raises InvalidHash if the token is malformed, forged or expired.
+    """
+    try:
+        raw_token = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except Exception:
+        raise InvalidHash
+    if len(raw_token) < _TOKEN_HEADER.size + 1 + TOKEN_MAC_SIZE:
+        raise InvalidHash
+    payload, mac = raw_token[:-TOKEN_MAC_SIZE], raw_token[-TOKEN_MAC_SIZE:]
+    if not hmac.compare_digest(_sign(payload), mac):
+        raise InvalidHash
+
+    (version, flags, file_type, dc_id, media_id, access_hash,
+     file_size, mime_class, thumb_size) = _TOKEN_HEADER.unpack_from(payload)
+    if version != TOKEN_VERSION:
+        raise InvalidHash
+    position = _TOKEN_HEADER.size
+    expires_at = 0
+    if flags & TOKEN_HAS_EXPIRY:
+        expires_at, = _TOKEN_EXPIRY.unpack_from(payload, position)
+        position += _TOKEN_EXPIRY.size
+        if expires_at < time.time():
+            raise InvalidHash
+    channel_id = message_id = None
+    if flags & TOKEN_HAS_LOCATOR:
+        channel_id, message_id = _TOKEN_LOCATOR.unpack_from(payload, position)
+        position += _TOKEN_LOCATOR.size
+    reference = payload[position + 1:position + 1 + payload[position]]
+
+    file_id = FileId(
+        file_type=FileType(file_type),
+        dc_id=dc_id,
+        media_id=media_id,
+        access_hash=access_hash,
+        file_reference=reference,
+        thumbnail_size=chr(thumb_size) if thumb_size else "",
+    )
+    mime_type = MIME_CLASSES[mime_class] if mime_class < len(MIME_CLASSES) else None
+    return LinkToken(file_id, file_size, mime_type, expires_at, channel_id, message_id)
+
+
+def get_token_link(file_id, file_name, file_size, mime_type=None, channel_id=None, message_id=None) -> str:
+    """Build a /dl URL around a signed token, expiring after LINK_TOKEN_TTL seconds if set."""
+    expires_at = int(time.time()) + Var.LINK_TOKEN_TTL if Var.LINK_TOKEN_TTL else 0
+    token = encode_link_token(file_id, file_size, mime_type, channel_id, message_id, expires_at)
+    safe_filename = urllib.parse.quote(file_name or 'file', safe='')
+    return f"https://{Var.FQDN}/dl/{token}/{safe_filename}"
@@ -2,16 +2,47 @@ import math
 import asyncio
 import logging
 from WebStreamer import Var
-from typing import Dict, Union
+from typing import AsyncGenerator, Dict, List, Optional, Tuple, Union
 from WebStreamer.bot import work_loads
 from pyrogram import Client, utils, raw
-from .file_properties import get_file_ids
+from .file_properties import get_file_ids, get_file_ids_batch, GET_MESSAGES_LIMIT
+from .metadata import (
+    FileMetadata,
+    file_metadata,
+    load_stored_metadata,
+    load_stored_metadata_many,
+    remember_file_id,
+)
+from .chunk_cache import chunk_cache, PART_SIZE
+from .scheduler import FetchScheduler, INTERACTIVE, BULK
+from .hedging import hedge_policy
 from pyrogram.session import Session, Auth
 import inspect
 from pyrogram.errors import AuthBytesInvalid, FloodWait
 from WebStreamer.server.exceptions import FileNotFound
 from pyrogram.file_id import FileId, FileType, ThumbnailSource
 
+# GetFile limits must be a power of two between 4 KiB and 1 MiB, so that aligned parts never cross a 1 MiB boundary
+MIN_PART_SIZE = 4 * 1024
+FIRST_PART_SIZE = min(PART_SIZE, max(MIN_PART_SIZE, 1 << (max(1, Var.FIRST_PART_SIZE * 1024) - 1).bit_length()))
+
+
+def get_part_range(position: int, until_bytes: int, part_size: int) -> Tuple[int, int]:
+    """
+    Returns the (offset, limit) of the GetFile call that fetches the byte at `position`.
+    limit is part_size, halved while a smaller part still reaches until_bytes, and offset is aligned to it.
+    """
+    limit = part_size
+    offset = position - position % limit
+    while limit > MIN_PART_SIZE:
+        half = limit // 2
+        half_offset = position - position % half
+        if half_offset + half <= until_bytes:
+            break
+        limit, offset = half, half_offset
+    return offset, limit
+
+
 # Locks to prevent concurrent auth exports per DC (prevents FloodWait)
 _dc_session_locks: Dict[int, asyncio.Lock] = {}
 
@@ -241,33 +272,98 @@ class ByteStreamer:
         """A custom class that holds the cache of a specific client and class functions.
         attributes:
             client: the client that the cache is for.
-            cached_file_ids: a dict of cached file IDs.
-            cached_file_properties: a dict of cached file properties.
+            client_key: the key this client's file references are tagged with in the shared metadata cache.
+            scheduler: hands out this client's GetFile slots, interactive streams first.
+            hedge_sessions: second media session per DC that hedged GetFile requests are sent on.
         
         functions:
             generate_file_properties: returns the properties for a media of a specific message contained in Tuple.
             generate_media_session: returns the media session for the DC that contains the media file.
+            get_file_part: fetches one part with GetFile, hedging slow requests if enabled.
+            cache_part: fetches a whole 1 MiB part into the chunk cache.
+            fill_part: cache_part shared with every other fill of the same part, for background fetches.
+            yield_buffered: yields a file from the chunk cache while it's filled ahead of the reader, for slow readers.
+            read_range: returns a byte range of a file at once, for parsing container headers.
             yield_file: yield a file from telegram servers for streaming.
             
         This is a modified version of the <https://github.com/eyaadh/megadlbot_oss/blob/master/mega/telegram/utils/custom_download.py>
         Thanks to Eyaadh <https://github.com/eyaadh>
         """
-        self.clean_timer = 30 * 60
         self.client: Client = client
-        self.cached_file_ids: Dict[int, FileId] = {}
-        asyncio.create_task(self.clean_cache())
+        self.client_key: str = client.name
+        self.scheduler = FetchScheduler(Var.GETFILE_SLOTS_PER_CLIENT, Var.BULK_STARVATION_LIMIT)
+        self.hedge_sessions: Dict[int, Session] = {}
 
     async def get_file_properties(self, message_id: int, channel_id) -> FileId:
         """
         Returns the properties of a media of a specific message in a FIleId class.
         if the properties are cached, then it'll return the cached results.
         or it'll generate the properties from the Message ID and cache them.
+        The cache is shared by all clients, this client's FileId is preferred but one resolved
+        by another client is reused rather than asking Telegram again.
+        """
+        key = (int(channel_id), int(message_id))
+        metadata = await file_metadata.get_or_load(
+            key, lambda: self.generate_file_metadata(message_id, channel_id)
+        )
+        file_id = metadata.file_id_for(self.client_key)
+        if file_id is None:
+            file_id = metadata.any_file_id()
+        if file_id is None:
+            file_id = await self.generate_file_properties(message_id, channel_id)
+            remember_file_id(channel_id, message_id, self.client_key, file_id)
+            logging.debug(f"Added reference of client {self.client_key} for message with ID {message_id}")
+        return file_id
+
+    async def generate_file_metadata(self, message_id: int, channel_id) -> FileMetadata:
         """
-        if message_id not in self.cached_file_ids:
-            await self.generate_file_properties(message_id, channel_id)
-            logging.debug(f"Cached file properties for message with ID {message_id}")
-        return self.cached_file_ids[message_id]
+        Generates the shared metadata entry of a media file, tagged with this client's FileId.
+        The persistent store is consulted before asking Telegram. A refresh of a cached entry
+        is merged into it, so the FileIds other clients tagged it with are kept.
+        """
+        metadata = await load_stored_metadata(channel_id, message_id)
+        if metadata is not None:
+            logging.debug(f"Loaded metadata of message {message_id} from the persistent store")
+            current = file_metadata.peek((int(channel_id), int(message_id)))
+            if current is not None:
+                current.merge(metadata)
+                return current
+            return metadata
+        file_id = await self.generate_file_properties(message_id, channel_id)
+        return remember_file_id(channel_id, message_id, self.client_key, file_id)
     
+    async def iter_file_properties(
+        self, channel_id: int, message_ids: List[int]
+    ) -> AsyncGenerator[Tuple[int, Optional[FileId]], None]:
+        """
+        Yields (message_id, FileId) pairs for many messages of one channel as they resolve.
+        Cached and stored entries come first, the rest is fetched with chunked multi-id get_messages calls.
+        FileId is None for missing messages and messages without media.
+        """
+        channel_id = int(channel_id)
+        missing = []
+        for message_id in message_ids:
+            metadata = file_metadata.get((channel_id, message_id))
+            if metadata is None:
+                missing.append(message_id)
+            else:
+                yield message_id, metadata.file_id_for(self.client_key) or metadata.any_file_id()
+
+        stored = await load_stored_metadata_many(channel_id, missing) if missing else {}
+        for message_id, metadata in stored.items():
+            file_metadata.set((channel_id, message_id), metadata)
+            yield message_id, metadata.any_file_id()
+        missing = [message_id for message_id in missing if message_id not in stored]
+
+        for i in range(0, len(missing), GET_MESSAGES_LIMIT):
+            chunk = missing[i:i + GET_MESSAGES_LIMIT]
+            resolved = await get_file_ids_batch(self.client, channel_id, chunk)
+            for message_id in chunk:
+                file_id = resolved.get(message_id)
+                if file_id is not None:
+                    remember_file_id(channel_id, message_id, self.client_key, file_id)
+                yield message_id, file_id
+
     async def generate_file_properties(self, message_id: int, channel_id) -> FileId:
         """
         Generates the properties of a media file on a specific message.
@@ -279,9 +375,7 @@ class ByteStreamer:
         if not file_id:
             logging.debug(f"Message with ID {message_id} not found")
             raise FileNotFound
-        self.cached_file_ids[message_id] = file_id
-        logging.debug(f"Cached media message with ID {message_id}")
-        return self.cached_file_ids[message_id]
+        return file_id
 
     async def generate_media_session(self, client: Client, file_id: FileId) -> Session:
         """
@@ -360,6 +454,177 @@ class ByteStreamer:
         return media_session
 
 
+    async def generate_hedge_session(self, file_id: FileId, media_session: Session) -> Session:
+        """
+        Returns a second media session for the DC of the file, created on first use.
+        It reuses the auth key of the main media session, so no new authorization is exported.
+        """
+        hedge_session = self.hedge_sessions.get(file_id.dc_id)
+        if hedge_session is None:
+            async with get_dc_lock(file_id.dc_id):
+                hedge_session = self.hedge_sessions.get(file_id.dc_id)
+                if hedge_session is None:
+                    hedge_session = create_session_safe(
+                        self.client,
+                        file_id.dc_id,
+                        media_session.auth_key,
+                        await self.client.storage.test_mode(),
+                        is_media=True
+                    )
+                    await hedge_session.start()
+                    logging.debug(f"Created hedge session for DC {file_id.dc_id}")
+                    self.hedge_sessions[file_id.dc_id] = hedge_session
+        return hedge_session
+
+    async def get_file_part(
+        self,
+        file_id: FileId,
+        media_session: Session,
+        location,
+        offset: int,
+        limit: int,
+        priority: int = BULK,
+    ):
+        """
+        Fetches one part with GetFile within this client's scheduler slots.
+        If hedging is enabled and the call is slower than the recent latency percentile,
+        the same part is requested on the hedge session and the first answer is used.
+        Latency is measured from the moment the call holds its slot, time spent queued isn't upstream latency.
+        """
+        request = raw.functions.upload.GetFile(location=location, offset=offset, limit=limit)
+
+        async def primary():
+            return await media_session.invoke(request)
+
+        async def backup():
+            hedge_session = await self.generate_hedge_session(file_id, media_session)
+            # The duplicate takes a slot of its own, so hedging stays within the client's cap and priorities
+            async with self.scheduler.slot(priority):
+                return await hedge_session.invoke(request)
+
+        async with self.scheduler.slot(priority):
+            # Latency depends on the part size, so each size gets its own percentile
+            return await hedge_policy.run((file_id.dc_id, limit), primary, backup)
+
+    async def cache_part(self, file_id: FileId, part_index: int, priority: int = BULK) -> bool:
+        """
+        Fetches part `part_index` (1 MiB) of a file into the chunk cache unless it's already there.
+        Returns False if Telegram returned nothing for it.
+        """
+        file_size = getattr(file_id, "file_size", 0)
+        if chunk_cache.has_part(file_id, file_size, part_index):
+            return True
+        media_session = await self.generate_media_session(self.client, file_id)
+        location = await self.get_location(file_id)
+        r = await self.get_file_part(
+            file_id, media_session, location, part_index * PART_SIZE, PART_SIZE, priority
+        )
+        if not isinstance(r, raw.types.upload.File) or not r.bytes:
+            return False
+        await chunk_cache.write_part(file_id, file_size, part_index, r.bytes)
+        return chunk_cache.has_part(file_id, file_size, part_index)
+
+    async def fill_part(self, file_id: FileId, part_index: int, priority: int = BULK) -> bool:
+        """
+        Makes sure part `part_index` gets into the chunk cache: waits for a fetch of it that's already running,
+        otherwise fetches it and registers the fetch so streams and other fills wait for it.
+        Returns True if this call fetched the part, callers check has_part for whether it's cached.
+        """
+        if chunk_cache.has_part(file_id, getattr(file_id, "file_size", 0), part_index):
+            return False
+        fill = chunk_cache.pending_fill(file_id, part_index)
+        if fill is not None:
+            await asyncio.wait({fill})
+            return False
+        fill = asyncio.ensure_future(self.cache_part(file_id, part_index, priority))
+        chunk_cache.track_fill(file_id, part_index, fill)
+        return await fill
+
+    async def yield_buffered(
+        self,
+        file_id: FileId,
+        index: int,
+        from_bytes: int,
+        until_bytes: int,
+        window: int,
+        priority: int = BULK,
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Yields the bytes from_bytes-until_bytes from the chunk cache, while a background task fetches
+        the parts at full speed up to `window` parts ahead of the reader.
+        Only the background fetches count towards work_loads, so a slow reader doesn't pin the client.
+        If a part can't be cached, the rest is streamed with yield_file.
+        """
+        file_size = getattr(file_id, "file_size", 0)
+        last_part = until_bytes // PART_SIZE
+        reader_part = from_bytes // PART_SIZE
+        changed = asyncio.Event()
+
+        async def fill():
+            part_index = reader_part
+            while part_index <= last_part:
+                if part_index >= reader_part + window:
+                    changed.clear()
+                    await changed.wait()
+                    continue
+                if not chunk_cache.has_part(file_id, file_size, part_index):
+                    work_loads[index] += 1
+                    try:
+                        await self.fill_part(file_id, part_index, priority)
+                    finally:
+                        work_loads[index] -= 1
+                    if not chunk_cache.has_part(file_id, file_size, part_index):
+                        return
+                part_index += 1
+                changed.set()
+
+        fill_task = asyncio.ensure_future(fill())
+        position = from_bytes
+        try:
+            while position <= until_bytes:
+                reader_part = position // PART_SIZE
+                changed.set()
+                while not chunk_cache.has_part(file_id, file_size, reader_part) and not fill_task.done():
+                    changed.clear()
+                    waiter = asyncio.ensure_future(changed.wait())
+                    await asyncio.wait({waiter, fill_task}, return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                chunk = await chunk_cache.read_part(file_id, file_size, reader_part)
+                if chunk is None:
+                    break
+                offset = reader_part * PART_SIZE
+                yield chunk[position - offset:until_bytes - offset + 1]
+                position = offset + len(chunk)
+                if len(chunk) < PART_SIZE:
+                    return
+            if position <= until_bytes:
+                logging.debug(f"Buffered stream fell back to direct streaming at byte {position}")
+                async for chunk in self.yield_file(file_id, index, position, until_bytes, priority):
+                    yield chunk
+        finally:
+            fill_task.cancel()
+
+    async def read_range(self, file_id: FileId, index: int, offset: int, length: int,
+                         priority: int = INTERACTIVE) -> bytes:
+        """
+        Returns `length` bytes from `offset`, fewer at the end of the file.
+        Goes through yield_file, so the chunk cache and GetFile scheduling apply.
+        """
+        file_size = getattr(file_id, "file_size", 0)
+        until_bytes = offset + length - 1
+        if file_size:
+            until_bytes = min(until_bytes, file_size - 1)
+        if until_bytes < offset:
+            return b""
+        chunks = []
+        generator = self.yield_file(file_id, index, offset, until_bytes, priority)
+        try:
+            async for chunk in generator:
+                chunks.append(chunk)
+        finally:
+            await generator.aclose()
+        return b"".join(chunks)
+
     @staticmethod
     async def get_location(file_id: FileId) -> Union[raw.types.InputPhotoFileLocation,
                                                      raw.types.InputDocumentFileLocation,
@@ -409,68 +674,74 @@ class ByteStreamer:
         self,
         file_id: FileId,
         index: int,
-        offset: int,
-        first_part_cut: int,
-        last_part_cut: int,
-        part_count: int,
-        chunk_size: int,
+        from_bytes: int,
+        until_bytes: int,
+        priority: int = BULK,
     ) -> Union[str, None]:
         """
-        Custom generator that yields the bytes of the media file.
+        Custom generator that yields the bytes from_bytes-until_bytes (inclusive) of the media file.
+        The first GetFile is small for a fast first byte and the part size ramps up to 1 MiB
+        for sequential reads, see get_part_range.
+        priority decides which fetches get this client's GetFile slots first under contention.
         Modded from <https://github.com/eyaadh/megadlbot_oss/blob/master/mega/telegram/utils/custom_download.py#L20>
         Thanks to Eyaadh <https://github.com/eyaadh>
         """
         client = self.client
         work_loads[index] += 1
         logging.debug(f"Starting to yielding file with client {index}.")
-        media_session = await self.generate_media_session(client, file_id)
+        file_size = getattr(file_id, "file_size", 0)
+        # Parts already on disk are served from the chunk cache, Telegram is only asked for the rest
+        media_session = None
 
-        current_part = 1
+        parts = 0
+        position = from_bytes
+        part_size = FIRST_PART_SIZE
+        # Smaller parts fetched from the start of a 1 MiB part are joined so the chunk cache gets the whole part
+        pending_part = None
         location = await self.get_location(file_id)
 
         try:
-            r = await media_session.invoke(
-                raw.functions.upload.GetFile(
-                    location=location, offset=offset, limit=chunk_size
-                ),
-            )
-            if isinstance(r, raw.types.upload.File):
-                while True:
-                    chunk = r.bytes
-                    if not chunk:
-                        break
-                    elif part_count == 1:
-                        yield chunk[first_part_cut:last_part_cut]
-                    elif current_part == 1:
-                        yield chunk[first_part_cut:]
-                    elif current_part == part_count:
-                        yield chunk[:last_part_cut]
-                    else:
-                        yield chunk
-
-                    current_part += 1
-                    offset += chunk_size
-
-                    if current_part > part_count:
+            while position <= until_bytes:
+                part_index = position // PART_SIZE
+                fill = chunk_cache.pending_fill(file_id, part_index)
+                if fill is not None:
+                    # Being fetched by readahead, don't ask Telegram twice (and don't fail if it's cancelled)
+                    await asyncio.wait({fill})
+                chunk = await chunk_cache.read_part(file_id, file_size, part_index)
+                if chunk is not None:
+                    offset, limit = part_index * PART_SIZE, PART_SIZE
+                    pending_part = None
+                else:
+                    offset, limit = get_part_range(position, until_bytes, part_size)
+                    if media_session is None:
+                        media_session = await self.generate_media_session(client, file_id)
+                    r = await self.get_file_part(
+                        file_id, media_session, location, offset, limit, priority
+                    )
+                    if not isinstance(r, raw.types.upload.File):
                         break
+                    chunk = r.bytes
+                    if chunk_cache.enabled:
+                        if offset % PART_SIZE == 0:
+                            pending_part = [chunk]
+                        elif pending_part is not None:
+                            pending_part.append(chunk)
+                        if pending_part is not None and (len(chunk) < limit or (offset + limit) % PART_SIZE == 0):
+                            await chunk_cache.write_part(file_id, file_size, part_index, b"".join(pending_part))
+                            pending_part = None
+                if not chunk:
+                    break
+                yield chunk[position - offset:until_bytes - offset + 1]
 
-                    r = await media_session.invoke(
-                        raw.functions.upload.GetFile(
-                            location=location, offset=offset, limit=chunk_size
-                        ),
-                    )
+                parts += 1
+                if len(chunk) < limit:
+                    # End of the file
+                    break
+                position = offset + limit
+                # Double the part size, as far as the new position is aligned so no bytes are fetched twice
+                part_size = min(PART_SIZE, limit * 2, position & -position)
         except (TimeoutError, AttributeError):
             pass
         finally:
-            logging.debug("Finished yielding file with {current_part} parts.")
+            logging.debug(f"Finished yielding file with {parts} parts.")
             work_loads[index] -= 1
-
-    
-    async def clean_cache(self) -> None:
-        """
-        function to clean the cache to reduce memory usage
-        """
-        while True:
-            await asyncio.sleep(self.clean_timer)
-            self.cached_file_ids.clear()
-            logging.debug("Cleaned the cache")
@@ -0,0 +1,137 @@
+# Deduplication of files posted or uploaded more than once
+# Every copy of a file is mapped onto the first copy seen, its canonical file, and links are built for that one,
+# so all copies share one link, one set of metadata and chunk cache entries and one stream of Telegram fetches.
+# Posted media are keyed by Telegram's file_unique_id, HTTP uploads by the SHA-256 of their content.
+# The mapping lives in the metadata store, recently used keys are also kept in memory.
+
+import logging
+from typing import Any, Dict, Optional
+from WebStreamer.vars import Var
+from .cache import LRUCache
+from .metadata_store import metadata_store
+
+KINDS = ("unique", "sha256")
+
+
+class CanonicalFile:
+    """
+    The copy of a file its duplicates map onto.
+    It has the attributes of a Pyrogram media object that links are built from.
+    attributes:
+        channel_id, message_id: the message holding the copy.
+    """
+    __slots__ = ("channel_id", "message_id", "file_unique_id", "file_id", "file_size", "mime_type", "file_name")
+
+    def __init__(self, channel_id: int, message_id: int, file_unique_id: str, file_id: str,
+                 file_size: int, mime_type: str, file_name: str):
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.file_unique_id = file_unique_id
+        self.file_id = file_id
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.file_name = file_name
+
+    @classmethod
+    def from_message(cls, message: Any, media: Any = None) -> "CanonicalFile":
+        media = media or message.document or message.video or message.audio
+        return cls(
+            message.chat.id, message.id, media.file_unique_id, media.file_id,
+            getattr(media, "file_size", 0) or 0, getattr(media, "mime_type", "") or "",
+            getattr(media, "file_name", "") or "",
+        )
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "CanonicalFile":
+        return cls(
+            record["channel_id"], record["message_id"], record["unique_id"], record["file_id"],
+            record["file_size"] or 0, record["mime_type"] or "", record["file_name"] or "",
+        )
+
+    def to_record(self, key: str) -> Dict[str, Any]:
+        return {
+            "key": key,
+            "channel_id": self.channel_id,
+            "message_id": self.message_id,
+            "unique_id": self.file_unique_id,
+            "file_id": self.file_id,
+            "file_size": self.file_size,
+            "mime_type": self.mime_type,
+            "file_name": self.file_name,
+        }
+
+    @property
+    def locator(self):
+        return self.channel_id, self.message_id
+
+
+class DedupIndex:
+    """
+    Maps copies of a file onto its canonical file, per key kind ("unique" or "sha256").
+    attributes:
+        enabled: with dedup off every file is its own canonical file.
+
+    functions:
+        claim: returns the canonical file of a key, the given file becomes it if the key is new.
+        lookup: returns the canonical file of a key if there is one, without claiming it.
+    """
+
+    def __init__(self, enabled: bool, max_size: int = 10000):
+        self.enabled = enabled
+        self._cache = LRUCache(max_size=max_size)
+        self._lookups = dict.fromkeys(KINDS, 0)
+        self._hits = dict.fromkeys(KINDS, 0)
+
+    async def claim(self, kind: str, value: str, candidate: CanonicalFile) -> CanonicalFile:
+        if not self.enabled or not value:
+            return candidate
+        key = f"{kind}:{value}"
+        canonical = self._cache.get(key)
+        if canonical is not None and canonical.locator == candidate.locator:
+            # The same message again, e.g. handled by another client
+            return canonical
+        if canonical is None:
+            try:
+                canonical = CanonicalFile.from_record(await metadata_store.claim_canonical(candidate.to_record(key)))
+            except Exception as e:
+                logging.warning(f"Failed to look up the canonical file of {key}: {e}")
+                return candidate
+            self._cache.set(key, canonical)
+        self._lookups[kind] += 1
+        if canonical.locator != candidate.locator:
+            self._hits[kind] += 1
+            logging.debug(f"Message {candidate.message_id} in {candidate.channel_id} duplicates {canonical.locator}")
+        return canonical
+
+    async def lookup(self, kind: str, value: str) -> Optional[CanonicalFile]:
+        """Only hits are counted, a miss is counted by the claim that follows it"""
+        if not self.enabled or not value:
+            return None
+        key = f"{kind}:{value}"
+        canonical = self._cache.get(key)
+        if canonical is None:
+            try:
+                record = await metadata_store.get_canonical(key)
+            except Exception as e:
+                logging.warning(f"Failed to look up the canonical file of {key}: {e}")
+                return None
+            if record is None:
+                return None
+            canonical = CanonicalFile.from_record(record)
+            self._cache.set(key, canonical)
+        self._lookups[kind] += 1
+        self._hits[kind] += 1
+        return canonical
+
+    def stats(self) -> Dict[str, Any]:
+        lookups, hits = sum(self._lookups.values()), sum(self._hits.values())
+        return {
+            "enabled": self.enabled,
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            **{kind: {"lookups": self._lookups[kind], "hits": self._hits[kind]} for kind in KINDS},
+        }
+
+
+dedup_index = DedupIndex(Var.DEDUP)
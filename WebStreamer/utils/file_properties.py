@@ -1,10 +1,18 @@
-from pyrogram import Client, raw, utils
-from typing import Any, Optional
+from pyrogram import Client
+from typing import Any, Dict, List, Optional, Tuple, Union
 from pyrogram.types import Message
 from pyrogram.file_id import FileId
 from pyrogram.raw.types.messages import Messages
-from WebStreamer.server.exceptions import FileNotFound
+from WebStreamer.server.exceptions import FileNotFound, PeerIdInvalid
+from .peer_cache import peer_cache
+import asyncio
 import logging
+import urllib.parse
+from WebStreamer.vars import Var
+from .cryptography import get_token_link
+
+# Maximum number of message ids accepted by a single get_messages call
+GET_MESSAGES_LIMIT = 200
 
 
 async def parse_file_id(message: "Message") -> Optional[FileId]:
@@ -17,110 +25,143 @@ async def parse_file_unique_id(message: "Messages") -> Optional[str]:
     if media:
         return media.file_unique_id
 
-async def resolve_peer_with_raw_api(client: Client, chat_id: int) -> bool:
+async def get_messages_resolving_peer(client: Client, chat_id: int, message_ids: Union[int, List[int]]):
     """
-    Force resolve peer using raw Telegram API.
-    This fetches the channel information and caches it in the session.
+    Calls client.get_messages, resolving the peer first if Telegram reports it as invalid.
+    message_ids may be a single id or a list of up to 200 ids.
+    Peers known to be unresolvable fail fast without calling Telegram.
     """
+    if peer_cache.is_unresolvable(client, chat_id):
+        raise PeerIdInvalid(f"Peer {chat_id} could not be resolved recently")
     try:
-        # Convert the chat_id to the proper channel_id format
-        channel_id = utils.get_channel_id(chat_id)
-        
-        logging.info(f"Attempting to resolve peer using raw API for chat_id={chat_id}, channel_id={channel_id}")
-        
-        # Try to get the channel using raw API with access_hash=0
-        # This forces Telegram to resolve the peer
-        try:
-            result = await client.invoke(
-                raw.functions.channels.GetChannels(
-                    id=[raw.types.InputChannel(
-                        channel_id=channel_id,
-                        access_hash=0
-                    )]
-                )
-            )
-            logging.info(f"Successfully resolved peer using GetChannels for {chat_id}")
-            return True
-        except Exception as e1:
-            logging.warning(f"GetChannels with access_hash=0 failed: {e1}")
-            
-            # Alternative: Try getting recent messages/history to cache the peer
-            try:
-                result = await client.invoke(
-                    raw.functions.messages.GetHistory(
-                        peer=raw.types.InputPeerChannel(
-                            channel_id=channel_id,
-                            access_hash=0
-                        ),
-                        offset_id=0,
-                        offset_date=0,
-                        add_offset=0,
-                        limit=1,
-                        max_id=0,
-                        min_id=0,
-                        hash=0
-                    )
-                )
-                logging.info(f"Successfully resolved peer using GetHistory for {chat_id}")
-                return True
-            except Exception as e2:
-                logging.error(f"GetHistory also failed: {e2}")
-                return False
-                
-    except Exception as e:
-        logging.error(f"Failed to resolve peer with raw API: {e}")
-        return False
-
-async def get_file_ids(client: Client, chat_id: int, message_id: int) -> Optional[FileId]:
-    try:
-        message = await client.get_messages(chat_id, message_id)
+        return await client.get_messages(chat_id, message_ids)
     except Exception as e:
         error_str = str(e).lower()
         # If we get a "Peer id invalid" error, try to resolve the peer first
-        if "peer id invalid" in error_str or "peer_id_invalid" in error_str:
-            logging.warning(f"Peer id invalid for chat {chat_id}, attempting to resolve peer...")
-            
-            # Try raw API resolution first
-            if await resolve_peer_with_raw_api(client, chat_id):
-                try:
-                    message = await client.get_messages(chat_id, message_id)
-                    logging.info(f"Successfully fetched message {message_id} after raw API peer resolution")
-                except Exception as retry_error:
-                    logging.error(f"Still failed after raw API resolution: {retry_error}")
-                    # Continue to other methods
-                    pass
-            
-            # If still failing, try other methods
-            if not hasattr(locals(), 'message') or locals().get('message') is None:
-                try:
-                    # Try to resolve peer by getting chat info
-                    await client.get_chat(chat_id)
-                    logging.info(f"Successfully resolved peer by getting chat info for {chat_id}")
-                    # Retry getting the message after resolving peer
-                    message = await client.get_messages(chat_id, message_id)
-                    logging.info(f"Successfully fetched message {message_id} from chat {chat_id} after peer resolution")
-                except Exception as chat_error:
-                    logging.warning(f"Failed to get chat info for {chat_id}: {chat_error}")
-                    # For bots, GetDialogs is not available. If raw API and get_chat both failed,
-                    # we cannot resolve the peer. Log and raise the error.
-                    logging.error(f"Unable to resolve peer for chat {chat_id}. All methods exhausted.")
-                    raise
-        else:
+        if "peer id invalid" not in error_str and "peer_id_invalid" not in error_str:
             # Re-raise if it's a different error
             raise
-    
-    if message.empty:
-        raise FileNotFound
+        peer_error = e
+
+    logging.warning(f"Peer id invalid for chat {chat_id}, attempting to resolve peer...")
+    if not await peer_cache.resolve(client, chat_id, force=True):
+        # For bots, GetDialogs is not available. If raw API and get_chat both failed,
+        # we cannot resolve the peer. Log and raise the error.
+        logging.error(f"Unable to resolve peer for chat {chat_id}. All methods exhausted.")
+        raise peer_error
+    messages = await client.get_messages(chat_id, message_ids)
+    logging.info(f"Successfully fetched message(s) {message_ids} from chat {chat_id} after peer resolution")
+    return messages
+
+def file_id_from_message(message: "Message") -> Optional[FileId]:
+    """
+    Builds the FileId of a message's media with its size, mime type, name and unique id attached.
+    Returns None for empty messages and messages without media.
+    """
+    if message is None or message.empty:
+        return None
     media = get_media_from_message(message)
-    file_unique_id = await parse_file_unique_id(message)
-    file_id = await parse_file_id(message)
+    if not media:
+        return None
+    file_id = FileId.decode(media.file_id)
     setattr(file_id, "file_size", getattr(media, "file_size", 0))
     setattr(file_id, "mime_type", getattr(media, "mime_type", ""))
     setattr(file_id, "file_name", getattr(media, "file_name", ""))
-    setattr(file_id, "unique_id", file_unique_id)
+    setattr(file_id, "unique_id", media.file_unique_id)
     setattr(file_id, "file_id", getattr(media, "file_id", ""))  # Store the actual file_id string
     return file_id
 
+class MessageBatcher:
+    """
+    Merges concurrent single-id get_messages lookups into multi-id requests.
+    Lookups for the same (client, chat) that arrive within `window` seconds of each other
+    are sent as one get_messages call and the results are fanned back out to the waiters.
+    attributes:
+        window: seconds to wait for more lookups before sending the request, 0 disables batching.
+        lookups: number of lookups received.
+        requests: number of get_messages calls made for them.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self.lookups = 0
+        self.requests = 0
+        self._pending: Dict[Tuple[int, int], Dict[int, List[asyncio.Future]]] = {}
+
+    async def get_message(self, client: Client, chat_id: int, message_id: int) -> Optional["Message"]:
+        self.lookups += 1
+        if self.window <= 0:
+            self.requests += 1
+            return await get_messages_resolving_peer(client, chat_id, message_id)
+
+        loop = asyncio.get_running_loop()
+        key = (id(client), chat_id)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = {}
+            loop.call_later(self.window, self._flush, key, batch, client, chat_id)
+        future = loop.create_future()
+        batch.setdefault(message_id, []).append(future)
+        if len(batch) >= GET_MESSAGES_LIMIT:
+            self._flush(key, batch, client, chat_id)
+        return await future
+
+    def _flush(self, key: Tuple[int, int], batch: Dict[int, List[asyncio.Future]], client: Client, chat_id: int) -> None:
+        # The timer of a batch that was already sent because it filled up must not send the next one
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        asyncio.ensure_future(self._send(batch, client, chat_id))
+
+    async def _send(self, batch: Dict[int, List[asyncio.Future]], client: Client, chat_id: int) -> None:
+        message_ids = list(batch)
+        self.requests += 1
+        try:
+            messages = await get_messages_resolving_peer(client, chat_id, message_ids)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        by_id = {message.id: message for message in messages if message is not None}
+        if len(message_ids) > 1:
+            logging.debug(f"Merged {len(message_ids)} message lookups in chat {chat_id} into one request")
+        for message_id, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(by_id.get(message_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "lookups": self.lookups,
+            "requests": self.requests,
+        }
+
+
+message_batcher = MessageBatcher(Var.GET_MESSAGES_BATCH_WINDOW / 1000)
+
+async def get_file_ids(client: Client, chat_id: int, message_id: int) -> Optional[FileId]:
+    message = await message_batcher.get_message(client, chat_id, message_id)
+    if message is None or message.empty:
+        raise FileNotFound
+    return file_id_from_message(message)
+
+async def get_file_ids_batch(client: Client, chat_id: int, message_ids: List[int]) -> Dict[int, Optional[FileId]]:
+    """
+    Resolves many messages of one chat with multi-id get_messages calls (up to 200 ids each).
+    Returns a dict of message_id -> FileId, None for missing messages or messages without media.
+    """
+    results: Dict[int, Optional[FileId]] = {}
+    for i in range(0, len(message_ids), GET_MESSAGES_LIMIT):
+        chunk = message_ids[i:i + GET_MESSAGES_LIMIT]
+        messages = await get_messages_resolving_peer(client, chat_id, chunk)
+        by_id = {message.id: message for message in messages if message is not None}
+        for message_id in chunk:
+            results[message_id] = file_id_from_message(by_id.get(message_id))
+    return results
+
 def get_media_from_message(message: "Message") -> Any:
     media_types = (
         "audio",
@@ -145,3 +186,15 @@ def get_hash(media_msg: Message) -> str:
 def get_name(media_msg: Message) -> str:
     media = get_media_from_message(media_msg)
     return getattr(media, 'file_name', "")
+
+def get_download_link(media: Any, channel_id: int, message_id: int) -> str:
+    """/dl link of a posted media file, signed if SIGNED_LINKS is set"""
+    file_name = getattr(media, 'file_name', None) or f"file_{media.file_unique_id}"
+    file_size = getattr(media, 'file_size', 0)
+    if Var.SIGNED_LINKS:
+        return get_token_link(
+            FileId.decode(media.file_id), file_name, file_size,
+            getattr(media, 'mime_type', None), channel_id, message_id
+        )
+    safe_filename = urllib.parse.quote(file_name, safe='')
+    return f"https://{Var.FQDN or 'your-domain.com'}/dl/{media.file_unique_id}/{media.file_id}/{file_size}/{safe_filename}"
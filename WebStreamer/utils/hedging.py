@@ -0,0 +1,135 @@
+# Hedged upstream requests
+# A part that's slower than the recent latency percentile gets a duplicate request,
+# the first answer wins and the other call is cancelled. A token budget caps the extra calls.
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+from WebStreamer.vars import Var
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent latencies.
+    attributes:
+        window: number of samples kept.
+        min_samples: samples needed before a percentile is reported.
+    """
+
+    def __init__(self, window: int = 1000, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._sorted: Optional[list] = None
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+        self._sorted = None
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * percentile / 100))
+        return self._sorted[index]
+
+
+class HedgePolicy:
+    """
+    Decides when a request gets a duplicate.
+    attributes:
+        enabled: hedging is opt-in.
+        percentile: latency percentile after which a request is hedged.
+        budget: hedges allowed per request, e.g. 0.05 lets at most 5% more upstream calls through.
+        min_delay: lower bound of the hedge delay in seconds.
+
+    functions:
+        run: awaits primary(), starting backup() if it's slow, and returns the first successful result.
+    """
+
+    def __init__(self, enabled: bool, percentile: float = 95, budget: float = 0.05,
+                 min_delay: float = 0.2, max_tokens: float = 10):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.max_tokens = max_tokens
+        self._tokens = 0.0
+        self._trackers: Dict[Hashable, LatencyTracker] = {}
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def tracker(self, key: Hashable) -> LatencyTracker:
+        tracker = self._trackers.get(key)
+        if tracker is None:
+            tracker = self._trackers[key] = LatencyTracker()
+        return tracker
+
+    def delay(self, key: Hashable) -> Optional[float]:
+        """Seconds to wait before hedging a request, None if it mustn't be hedged"""
+        if not self.enabled:
+            return None
+        threshold = self.tracker(key).percentile(self.percentile)
+        if threshold is None:
+            return None
+        return max(self.min_delay, threshold)
+
+    async def run(self, key: Hashable, primary: Callable[[], Awaitable[Any]],
+                  backup: Callable[[], Awaitable[Any]]) -> Any:
+        self.requests += 1
+        self._tokens = min(self.max_tokens, self._tokens + self.budget)
+        started = time.monotonic()
+        delay = self.delay(key)
+        if delay is None:
+            result = await primary()
+            self.tracker(key).add(time.monotonic() - started)
+            return result
+
+        first = asyncio.ensure_future(primary())
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._tokens >= 1:
+                self._tokens -= 1
+                self.hedges += 1
+                logging.debug(f"Hedging a request to {key} after {delay * 1000:.0f} ms")
+                tasks.add(asyncio.ensure_future(backup()))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.tracker(key).add(time.monotonic() - started)
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            "thresholds_ms": {
+                str(key): round(threshold * 1000, 1)
+                for key, threshold in ((key, self.delay(key)) for key in self._trackers)
+                if threshold is not None
+            },
+        }
+
+
+hedge_policy = HedgePolicy(
+    Var.HEDGE_REQUESTS,
+    percentile=Var.HEDGE_PERCENTILE,
+    budget=Var.HEDGE_BUDGET,
+    min_delay=Var.HEDGE_MIN_DELAY / 1000,
+)
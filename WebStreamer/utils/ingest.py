@@ -0,0 +1,339 @@
+# Mirroring of remote HTTP files into BIN_CHANNEL
+# The source is downloaded with several ranged requests at once and handed over in order to a PartUploader,
+# which sends it on as upload parts. Both sides are bounded: at most `window` segments are downloaded or
+# waiting ahead of the uploader, and the uploader only takes data while it has a free part slot,
+# so the slower side holds the faster one back. Parts Telegram acknowledged are remembered
+# and a failed job resumes after them, with the same client and upload id.
+
+import os
+import re
+import time
+import asyncio
+import logging
+import hashlib
+import secrets
+import mimetypes
+import urllib.parse
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+import aiohttp
+from WebStreamer.vars import Var
+from WebStreamer.bot import work_loads
+from .dedup import dedup_index, CanonicalFile
+from .uploader import ChannelUpload, PartUploader, UploadError, UPLOAD_PART_SIZE, SMALL_FILE_SIZE
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+
+class IngestJob:
+    """
+    A remote file to mirror into BIN_CHANNEL.
+    attributes:
+        job_id: random id used in the status URL.
+        url: the source.
+        name: file name in Telegram, from the request, the source's Content-Disposition or the URL.
+        state: queued, running, done or failed.
+        file_size: source size, None if the source doesn't announce it.
+        ranged: whether the source answers Range requests, only those sources are downloaded
+            in parallel and resumed mid-file.
+        acked_parts: leading upload parts Telegram acknowledged.
+        link: DL link once the file is posted.
+    """
+    __slots__ = ("job_id", "url", "name", "mime_type", "state", "error", "file_size", "ranged", "probed",
+                 "downloaded", "acked_parts", "upload_id", "attempts", "link", "created", "started", "finished",
+                 "target", "uploader")
+
+    def __init__(self, job_id: str, url: str, name: str = ""):
+        self.job_id = job_id
+        self.url = url
+        self.name = name
+        self.mime_type = ""
+        self.state = QUEUED
+        self.error = ""
+        self.file_size: Optional[int] = None
+        self.ranged = False
+        self.probed = False
+        self.downloaded = 0
+        self.acked_parts = 0
+        self.upload_id: Optional[int] = None
+        self.attempts = 0
+        self.link = ""
+        self.created = time.time()
+        self.started = 0.0
+        self.finished = 0.0
+        # The upload target (client) and the running PartUploader
+        self.target: Any = None
+        self.uploader: Optional[PartUploader] = None
+
+    @property
+    def uploaded(self) -> int:
+        acked_parts = self.uploader.acked_parts if self.uploader is not None else self.acked_parts
+        uploaded = acked_parts * UPLOAD_PART_SIZE
+        return min(uploaded, self.file_size) if self.file_size is not None else uploaded
+
+    def status(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.time()) - self.started if self.started else 0
+        return {
+            "job_id": self.job_id,
+            "url": self.url,
+            "name": self.name,
+            "state": self.state,
+            "error": self.error or None,
+            "file_size": self.file_size,
+            "ranged": self.ranged,
+            "downloaded": self.downloaded,
+            "uploaded": self.uploaded,
+            "progress": round(self.uploaded / self.file_size, 4) if self.file_size else None,
+            "speed": round(self.downloaded / elapsed) if elapsed else 0,
+            "attempts": self.attempts,
+            "link": self.link or None,
+            "created": self.created,
+            "started": self.started or None,
+            "finished": self.finished or None,
+        }
+
+
+class IngestManager:
+    """
+    Runs ingest jobs, `concurrency` at a time, retrying failed ones from their last acknowledged part.
+    attributes:
+        connections: ranged requests per job at once.
+        segment_size: bytes per ranged request, a multiple of the upload part size.
+        window: segments a job may have downloaded or in flight ahead of its uploader.
+        retries: attempts per segment, and automatic resumes per job.
+        target_factory: returns the upload target of a job, an object with save_part and post like ChannelUpload.
+
+    functions:
+        submit: queues a URL.
+        resume: queues a failed job again, it continues after its acknowledged parts.
+        get: returns a job by id.
+    """
+
+    def __init__(self, connections: int = 4, segment_size: int = 2 * 1024 * 1024, window: int = 8,
+                 retries: int = 3, concurrency: int = 2, max_size: int = 2000 * 1024 * 1024,
+                 target_factory: Callable[[], Any] = ChannelUpload, retry_delay: float = 1.0, job_ttl: float = 86400):
+        self.connections = max(1, connections)
+        self.segment_size = max(UPLOAD_PART_SIZE, segment_size - segment_size % UPLOAD_PART_SIZE)
+        self.window = max(self.connections, window)
+        self.retries = max(1, retries)
+        self.concurrency = max(1, concurrency)
+        self.max_size = max_size
+        self.target_factory = target_factory
+        self.retry_delay = retry_delay
+        self.job_ttl = job_ttl
+        self._jobs: Dict[str, IngestJob] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.ingested_bytes = 0
+
+    def _http(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    def submit(self, url: str, name: str = "") -> IngestJob:
+        if urllib.parse.urlsplit(url).scheme not in ("http", "https"):
+            raise ValueError("Only http and https URLs can be ingested")
+        self._forget_old_jobs()
+        job = IngestJob(secrets.token_urlsafe(9), url, name)
+        self._jobs[job.job_id] = job
+        asyncio.ensure_future(self._run(job))
+        return job
+
+    def resume(self, job_id: str) -> IngestJob:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job.state != FAILED:
+            raise ValueError(f"The job is {job.state}")
+        job.state, job.error, job.finished = QUEUED, "", 0.0
+        asyncio.ensure_future(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    def _forget_old_jobs(self) -> None:
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished > self.job_ttl]:
+            del self._jobs[job_id]
+
+    async def _run(self, job: IngestJob) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        async with self._slots:
+            job.state, job.started = RUNNING, time.time()
+            for attempt in range(self.retries):
+                job.attempts += 1
+                try:
+                    await self._attempt(job)
+                    job.state, job.error = DONE, ""
+                    break
+                except (UploadError, ValueError) as e:
+                    # The source itself is unusable, trying again won't help
+                    job.error = str(e)
+                    break
+                except Exception as e:
+                    job.error = str(e) or type(e).__name__
+                    logging.debug(f"Ingest job {job.job_id} attempt {job.attempts} failed: {job.error}")
+                    if attempt + 1 < self.retries:
+                        await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            if job.state != DONE:
+                job.state = FAILED
+                logging.warning(f"Ingest of {job.url} failed after {job.attempts} attempts: {job.error}")
+            job.finished = time.time()
+
+    async def _probe(self, job: IngestJob) -> None:
+        """Finds the size, type and name of the source and whether it answers Range requests"""
+        async with self._http().get(job.url, headers={"Range": "bytes=0-0"}) as response:
+            if response.status >= 400:
+                raise UploadError(f"The source answered {response.status}")
+            match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+            if response.status == 206 and match:
+                job.file_size, job.ranged = int(match.group(3)), True
+            else:
+                job.file_size, job.ranged = response.content_length, False
+            if response.content_type != "application/octet-stream":
+                job.mime_type = response.content_type
+            if not job.name and response.content_disposition is not None:
+                job.name = response.content_disposition.filename or ""
+        job.name = os.path.basename(job.name) or os.path.basename(urllib.parse.unquote(urllib.parse.urlsplit(job.url).path)) or "file"
+        job.mime_type = job.mime_type or mimetypes.guess_type(job.name)[0] or "application/octet-stream"
+        if job.file_size == 0:
+            raise UploadError("The source is empty")
+        if job.file_size is not None and job.file_size > self.max_size:
+            raise UploadError("File too large")
+        job.probed = True
+
+    async def _attempt(self, job: IngestJob) -> None:
+        from .file_properties import get_download_link
+
+        if not job.probed:
+            await self._probe(job)
+        if job.target is None:
+            job.target = self.target_factory()
+        resumable = job.ranged and job.file_size > SMALL_FILE_SIZE and job.upload_id is not None
+        first_part = job.acked_parts if resumable else 0
+        uploader = PartUploader(job.target.save_part, job.name, job.file_size, Var.UPLOAD_PARTS_IN_FLIGHT,
+                                upload_id=job.upload_id if resumable else None, first_part=first_part)
+        job.upload_id, job.uploader, job.downloaded = uploader.upload_id, uploader, 0
+        index = getattr(job.target, "index", None)
+        if index in work_loads:
+            work_loads[index] += 1
+        try:
+            if job.ranged:
+                chunks = self._download_ranges(job, first_part * UPLOAD_PART_SIZE)
+            else:
+                chunks = self._download(job)
+            # The content hash for dedup is only known when the whole file went through this attempt
+            content_hash = hashlib.sha256() if not first_part else None
+            try:
+                async for chunk in chunks:
+                    if content_hash is not None:
+                        content_hash.update(chunk)
+                    await uploader.write(chunk)
+            finally:
+                await chunks.aclose()
+            input_file = await uploader.finish()
+        finally:
+            job.acked_parts, job.uploader = uploader.acked_parts, None
+            uploader.close()
+            if index in work_loads:
+                work_loads[index] -= 1
+        message = await job.target.post(input_file, job.name, job.mime_type)
+        canonical = CanonicalFile.from_message(message)
+        if content_hash is not None:
+            canonical = await dedup_index.claim("sha256", content_hash.hexdigest(), canonical)
+        job.link = get_download_link(canonical, canonical.channel_id, canonical.message_id)
+        self.ingested_bytes += uploader.received
+        logging.info(f"Ingested {job.url} as {job.name} ({uploader.received} bytes)")
+
+    async def _download(self, job: IngestJob) -> AsyncGenerator[bytes, None]:
+        """The whole source in one request, for sources without Range support"""
+        async with self._http().get(job.url) as response:
+            if response.status != 200:
+                raise IOError(f"The source answered {response.status}")
+            async for chunk in response.content.iter_chunked(UPLOAD_PART_SIZE):
+                job.downloaded += len(chunk)
+                if job.downloaded > self.max_size:
+                    raise UploadError("File too large")
+                yield chunk
+
+    async def _fetch_range(self, job: IngestJob, first: int, last: int) -> bytes:
+        error: Optional[BaseException] = None
+        for attempt in range(self.retries):
+            try:
+                async with self._http().get(job.url, headers={"Range": f"bytes={first}-{last}"}) as response:
+                    if response.status != 206:
+                        raise IOError(f"The source answered {response.status} to a range request")
+                    data = await response.read()
+                if len(data) != last - first + 1:
+                    raise IOError(f"The source sent {len(data)} of {last - first + 1} bytes")
+                job.downloaded += len(data)
+                return data
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                error = e
+                await asyncio.sleep(self.retry_delay * (attempt + 1))
+        raise IOError(f"Bytes {first}-{last} couldn't be downloaded: {error}")
+
+    async def _download_ranges(self, job: IngestJob, start: int) -> AsyncGenerator[bytes, None]:
+        """The source from `start` on, in segments fetched `connections` at once and yielded in order"""
+        segments: List[Tuple[int, int]] = [
+            (offset, min(offset + self.segment_size, job.file_size) - 1)
+            for offset in range(start, job.file_size, self.segment_size)
+        ]
+        loop = asyncio.get_running_loop()
+        results = [loop.create_future() for _ in segments]
+        # A worker takes a slot before it picks the next segment, so the segment the uploader waits for
+        # is always being fetched and never stuck behind segments further ahead
+        slots = asyncio.Semaphore(self.window)
+        order = iter(range(len(segments)))
+
+        async def worker() -> None:
+            while True:
+                await slots.acquire()
+                index = next(order, None)
+                if index is None:
+                    return
+                try:
+                    results[index].set_result(await self._fetch_range(job, *segments[index]))
+                except Exception as e:
+                    results[index].set_exception(e)
+                    return
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(self.connections, len(segments)))]
+        try:
+            for result in results:
+                data = await result
+                slots.release()
+                yield data
+        finally:
+            for task in workers:
+                task.cancel()
+            for result in results:
+                if result.done() and not result.cancelled():
+                    result.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        states = [job.state for job in self._jobs.values()]
+        return {
+            "ingested_bytes": self.ingested_bytes,
+            **{state: states.count(state) for state in (QUEUED, RUNNING, DONE, FAILED)},
+        }
+
+
+ingest_jobs = IngestManager(
+    connections=Var.INGEST_CONNECTIONS,
+    segment_size=Var.INGEST_SEGMENT_SIZE * 1024 * 1024,
+    window=Var.INGEST_BUFFER_SEGMENTS,
+    retries=Var.INGEST_RETRIES,
+    concurrency=Var.INGEST_CONCURRENCY,
+    max_size=Var.UPLOAD_MAX_SIZE * 1024 * 1024,
+)
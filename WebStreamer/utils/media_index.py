@@ -0,0 +1,483 @@
+# Time to byte offset index of MP4 and Matroska files
+# Only the boxes/elements that hold the sample index are read (MP4 moov, Matroska SeekHead, Info and Cues),
+# through the same part fetcher streams use, so a file never has to be downloaded to be seekable.
+
+import sys
+import struct
+import logging
+from array import array
+from bisect import bisect_right
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from pyrogram.file_id import FileId, FileUniqueId, FileUniqueType
+from WebStreamer.vars import Var
+from .cache import LRUCache, MetadataCache
+
+# read(offset, length) -> bytes, shorter at the end of the file
+Reader = Callable[[int, int], Awaitable[bytes]]
+
+# Keyframes closer than this to the previous kept one are dropped, audio tracks have a "keyframe" per packet
+KEYFRAME_SPACING = 0.5
+# Top-level boxes/elements looked at before giving up on finding the index
+MAX_HEADER_READS = 64
+# Files without a usable index are only remembered this long (seconds), a later build may succeed
+EMPTY_INDEX_TTL = 60
+
+MKV_EBML = 0x1A45DFA3
+MKV_SEGMENT = 0x18538067
+MKV_SEEK_HEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_CUES = 0x1C53BB6B
+MKV_CUE_POINT = 0xBB
+MKV_CUE_TIME = 0xB3
+MKV_CUE_TRACK_POSITIONS = 0xB7
+MKV_CUE_CLUSTER_POSITION = 0xF1
+MKV_CLUSTER = 0x1F43B675
+
+
+class MediaIndexError(Exception):
+    """The file isn't a supported container or its index couldn't be read"""
+
+
+class MediaIndex:
+    """
+    Keyframe times and the byte offsets they start at.
+    attributes:
+        container: "mp4", "matroska", or None if the file has no usable index.
+        duration: length in seconds, 0 if unknown.
+        times: keyframe times in seconds, ascending.
+        offsets: byte offset of each keyframe.
+
+    functions:
+        seek: returns the (time, offset) of the last keyframe at or before a time.
+    """
+    __slots__ = ("container", "duration", "times", "offsets")
+
+    def __init__(self, container: Optional[str], duration: float = 0.0,
+                 times: Optional[List[float]] = None, offsets: Optional[List[int]] = None):
+        self.container = container
+        self.duration = duration
+        self.times = times or []
+        self.offsets = offsets or []
+
+    def __bool__(self) -> bool:
+        return bool(self.times)
+
+    def seek(self, seconds: float) -> Tuple[float, int]:
+        if not self.times:
+            raise MediaIndexError("The file has no seek index")
+        position = max(0, bisect_right(self.times, seconds) - 1)
+        return self.times[position], self.offsets[position]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "container": self.container,
+            "duration": round(self.duration, 3),
+            "keyframes": len(self.times),
+        }
+
+
+def thin_keyframes(points: Iterator[Tuple[float, int]]) -> Tuple[List[float], List[int]]:
+    times: List[float] = []
+    offsets: List[int] = []
+    for time, offset in points:
+        if times and time - times[-1] < KEYFRAME_SPACING:
+            continue
+        times.append(time)
+        offsets.append(offset)
+    return times, offsets
+
+
+# ---------------------------------------------------------------- MP4
+
+def iter_boxes(data: bytes, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yields (type, payload start, payload end) of the boxes in data[start:end]"""
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, position)
+        header = 8
+        if size == 1:
+            if position + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, position + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header or position + size > end:
+            return
+        yield box_type, position + header, position + size
+        position += size
+
+
+def find_box(data: bytes, start: int, end: int, box_type: bytes) -> Optional[Tuple[int, int]]:
+    for found, payload_start, payload_end in iter_boxes(data, start, end):
+        if found == box_type:
+            return payload_start, payload_end
+    return None
+
+
+def be_array(data: bytes, start: int, count: int, typecode: str = "I") -> array:
+    values = array(typecode)
+    values.frombytes(data[start:start + count * values.itemsize])
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+
+def parse_mp4_track(moov: bytes, start: int, end: int) -> Optional[Dict[str, Any]]:
+    mdia = find_box(moov, start, end, b"mdia")
+    if mdia is None:
+        return None
+    mdhd = find_box(moov, *mdia, b"mdhd")
+    hdlr = find_box(moov, *mdia, b"hdlr")
+    minf = find_box(moov, *mdia, b"minf")
+    stbl = find_box(moov, *minf, b"stbl") if minf else None
+    if mdhd is None or hdlr is None or stbl is None:
+        return None
+    if moov[mdhd[0]] == 1:
+        timescale, duration = struct.unpack_from(">IQ", moov, mdhd[0] + 20)
+    else:
+        timescale, duration = struct.unpack_from(">II", moov, mdhd[0] + 12)
+    tables = {box_type: (payload_start, payload_end) for box_type, payload_start, payload_end in iter_boxes(moov, *stbl)}
+    return {
+        "handler": moov[hdlr[0] + 8:hdlr[0] + 12],
+        "timescale": timescale,
+        "duration": duration,
+        "tables": tables,
+    }
+
+
+def mp4_sample_sizes(moov: bytes, tables: Dict[bytes, Tuple[int, int]]) -> List[int]:
+    if b"stsz" in tables:
+        start = tables[b"stsz"][0]
+        sample_size, count = struct.unpack_from(">II", moov, start + 4)
+        if sample_size:
+            return [sample_size] * count
+        return list(be_array(moov, start + 12, count))
+    if b"stz2" in tables:
+        start = tables[b"stz2"][0]
+        field_size = moov[start + 7]
+        count = struct.unpack_from(">I", moov, start + 8)[0]
+        if field_size == 16:
+            return list(be_array(moov, start + 12, count, "H"))
+        if field_size == 8:
+            return list(moov[start + 12:start + 12 + count])
+        packed = moov[start + 12:start + 12 + (count + 1) // 2]
+        return [(packed[i // 2] >> (0 if i % 2 else 4)) & 0x0F for i in range(count)]
+    raise MediaIndexError("MP4 track has no sample size table")
+
+
+def mp4_keyframes(moov: bytes, track: Dict[str, Any]) -> Iterator[Tuple[float, int]]:
+    tables = track["tables"]
+    if b"stts" not in tables or b"stsc" not in tables or not (b"stco" in tables or b"co64" in tables):
+        raise MediaIndexError("MP4 track is missing sample tables")
+    timescale = track["timescale"] or 1
+
+    start = tables[b"stts"][0]
+    deltas = be_array(moov, start + 8, 2 * struct.unpack_from(">I", moov, start + 4)[0])
+    start = tables[b"stsc"][0]
+    chunk_runs = be_array(moov, start + 8, 3 * struct.unpack_from(">I", moov, start + 4)[0])
+    if b"co64" in tables:
+        start = tables[b"co64"][0]
+        chunk_offsets = be_array(moov, start + 8, struct.unpack_from(">I", moov, start + 4)[0], "Q")
+    else:
+        start = tables[b"stco"][0]
+        chunk_offsets = be_array(moov, start + 8, struct.unpack_from(">I", moov, start + 4)[0])
+    sizes = mp4_sample_sizes(moov, tables)
+    sync = None
+    if b"stss" in tables:
+        start = tables[b"stss"][0]
+        sync = set(be_array(moov, start + 8, struct.unpack_from(">I", moov, start + 4)[0]))
+
+    # Sample number (1-based) -> decode time, walked alongside the chunk layout
+    stts_entry, stts_left, time = 0, deltas[0] if deltas else 0, 0
+    sample = 1
+    for run in range(0, len(chunk_runs), 3):
+        first_chunk, per_chunk = chunk_runs[run], chunk_runs[run + 1]
+        last_chunk = chunk_runs[run + 3] - 1 if run + 3 < len(chunk_runs) else len(chunk_offsets)
+        for chunk in range(first_chunk, last_chunk + 1):
+            offset = chunk_offsets[chunk - 1]
+            for _ in range(per_chunk):
+                if sample > len(sizes):
+                    return
+                if sync is None or sample in sync:
+                    yield time / timescale, offset
+                offset += sizes[sample - 1]
+                sample += 1
+                while stts_left == 0 and stts_entry + 2 < len(deltas):
+                    stts_entry += 2
+                    stts_left = deltas[stts_entry]
+                if stts_left:
+                    time += deltas[stts_entry + 1]
+                    stts_left -= 1
+
+
+def parse_moov(moov: bytes) -> MediaIndex:
+    """Builds the index from the payload of a moov box"""
+    duration = 0.0
+    mvhd = find_box(moov, 0, len(moov), b"mvhd")
+    if mvhd is not None:
+        if moov[mvhd[0]] == 1:
+            timescale, length = struct.unpack_from(">IQ", moov, mvhd[0] + 20)
+        else:
+            timescale, length = struct.unpack_from(">II", moov, mvhd[0] + 12)
+        duration = length / timescale if timescale else 0.0
+
+    tracks = [
+        track for box_type, start, end in iter_boxes(moov, 0, len(moov)) if box_type == b"trak"
+        for track in [parse_mp4_track(moov, start, end)] if track is not None
+    ]
+    # Seek on the video track, audio-only files on their first audio track
+    track = next((t for t in tracks if t["handler"] == b"vide"), None)
+    track = track or next((t for t in tracks if t["handler"] == b"soun"), None)
+    if track is None:
+        raise MediaIndexError("MP4 has no audio or video track")
+    if not duration and track["timescale"]:
+        duration = track["duration"] / track["timescale"]
+    times, offsets = thin_keyframes(mp4_keyframes(moov, track))
+    return MediaIndex("mp4", duration, times, offsets)
+
+
+async def index_mp4(read: Reader, file_size: int, max_bytes: int) -> MediaIndex:
+    position = 0
+    for _ in range(MAX_HEADER_READS):
+        if position + 8 > file_size:
+            break
+        header = await read(position, 16)
+        if len(header) < 8:
+            break
+        size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - position
+        if size < header_size:
+            break
+        if box_type == b"moov":
+            if size > max_bytes:
+                raise MediaIndexError(f"moov box is too large ({size} bytes)")
+            moov = await read(position + header_size, size - header_size)
+            return parse_moov(moov)
+        if box_type == b"moof":
+            raise MediaIndexError("Fragmented MP4 isn't supported")
+        position += size
+    raise MediaIndexError("MP4 has no moov box")
+
+
+# ---------------------------------------------------------------- Matroska
+
+def read_vint(data: bytes, position: int, keep_marker: bool = False) -> Tuple[Optional[int], int]:
+    """Returns (value, length) of an EBML variable size integer, value is None for the "unknown size" marker"""
+    first = data[position]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or position + length > len(data):
+        raise MediaIndexError("Invalid EBML variable size integer")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[position + 1:position + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def read_element_header(data: bytes, position: int) -> Tuple[int, Optional[int], int]:
+    """Returns (id, data size, header length) of the EBML element at position"""
+    element_id, id_length = read_vint(data, position, keep_marker=True)
+    size, size_length = read_vint(data, position + id_length)
+    return element_id, size, id_length + size_length
+
+
+def iter_elements(data: bytes, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    """Yields (id, data start, data end) of the EBML elements in data[start:end]"""
+    position = start
+    while position < end:
+        element_id, size, header = read_element_header(data, position)
+        data_start = position + header
+        data_end = end if size is None else min(end, data_start + size)
+        yield element_id, data_start, data_end
+        position = data_end
+
+
+def ebml_uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], "big")
+
+
+def ebml_float(data: bytes, start: int, end: int) -> float:
+    if end - start == 4:
+        return struct.unpack(">f", data[start:end])[0]
+    if end - start == 8:
+        return struct.unpack(">d", data[start:end])[0]
+    return 0.0
+
+
+def parse_seek_head(data: bytes) -> Dict[int, int]:
+    """Element id -> position relative to the segment data"""
+    positions = {}
+    for element_id, start, end in iter_elements(data, 0, len(data)):
+        if element_id != MKV_SEEK:
+            continue
+        seek_id = seek_position = None
+        for child_id, child_start, child_end in iter_elements(data, start, end):
+            if child_id == MKV_SEEK_ID:
+                seek_id = ebml_uint(data, child_start, child_end)
+            elif child_id == MKV_SEEK_POSITION:
+                seek_position = ebml_uint(data, child_start, child_end)
+        if seek_id is not None and seek_position is not None:
+            positions.setdefault(seek_id, seek_position)
+    return positions
+
+
+def parse_info(data: bytes) -> Tuple[int, float]:
+    """Returns (timecode scale in ns, duration in timecode scale units)"""
+    scale, duration = 1000000, 0.0
+    for element_id, start, end in iter_elements(data, 0, len(data)):
+        if element_id == MKV_TIMECODE_SCALE:
+            scale = ebml_uint(data, start, end) or scale
+        elif element_id == MKV_DURATION:
+            duration = ebml_float(data, start, end)
+    return scale, duration
+
+
+def parse_cues(data: bytes, segment_start: int, scale: int) -> Iterator[Tuple[float, int]]:
+    for element_id, start, end in iter_elements(data, 0, len(data)):
+        if element_id != MKV_CUE_POINT:
+            continue
+        time = cluster = None
+        for child_id, child_start, child_end in iter_elements(data, start, end):
+            if child_id == MKV_CUE_TIME:
+                time = ebml_uint(data, child_start, child_end)
+            elif child_id == MKV_CUE_TRACK_POSITIONS and cluster is None:
+                for position_id, position_start, position_end in iter_elements(data, child_start, child_end):
+                    if position_id == MKV_CUE_CLUSTER_POSITION:
+                        cluster = ebml_uint(data, position_start, position_end)
+        if time is not None and cluster is not None:
+            yield time * scale / 1e9, segment_start + cluster
+
+
+async def read_element(read: Reader, position: int) -> Tuple[int, Optional[int], int]:
+    """Reads the header of the element at position, returns (id, data size, header length)"""
+    head = await read(position, 16)
+    if not head:
+        raise MediaIndexError("Unexpected end of file")
+    return read_element_header(head, 0)
+
+
+async def index_matroska(read: Reader, file_size: int, max_bytes: int) -> MediaIndex:
+    element_id, size, header = await read_element(read, 0)
+    if element_id != MKV_EBML or size is None:
+        raise MediaIndexError("Not an EBML file")
+    position = header + size
+    element_id, _, header = await read_element(read, position)
+    if element_id != MKV_SEGMENT:
+        raise MediaIndexError("Matroska file has no segment")
+    segment_start = position + header
+
+    positions: Dict[int, int] = {}
+    found: Dict[int, bytes] = {}
+
+    async def load(element_position: int, expected_id: int) -> Optional[bytes]:
+        element_id, size, header = await read_element(read, element_position)
+        if element_id != expected_id or size is None:
+            return None
+        if size > max_bytes:
+            raise MediaIndexError(f"Matroska element {expected_id:#x} is too large ({size} bytes)")
+        return await read(element_position + header, size)
+
+    # Walk the top-level elements up to the first cluster, the SeekHead there says where the rest is
+    position = segment_start
+    for _ in range(MAX_HEADER_READS):
+        if position >= file_size:
+            break
+        element_id, size, header = await read_element(read, position)
+        if element_id == MKV_CLUSTER or size is None:
+            break
+        if element_id in (MKV_SEEK_HEAD, MKV_INFO, MKV_CUES) and element_id not in found:
+            if size > max_bytes:
+                raise MediaIndexError(f"Matroska element {element_id:#x} is too large ({size} bytes)")
+            found[element_id] = await read(position + header, size)
+            if element_id == MKV_SEEK_HEAD:
+                positions = parse_seek_head(found[element_id])
+        position += header + size
+
+    for element_id in (MKV_INFO, MKV_CUES):
+        if element_id not in found and element_id in positions:
+            data = await load(segment_start + positions[element_id], element_id)
+            if data is not None:
+                found[element_id] = data
+    if MKV_CUES not in found:
+        raise MediaIndexError("Matroska file has no cues")
+
+    scale, duration = parse_info(found.get(MKV_INFO, b""))
+    times, offsets = thin_keyframes(parse_cues(found[MKV_CUES], segment_start, scale))
+    return MediaIndex("matroska", duration * scale / 1e9, times, offsets)
+
+
+# ---------------------------------------------------------------- Entry point
+
+def buffered_reader(read: Reader, block_size: int = 64 * 1024) -> Reader:
+    """Wraps a reader so the many small header reads of a parse are served from one fetched block"""
+    block = [0, b""]
+
+    async def buffered_read(offset: int, length: int) -> bytes:
+        start, data = block
+        if start <= offset and offset + length <= start + len(data):
+            return data[offset - start:offset - start + length]
+        if length >= block_size:
+            return await read(offset, length)
+        block[:] = [offset, await read(offset, block_size)]
+        return block[1][:length]
+
+    return buffered_read
+
+
+async def build_media_index(read: Reader, file_size: int, max_bytes: int) -> MediaIndex:
+    """Sniffs the container and builds its index, files without one get an empty MediaIndex"""
+    head = await read(0, 12)
+    try:
+        if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide"):
+            return await index_mp4(read, file_size, max_bytes)
+        if head[:4] == b"\x1a\x45\xdf\xa3":
+            return await index_matroska(read, file_size, max_bytes)
+    except (MediaIndexError, struct.error, IndexError) as e:
+        logging.debug(f"Couldn't index media: {e}")
+    return MediaIndex(None)
+
+
+def unique_id_of(file_id: FileId) -> str:
+    """The file_unique_id Telegram assigns to a document, video or audio file"""
+    return FileUniqueId(file_unique_type=FileUniqueType.DOCUMENT, media_id=file_id.media_id).encode()
+
+
+# Parsed indexes keyed by file_unique_id, the sample layout of a file never changes
+media_indexes = MetadataCache(max_size=Var.MEDIA_INDEX_CACHE_SIZE, ttl=0)
+# Empty indexes by file_unique_id, kept briefly so files that can't be indexed aren't read on every request
+empty_indexes = LRUCache(max_size=Var.MEDIA_INDEX_CACHE_SIZE, ttl=EMPTY_INDEX_TTL)
+
+
+async def load_media_index(key: str, read: Reader, file_size: int, max_bytes: int) -> MediaIndex:
+    """
+    Returns the cached index of a file, building it on first use. Only usable indexes are kept for good,
+    a file of unknown size isn't read at all and an empty index is built again after EMPTY_INDEX_TTL.
+    """
+    if file_size <= 0:
+        return MediaIndex(None)
+    empty = empty_indexes.get(key)
+    if empty is not None:
+        return empty
+
+    async def build() -> Optional[MediaIndex]:
+        index = await build_media_index(read, file_size, max_bytes)
+        if not index:
+            empty_indexes.set(key, index)
+            return None
+        return index
+
+    return await media_indexes.get_or_load(key, build) or empty_indexes.get(key) or MediaIndex(None)
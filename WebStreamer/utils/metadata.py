@@ -0,0 +1,212 @@
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+from WebStreamer.vars import Var
+from pyrogram.file_id import FileId
+from .cache import LRUCache, MetadataCache
+from .metadata_store import metadata_store
+
+
+class FileMetadata:
+    """
+    Metadata of a media file shared by all clients.
+    attributes:
+        unique_id, file_size, mime_type, file_name, dc_id: bot-independent properties of the media.
+        file_ids: FileId objects keyed by the name of the client that resolved them.
+            Any client can stream with any of them, the newest reference is the least likely to be expired.
+        ref_times: when each client's file_reference was obtained.
+    """
+    __slots__ = ("unique_id", "file_size", "mime_type", "file_name", "dc_id", "file_ids", "ref_times")
+
+    def __init__(self, unique_id: str, file_size: int, mime_type: str, file_name: str, dc_id: int):
+        self.unique_id = unique_id
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.file_name = file_name
+        self.dc_id = dc_id
+        self.file_ids: Dict[str, FileId] = {}
+        self.ref_times: Dict[str, float] = {}
+
+    @classmethod
+    def from_file_id(cls, client_key: str, file_id: FileId) -> "FileMetadata":
+        metadata = cls(
+            unique_id=getattr(file_id, "unique_id", ""),
+            file_size=getattr(file_id, "file_size", 0),
+            mime_type=getattr(file_id, "mime_type", ""),
+            file_name=getattr(file_id, "file_name", ""),
+            dc_id=file_id.dc_id,
+        )
+        metadata.add_file_id(client_key, file_id)
+        return metadata
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "FileMetadata":
+        file_id = FileId.decode(record["file_id"])
+        setattr(file_id, "file_size", record["file_size"] or 0)
+        setattr(file_id, "mime_type", record["mime_type"] or "")
+        setattr(file_id, "file_name", record["file_name"] or "")
+        setattr(file_id, "unique_id", record["unique_id"])
+        setattr(file_id, "file_id", record["file_id"])
+        metadata = cls.from_file_id(record["client_key"] or "", file_id)
+        metadata.ref_times[record["client_key"] or ""] = record["ref_time"] or 0
+        return metadata
+
+    def add_file_id(self, client_key: str, file_id: FileId) -> None:
+        self.file_ids[client_key] = file_id
+        self.ref_times[client_key] = time.time()
+
+    def merge(self, other: "FileMetadata") -> None:
+        """Takes over the FileIds of another entry of the same file, keeping the newer reference of each client"""
+        for client_key, file_id in other.file_ids.items():
+            ref_time = other.ref_times.get(client_key, 0)
+            if ref_time >= self.ref_times.get(client_key, 0):
+                self.file_ids[client_key] = file_id
+                self.ref_times[client_key] = ref_time
+
+    def file_id_for(self, client_key: str) -> Optional[FileId]:
+        return self.file_ids.get(client_key)
+
+    def any_file_id(self) -> Optional[FileId]:
+        # Most recently resolved reference first
+        if not self.file_ids:
+            return None
+        client_key = max(self.ref_times, key=self.ref_times.get)
+        return self.file_ids[client_key]
+
+
+# Process-wide metadata layer shared by every ByteStreamer
+# Format: {(channel_id, message_id): FileMetadata}
+file_metadata = MetadataCache(
+    max_size=Var.METADATA_CACHE_SIZE,
+    ttl=Var.METADATA_CACHE_TTL,
+    stale_ttl=Var.METADATA_CACHE_STALE_TTL,
+)
+
+# Secondary index of the same entries by Telegram's file_unique_id
+# Format: {unique_id: FileMetadata}
+unique_index = LRUCache(max_size=Var.METADATA_CACHE_SIZE)
+
+
+def remember_file_id(channel_id: int, message_id: int, client_key: str, file_id: FileId) -> FileMetadata:
+    """
+    Records a freshly resolved FileId in the shared cache and queues it for the persistent store.
+    """
+    key = (int(channel_id), int(message_id))
+    metadata = file_metadata.peek(key)
+    if metadata is None:
+        metadata = FileMetadata.from_file_id(client_key, file_id)
+        file_metadata.set(key, metadata)
+    else:
+        metadata.add_file_id(client_key, file_id)
+    if metadata.unique_id:
+        unique_index.set(metadata.unique_id, metadata)
+    metadata_store.put({
+        "channel_id": key[0],
+        "message_id": key[1],
+        "unique_id": metadata.unique_id,
+        "file_id": getattr(file_id, "file_id", ""),
+        "file_size": metadata.file_size,
+        "mime_type": metadata.mime_type,
+        "file_name": metadata.file_name,
+        "dc_id": metadata.dc_id,
+        "client_key": client_key,
+    })
+    return metadata
+
+
+def alias_metadata(channel_id: int, message_id: int, canonical_channel_id: int, canonical_message_id: int,
+                   file_name: str = "") -> Optional[FileMetadata]:
+    """
+    Makes the cache entry of a duplicate message the entry of its canonical message, the FileIds of both are merged.
+    """
+    key = (int(channel_id), int(message_id))
+    canonical_key = (int(canonical_channel_id), int(canonical_message_id))
+    metadata = file_metadata.peek(key)
+    canonical = file_metadata.peek(canonical_key)
+    if key == canonical_key or metadata is canonical:
+        return canonical
+    if canonical is None:
+        if metadata is None:
+            return None
+        canonical = FileMetadata(metadata.unique_id, metadata.file_size, metadata.mime_type,
+                                 file_name or metadata.file_name, metadata.dc_id)
+        file_metadata.set(canonical_key, canonical)
+    if metadata is not None:
+        canonical.merge(metadata)
+    file_metadata.set(key, canonical)
+    if canonical.unique_id:
+        unique_index.set(canonical.unique_id, canonical)
+    return canonical
+
+
+def _metadata_from_record(record: Optional[Dict[str, Any]]) -> Optional[FileMetadata]:
+    if not record or not record.get("file_id"):
+        return None
+    if time.time() - (record.get("ref_time") or 0) > Var.METADATA_REF_MAX_AGE:
+        return None
+    try:
+        return FileMetadata.from_record(record)
+    except Exception as e:
+        logging.debug(f"Ignoring unreadable stored record for message {record.get('message_id')}: {e}")
+        return None
+
+
+async def load_stored_metadata(channel_id: int, message_id: int) -> Optional[FileMetadata]:
+    """
+    Returns the metadata of a message from the persistent store if its file reference is recent enough.
+    """
+    return _metadata_from_record(await metadata_store.get(int(channel_id), int(message_id)))
+
+
+async def load_stored_metadata_many(channel_id: int, message_ids: List[int]) -> Dict[int, FileMetadata]:
+    """
+    Batch version of load_stored_metadata for many messages of one channel.
+    """
+    records = await metadata_store.get_many(int(channel_id), message_ids)
+    loaded = {}
+    for message_id, record in records.items():
+        metadata = _metadata_from_record(record)
+        if metadata is not None:
+            loaded[message_id] = metadata
+    return loaded
+
+
+async def lookup_by_unique_id(unique_id: str) -> Optional[FileMetadata]:
+    """
+    Returns the size, name and mime type of a file by its file_unique_id, from memory or the persistent store.
+    Only the bot-independent properties are meant to be used, so the reference age doesn't matter.
+    """
+    metadata = unique_index.get(unique_id)
+    if metadata is not None:
+        return metadata
+    record = await metadata_store.get_by_unique_id(unique_id)
+    if not record or not record.get("file_size"):
+        return None
+    try:
+        metadata = FileMetadata.from_record(record)
+    except Exception as e:
+        logging.debug(f"Ignoring unreadable stored record for unique id {unique_id}: {e}")
+        return None
+    unique_index.set(unique_id, metadata)
+    return metadata
+
+
+async def warm_metadata_cache(page_size: int = 500) -> None:
+    """
+    Lazily pages the most recent stored entries into the shared cache after startup.
+    """
+    loaded = 0
+    async for records in metadata_store.iter_pages(page_size, limit=Var.METADATA_CACHE_SIZE):
+        for record in records:
+            key = (record["channel_id"], record["message_id"])
+            if key in file_metadata or not record.get("file_id"):
+                continue
+            try:
+                file_metadata.set(key, FileMetadata.from_record(record))
+                loaded += 1
+            except Exception:
+                continue
+        # Yield to live requests between pages
+        await asyncio.sleep(0.1)
+    logging.info(f"Paged {loaded} stored metadata entries into the cache")
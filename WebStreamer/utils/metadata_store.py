@@ -0,0 +1,250 @@
+# Persistent SQLite index of resolved files
+# All database access runs on a single dedicated thread so the event loop never blocks
+
+import time
+import sqlite3
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from WebStreamer.vars import Var
+
+COLUMNS = (
+    "channel_id", "message_id", "unique_id", "file_id", "file_size",
+    "mime_type", "file_name", "dc_id", "client_key", "ref_time",
+)
+CANONICAL_COLUMNS = (
+    "key", "channel_id", "message_id", "unique_id", "file_id",
+    "file_size", "mime_type", "file_name", "created",
+)
+
+
+class MetadataStore:
+    """
+    Persistent (channel_id, message_id) -> file metadata index.
+    attributes:
+        path: path of the SQLite database, an empty path disables the store.
+        flush_interval: seconds between batched writes.
+        batch_size: pending records that trigger an early flush.
+
+    functions:
+        put: queues a record, never blocks.
+        get: returns a stored record or None.
+        get_by_unique_id: returns the latest stored record of a file_unique_id or None.
+        iter_pages: yields stored records page by page, most recent first.
+        claim_canonical: records the canonical file of a dedup key unless one exists, returns the one that's kept.
+        get_canonical: returns the canonical file of a dedup key or None.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 2.0, batch_size: int = 500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metadata_db_")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        self._flush_event = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self._conn is not None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> None:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                unique_id TEXT,
+                file_id TEXT,
+                file_size INTEGER,
+                mime_type TEXT,
+                file_name TEXT,
+                dc_id INTEGER,
+                client_key TEXT,
+                ref_time REAL,
+                PRIMARY KEY (channel_id, message_id)
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS files_unique_id ON files (unique_id)")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS canonical_files (
+                key TEXT PRIMARY KEY,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                unique_id TEXT,
+                file_id TEXT,
+                file_size INTEGER,
+                mime_type TEXT,
+                file_name TEXT,
+                created REAL
+            )"""
+        )
+        conn.commit()
+        self._conn = conn
+
+    async def start(self) -> None:
+        if not self.path:
+            logging.info("Metadata store disabled (METADATA_DB is empty)")
+            return
+        await self._run(self._open)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logging.info(f"Metadata store opened at {self.path}")
+
+    async def close(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._conn is None:
+            return
+        await self.flush()
+        await self._run(self._conn.close)
+        self._conn = None
+
+    def put(self, record: Dict[str, Any]) -> None:
+        """Queue a record for the next batched write. Later records for the same key win."""
+        if not self.path:
+            return
+        record.setdefault("ref_time", time.time())
+        self._pending[(record["channel_id"], record["message_id"])] = record
+        if len(self._pending) >= self.batch_size:
+            self._flush_event.set()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Failed to flush metadata store: {e}")
+
+    def _write(self, rows: List[Tuple]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                f"REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+
+    async def flush(self) -> None:
+        if not self._pending or self._conn is None:
+            return
+        pending, self._pending = self._pending, {}
+        rows = [tuple(record.get(column) for column in COLUMNS) for record in pending.values()]
+        await self._run(self._write, rows)
+        logging.debug(f"Flushed {len(rows)} records to the metadata store")
+
+    def _select(self, query: str, params: Tuple) -> List[Dict[str, Any]]:
+        cursor = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM files {query}", params)
+        return [dict(zip(COLUMNS, row)) for row in cursor.fetchall()]
+
+    async def get(self, channel_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+        pending = self._pending.get((channel_id, message_id))
+        if pending is not None:
+            return pending
+        if self._conn is None:
+            return None
+        rows = await self._run(
+            self._select, "WHERE channel_id = ? AND message_id = ?", (channel_id, message_id)
+        )
+        return rows[0] if rows else None
+
+    async def get_by_unique_id(self, unique_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the most recently resolved record of a file by its unique id."""
+        for record in self._pending.values():
+            if record.get("unique_id") == unique_id:
+                return record
+        if self._conn is None:
+            return None
+        rows = await self._run(
+            self._select, "WHERE unique_id = ? ORDER BY ref_time DESC LIMIT 1", (unique_id,)
+        )
+        return rows[0] if rows else None
+
+    async def get_many(self, channel_id: int, message_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Returns the stored records of many messages of one channel, keyed by message id."""
+        records = {}
+        missing = []
+        for message_id in message_ids:
+            pending = self._pending.get((channel_id, message_id))
+            if pending is not None:
+                records[message_id] = pending
+            else:
+                missing.append(message_id)
+        if missing and self._conn is not None:
+            # Stay well below SQLite's bound parameter limit
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                rows = await self._run(
+                    self._select,
+                    f"WHERE channel_id = ? AND message_id IN ({', '.join('?' * len(chunk))})",
+                    (channel_id, *chunk),
+                )
+                records.update((row["message_id"], row) for row in rows)
+        return records
+
+    def _select_canonical(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            f"SELECT {', '.join(CANONICAL_COLUMNS)} FROM canonical_files WHERE key = ?", (key,)
+        ).fetchone()
+        return dict(zip(CANONICAL_COLUMNS, row)) if row else None
+
+    def _claim_canonical(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        with self._conn:
+            self._conn.execute(
+                f"INSERT OR IGNORE INTO canonical_files ({', '.join(CANONICAL_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(CANONICAL_COLUMNS))})",
+                tuple(record.get(column) for column in CANONICAL_COLUMNS),
+            )
+        return self._select_canonical(record["key"])
+
+    async def claim_canonical(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Makes `record` the canonical file of its dedup key if the key has none yet.
+        Returns the canonical record, the first one claimed wins. Without a database the record is returned as is.
+        """
+        if self._conn is None:
+            return record
+        record.setdefault("created", time.time())
+        return await self._run(self._claim_canonical, record)
+
+    async def get_canonical(self, key: str) -> Optional[Dict[str, Any]]:
+        if self._conn is None:
+            return None
+        return await self._run(self._select_canonical, key)
+
+    async def channel_ids(self) -> List[int]:
+        """Returns every channel that has stored files."""
+        if self._conn is None:
+            return []
+        rows = await self._run(
+            lambda: self._conn.execute("SELECT DISTINCT channel_id FROM files").fetchall()
+        )
+        return [row[0] for row in rows]
+
+    async def iter_pages(self, page_size: int = 500, limit: int = 0):
+        """Yield stored records page by page, most recently resolved first."""
+        if self._conn is None:
+            return
+        offset = 0
+        while not limit or offset < limit:
+            size = min(page_size, limit - offset) if limit else page_size
+            rows = await self._run(
+                self._select, "ORDER BY ref_time DESC LIMIT ? OFFSET ?", (size, offset)
+            )
+            if not rows:
+                break
+            yield rows
+            offset += len(rows)
+
+
+metadata_store = MetadataStore(Var.METADATA_DB, flush_interval=Var.METADATA_DB_FLUSH_INTERVAL)
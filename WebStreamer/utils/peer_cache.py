@@ -0,0 +1,186 @@
+# Positive/negative cache of peer resolution, shared by all clients
+import asyncio
+import logging
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+from pyrogram import Client, raw, utils
+from WebStreamer.vars import Var
+from .cache import LRUCache
+
+
+async def resolve_peer_with_raw_api(client: Client, chat_id: int) -> bool:
+    """
+    Force resolve peer using raw Telegram API.
+    This fetches the channel information and caches it in the session.
+    """
+    try:
+        # Convert the chat_id to the proper channel_id format
+        channel_id = utils.get_channel_id(chat_id)
+        
+        logging.info(f"Attempting to resolve peer using raw API for chat_id={chat_id}, channel_id={channel_id}")
+        
+        # Try to get the channel using raw API with access_hash=0
+        # This forces Telegram to resolve the peer
+        try:
+            result = await client.invoke(
+                raw.functions.channels.GetChannels(
+                    id=[raw.types.InputChannel(
+                        channel_id=channel_id,
+                        access_hash=0
+                    )]
+                )
+            )
+            logging.info(f"Successfully resolved peer using GetChannels for {chat_id}")
+            return True
+        except Exception as e1:
+            logging.warning(f"GetChannels with access_hash=0 failed: {e1}")
+            
+            # Alternative: Try getting recent messages/history to cache the peer
+            try:
+                result = await client.invoke(
+                    raw.functions.messages.GetHistory(
+                        peer=raw.types.InputPeerChannel(
+                            channel_id=channel_id,
+                            access_hash=0
+                        ),
+                        offset_id=0,
+                        offset_date=0,
+                        add_offset=0,
+                        limit=1,
+                        max_id=0,
+                        min_id=0,
+                        hash=0
+                    )
+                )
+                logging.info(f"Successfully resolved peer using GetHistory for {chat_id}")
+                return True
+            except Exception as e2:
+                logging.error(f"GetHistory also failed: {e2}")
+                return False
+                
+    except Exception as e:
+        logging.error(f"Failed to resolve peer with raw API: {e}")
+        return False
+
+
+class PeerCache:
+    """
+    Remembers which channels each client could or couldn't resolve.
+    attributes:
+        resolved: (client name, chat_id) -> access_hash of peers resolved within `ttl` seconds.
+        failed: (client name, chat_id) of peers that couldn't be resolved within `negative_ttl` seconds.
+
+    functions:
+        resolve: makes sure a client can address a chat, running the resolution chain only when needed.
+        prewarm: resolves a set of chats for every client ahead of the first request.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int = 10000):
+        self.resolved = LRUCache(max_size=max_size, ttl=ttl)
+        self.failed = LRUCache(max_size=max_size, ttl=negative_ttl)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(client: Client, chat_id: int) -> Tuple[str, int]:
+        return client.name, int(chat_id)
+
+    def is_unresolvable(self, client: Client, chat_id: int) -> bool:
+        return self._key(client, chat_id) in self.failed
+
+    def mark_seen(self, client: Client, chat_id: int) -> None:
+        """A client received an update from the chat, so its session knows the peer."""
+        key = self._key(client, chat_id)
+        self.failed.pop(key)
+        if key not in self.resolved:
+            self.resolved.set(key, None)
+
+    async def resolve(self, client: Client, chat_id: int, force: bool = False) -> bool:
+        """
+        Returns True if the client can address the chat.
+        force skips the positive cache, it's used after Telegram rejected the stored peer.
+        """
+        key = self._key(client, chat_id)
+        if self.failed.get(key) is not None:
+            return False
+        if not force and self.resolved.get(key, False) is not False:
+            return True
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._resolve(client, int(chat_id), force))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _restore(self, client: Client, chat_id: int, access_hash: int) -> bool:
+        # Seed the client's session with an access hash it resolved before
+        try:
+            await client.storage.update_peers([(chat_id, access_hash, "channel", [], None)])
+            return True
+        except Exception as e:
+            logging.debug(f"Could not restore peer {chat_id} for client {client.name}: {e}")
+            return False
+
+    async def _resolve(self, client: Client, chat_id: int, force: bool) -> bool:
+        key = self._key(client, chat_id)
+        access_hash = self.resolved.peek(key)
+        if force and access_hash and await self._restore(client, chat_id, access_hash):
+            logging.debug(f"Restored cached peer {chat_id} for client {client.name}")
+            # Only reuse a cached hash once, a second rejection runs the full chain
+            self.resolved.pop(key)
+            return True
+
+        if not force:
+            try:
+                peer = await client.resolve_peer(chat_id)
+                self.resolved.set(key, getattr(peer, "access_hash", None))
+                return True
+            except Exception:
+                pass
+
+        resolved = await resolve_peer_with_raw_api(client, chat_id)
+        if not resolved:
+            try:
+                # Try to resolve peer by getting chat info
+                await client.get_chat(chat_id)
+                logging.info(f"Successfully resolved peer by getting chat info for {chat_id}")
+                resolved = True
+            except Exception as chat_error:
+                logging.warning(f"Failed to get chat info for {chat_id}: {chat_error}")
+
+        if not resolved:
+            self.failed.set(key, True)
+            return False
+        try:
+            peer = await client.resolve_peer(chat_id)
+            access_hash = getattr(peer, "access_hash", None)
+        except Exception:
+            access_hash = None
+        self.resolved.set(key, access_hash)
+        return True
+
+    async def prewarm(self, clients: Iterable[Client], chat_ids: Iterable[int], concurrency: int = 4) -> None:
+        """Resolve every chat for every client, a few at a time."""
+        semaphore = asyncio.Semaphore(concurrency)
+        chat_ids = list(dict.fromkeys(int(chat_id) for chat_id in chat_ids if chat_id))
+
+        async def _warm(client: Client, chat_id: int) -> bool:
+            async with semaphore:
+                try:
+                    return await self.resolve(client, chat_id)
+                except Exception as e:
+                    logging.debug(f"Pre-resolving {chat_id} for client {client.name} failed: {e}")
+                    return False
+
+        jobs = [_warm(client, chat_id) for client in clients for chat_id in chat_ids]
+        results = await asyncio.gather(*jobs)
+        logging.info(f"Pre-resolved {sum(results)}/{len(results)} channel peers")
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        return {
+            "resolved": len(self.resolved),
+            "unresolvable": len(self.failed),
+            "hits": self.resolved.hits,
+            "negative_hits": self.failed.hits,
+        }
+
+
+peer_cache = PeerCache(ttl=Var.PEER_CACHE_TTL, negative_ttl=Var.PEER_NEGATIVE_TTL)
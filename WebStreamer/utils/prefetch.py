@@ -0,0 +1,263 @@
+# Background prefetch of whole files into the chunk cache
+# A job pulls every part of a file with all clients in parallel, within a shared bandwidth budget.
+# Jobs are saved as JSON next to the cache, progress is read from the cache's part bitmap,
+# so a restart picks unfinished jobs up where they stopped.
+
+import os
+import json
+import time
+import asyncio
+import logging
+import secrets
+from typing import Any, Callable, Dict, List, Optional
+from pyrogram.file_id import FileId
+from WebStreamer.vars import Var
+from WebStreamer.bot import multi_clients, work_loads
+from .chunk_cache import chunk_cache, cache_key, PART_SIZE
+from .rate_limit import TokenBucket
+from .scheduler import BULK
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class PrefetchJob:
+    """
+    A file to pull into the chunk cache.
+    attributes:
+        job_id: random id used in the status URL.
+        file_id: FileId of the file, with file_size set.
+        name: file name, for display only.
+        state: queued, running, done or failed.
+    """
+    __slots__ = ("job_id", "file_id", "name", "state", "error", "created", "started", "finished", "fetched")
+
+    def __init__(self, job_id: str, file_id: FileId, name: str = "", state: str = QUEUED,
+                 error: str = "", created: float = 0, started: float = 0, finished: float = 0):
+        self.job_id = job_id
+        self.file_id = file_id
+        self.name = name
+        self.state = state
+        self.error = error
+        self.created = created or time.time()
+        self.started = started
+        self.finished = finished
+        # Bytes fetched by this run, the rest came from the cache
+        self.fetched = 0
+
+    @property
+    def file_size(self) -> int:
+        return getattr(self.file_id, "file_size", 0)
+
+    @property
+    def part_count(self) -> int:
+        return (self.file_size + PART_SIZE - 1) // PART_SIZE
+
+    def parts_cached(self) -> int:
+        return sum(chunk_cache.has_part(self.file_id, self.file_size, i) for i in range(self.part_count))
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "file_id": self.file_id.encode(),
+            "file_size": self.file_size,
+            "name": self.name,
+            "state": self.state,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "PrefetchJob":
+        file_id = FileId.decode(data["file_id"])
+        setattr(file_id, "file_size", int(data["file_size"]))
+        return cls(data["job_id"], file_id, data.get("name", ""), data.get("state", QUEUED), data.get("error", ""),
+                   data.get("created", 0), data.get("started", 0), data.get("finished", 0))
+
+    def status(self) -> Dict[str, Any]:
+        parts_cached = self.parts_cached() if self.state != DONE else self.part_count
+        elapsed = (self.finished or time.time()) - self.started if self.started else 0
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "state": self.state,
+            "error": self.error or None,
+            "file_size": self.file_size,
+            "parts": self.part_count,
+            "parts_cached": parts_cached,
+            "progress": round(parts_cached / self.part_count, 4) if self.part_count else 1.0,
+            "fetched_bytes": self.fetched,
+            "speed": round(self.fetched / elapsed) if elapsed else 0,
+            "created": self.created,
+            "started": self.started or None,
+            "finished": self.finished or None,
+        }
+
+
+class PrefetchManager:
+    """
+    Runs prefetch jobs one after another, each with all clients.
+    attributes:
+        bandwidth: bytes per second all prefetches share, 0 for no limit.
+        parts_per_client: parts each client fetches at once.
+        job_ttl: seconds finished jobs are remembered.
+
+    functions:
+        start: loads saved jobs and starts the runner.
+        submit: queues a file, returns the existing job if the file is already queued or running.
+        get: returns a job by id.
+    """
+
+    def __init__(self, bandwidth: int, parts_per_client: int = 2, job_ttl: float = 86400):
+        self.bandwidth = bandwidth
+        self.parts_per_client = max(1, parts_per_client)
+        self.job_ttl = job_ttl
+        self._jobs: Dict[str, PrefetchJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._streamer_for: Optional[Callable[[int], Any]] = None
+        self._bucket = TokenBucket(bandwidth, max(bandwidth, PART_SIZE)) if bandwidth else None
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(chunk_cache.directory, "prefetch")
+
+    @property
+    def started(self) -> bool:
+        return self._runner is not None
+
+    async def start(self, streamer_for: Callable[[int], Any]) -> None:
+        self._streamer_for = streamer_for
+        self._queue = asyncio.Queue()
+        if chunk_cache.enabled:
+            jobs = await asyncio.get_running_loop().run_in_executor(None, self._load_jobs)
+            for job in sorted(jobs, key=lambda job: job.created):
+                self._jobs[job.job_id] = job
+                if job.state in (QUEUED, RUNNING):
+                    job.state = QUEUED
+                    self._queue.put_nowait(job)
+            if jobs:
+                logging.info(f"Loaded {len(jobs)} prefetch jobs, {self._queue.qsize()} to resume")
+        self._runner = asyncio.ensure_future(self._run())
+
+    def _load_jobs(self) -> List[PrefetchJob]:
+        os.makedirs(self.directory, exist_ok=True)
+        jobs = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    job = PrefetchJob.from_json(json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                logging.debug(f"Dropping unreadable prefetch job {name}: {e}")
+                os.remove(path)
+                continue
+            if job.finished and time.time() - job.finished > self.job_ttl:
+                os.remove(path)
+                continue
+            jobs.append(job)
+        return jobs
+
+    def _write_job(self, data: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{data['job_id']}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    async def _save(self, job: PrefetchJob) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_job, job.to_json())
+        except OSError as e:
+            logging.warning(f"Failed to save prefetch job {job.job_id}: {e}")
+
+    def submit(self, file_id: FileId, name: str = "") -> PrefetchJob:
+        if not self.started or not chunk_cache.enabled:
+            raise RuntimeError("Prefetching needs the chunk cache")
+        file_size = getattr(file_id, "file_size", 0)
+        if not file_size or cache_key(file_id) is None:
+            raise ValueError("The file size is unknown")
+        if file_size > chunk_cache.max_bytes:
+            raise ValueError("The file is larger than the chunk cache")
+        key = cache_key(file_id)
+        for job in self._jobs.values():
+            if job.state in (QUEUED, RUNNING) and cache_key(job.file_id) == key and job.file_size == file_size:
+                return job
+        self._forget_old_jobs()
+        job = PrefetchJob(secrets.token_urlsafe(9), file_id, name)
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait(job)
+        asyncio.ensure_future(self._save(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[PrefetchJob]:
+        return self._jobs.get(job_id)
+
+    def _forget_old_jobs(self) -> None:
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished > self.job_ttl]:
+            del self._jobs[job_id]
+            try:
+                os.remove(os.path.join(self.directory, f"{job_id}.json"))
+            except OSError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.state, job.started, job.fetched = RUNNING, time.time(), 0
+            await self._save(job)
+            try:
+                await self._prefetch(job)
+                job.state = DONE
+                logging.info(f"Prefetched {job.name or cache_key(job.file_id)} ({job.fetched} bytes fetched)")
+            except Exception as e:
+                job.state, job.error = FAILED, str(e) or type(e).__name__
+                logging.warning(f"Prefetch job {job.job_id} failed: {job.error}")
+            job.finished = time.time()
+            await self._save(job)
+
+    async def _prefetch(self, job: PrefetchJob) -> None:
+        missing = iter([i for i in range(job.part_count)
+                        if not chunk_cache.has_part(job.file_id, job.file_size, i)])
+
+        async def worker(index: int) -> None:
+            streamer = self._streamer_for(index)
+            for part_index in missing:
+                if self._bucket is not None:
+                    await self._bucket.consume(min(PART_SIZE, job.file_size - part_index * PART_SIZE))
+                work_loads[index] += 1
+                try:
+                    if await streamer.fill_part(job.file_id, part_index, BULK):
+                        job.fetched += min(PART_SIZE, job.file_size - part_index * PART_SIZE)
+                finally:
+                    work_loads[index] -= 1
+                if not chunk_cache.has_part(job.file_id, job.file_size, part_index):
+                    raise IOError(f"Part {part_index} couldn't be cached")
+
+        workers = [asyncio.ensure_future(worker(index))
+                   for index in list(multi_clients) for _ in range(self.parts_per_client)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        if job.parts_cached() != job.part_count:
+            raise IOError("Parts were evicted from the chunk cache before the job finished")
+
+    def stats(self) -> Dict[str, Any]:
+        states = [job.state for job in self._jobs.values()]
+        return {
+            "bandwidth": self.bandwidth,
+            **{state: states.count(state) for state in (QUEUED, RUNNING, DONE, FAILED)},
+        }
+
+
+prefetch_jobs = PrefetchManager(
+    Var.PREFETCH_BANDWIDTH * 1024,
+    parts_per_client=Var.PREFETCH_PARTS_PER_CLIENT,
+)
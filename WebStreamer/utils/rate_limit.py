@@ -0,0 +1,160 @@
+# Per-IP request rate limits, concurrent stream caps and per-stream bandwidth ceilings
+
+import time
+import asyncio
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+from aiohttp import web
+from WebStreamer.vars import Var
+from .cache import LRUCache
+
+
+class TokenBucket:
+    """
+    Classic token bucket.
+    attributes:
+        rate: tokens added per second.
+        capacity: maximum tokens kept, i.e. the allowed burst.
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount: float = 1) -> float:
+        """Takes `amount` tokens if available and returns 0, otherwise returns the seconds to wait."""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    async def consume(self, amount: float) -> None:
+        """Takes `amount` tokens, going into debt and sleeping it off if there aren't enough."""
+        self._refill()
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+def get_client_ip(request: web.Request) -> str:
+    """The address limits are applied to, taken from proxy headers only if TRUST_PROXY_HEADERS is set"""
+    if Var.TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+        real_ip = request.headers.get("X-Real-IP")
+        if real_ip:
+            return real_ip.strip()
+    return request.remote or ""
+
+
+class StreamSlot:
+    """
+    One of an IP's concurrent streams, taken when a request is admitted.
+    functions:
+        release: gives the slot back, calling it again does nothing.
+    """
+    __slots__ = ("limiter", "ip", "released")
+
+    def __init__(self, limiter: "RouteLimiter", ip: str):
+        self.limiter = limiter
+        self.ip = ip
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.limiter._release(self.ip)
+
+
+class RouteLimiter:
+    """
+    Limits applied to the requests of one route, per client IP.
+    attributes:
+        name: route name used in the statistics.
+        rate: requests per minute, 0 disables the request limit.
+        burst: requests allowed at once before the rate applies.
+        max_streams: concurrent streams, 0 disables the cap.
+        bandwidth: bytes per second of each stream, 0 disables the ceiling.
+
+    functions:
+        check: returns the seconds to wait before retrying, or 0 if the request may proceed.
+        admit: like check, but also takes one of the IP's stream slots when the request may proceed.
+        throttle: wraps a response body so it respects the bandwidth ceiling.
+    """
+
+    def __init__(self, name: str, rate: float = 0, burst: int = 0, max_streams: int = 0, bandwidth: int = 0):
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.max_streams = max_streams
+        self.bandwidth = bandwidth
+        self._buckets = LRUCache(max_size=100000, ttl=3600)
+        self._streams: Dict[str, int] = {}
+        self.limited = 0
+
+    def check(self, ip: str) -> float:
+        if self.max_streams and self._streams.get(ip, 0) >= self.max_streams:
+            self.limited += 1
+            return 1.0
+        if not self.rate:
+            return 0.0
+        bucket = self._buckets.get(ip)
+        if bucket is None:
+            bucket = TokenBucket(self.rate / 60, self.burst)
+            self._buckets.set(ip, bucket)
+        retry_after = bucket.try_consume()
+        if retry_after:
+            self.limited += 1
+        return retry_after
+
+    def admit(self, ip: str) -> Tuple[float, Optional[StreamSlot]]:
+        """
+        Checks the limits and takes a stream slot in the same step, before the handler awaits anything,
+        so a burst of parallel requests can't all pass the cap. The slot must be released once the response is done.
+        """
+        retry_after = self.check(ip)
+        if retry_after:
+            return retry_after, None
+        self._streams[ip] = self._streams.get(ip, 0) + 1
+        return 0.0, StreamSlot(self, ip)
+
+    def _release(self, ip: str) -> None:
+        self._streams[ip] -= 1
+        if not self._streams[ip]:
+            del self._streams[ip]
+
+    async def throttle(self, body: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+        bucket = TokenBucket(self.bandwidth, self.bandwidth) if self.bandwidth else None
+        async for chunk in body:
+            if bucket is not None:
+                await bucket.consume(len(chunk))
+            yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests_per_minute": self.rate,
+            "max_streams_per_ip": self.max_streams,
+            "stream_bandwidth": self.bandwidth,
+            "active_streams": sum(self._streams.values()),
+            "active_ips": len(self._streams),
+            "limited": self.limited,
+        }
+
+
+dl_limiter = RouteLimiter(
+    "dl",
+    rate=Var.DL_RATE_LIMIT,
+    burst=Var.DL_RATE_BURST,
+    max_streams=Var.DL_MAX_STREAMS_PER_IP,
+    bandwidth=Var.DL_STREAM_BANDWIDTH * 1024,
+)
+link_limiter = RouteLimiter("link", rate=Var.LINK_RATE_LIMIT, burst=Var.LINK_RATE_BURST)
@@ -0,0 +1,146 @@
+# Sequential access detection and speculative readahead
+# Players fetch videos as a run of adjacent Range requests, or as one request read to the end. Once a
+# (client IP, file) pair reads sequentially, or asks for everything up to the end, up to READAHEAD_PARTS
+# parts after the current request (or after its first part) are fetched into the chunk cache in the background.
+
+import asyncio
+import logging
+from typing import Any, Dict, Hashable, Optional
+from pyrogram.file_id import FileId
+from WebStreamer.vars import Var
+from WebStreamer.bot import work_loads
+from .cache import LRUCache
+from .chunk_cache import chunk_cache, cache_key, PART_SIZE
+from .scheduler import BULK
+
+
+class AccessState:
+    """
+    Access pattern of one client IP on one file.
+    attributes:
+        next_offset: where the next request starts if playback is sequential.
+        streak: adjacent requests in a row.
+        task: the running readahead, if any.
+    """
+    __slots__ = ("next_offset", "streak", "task")
+
+    def __init__(self, next_offset: int):
+        self.next_offset = next_offset
+        self.streak = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def cancel(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+
+class ReadaheadTracker:
+    """
+    Tracks access patterns and runs bounded readahead into the chunk cache.
+    attributes:
+        parts: 1 MiB parts fetched ahead of a sequential reader, 0 disables readahead.
+        max_tasks: readaheads running at once over all clients.
+        slack: bytes a request may start away from the previous one's end and still count as sequential.
+
+    functions:
+        observe: records a request and starts or cancels readahead for it.
+        cancel: stops the readahead of a client that went away.
+    """
+
+    def __init__(self, parts: int, max_tasks: int, max_entries: int, slack: int = PART_SIZE):
+        self.parts = parts
+        self.max_tasks = max_tasks
+        self.slack = slack
+        self._states = LRUCache(max_size=max_entries, ttl=300)
+        self._tasks = 0
+        self.sequential = 0
+        self.seeks = 0
+        self.started = 0
+        self.cancelled = 0
+        self.parts_fetched = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.parts > 0 and chunk_cache.enabled
+
+    def observe(self, ip: str, file_id: FileId, file_size: int, from_bytes: int, until_bytes: int,
+                streamer, index: int) -> None:
+        if not self.enabled or not file_size:
+            return
+        key = cache_key(file_id)
+        if key is None:
+            return
+        state_key: Hashable = (ip, key)
+        state = self._states.get(state_key)
+        if state is None:
+            state = AccessState(until_bytes + 1)
+            self._states.set(state_key, state)
+        elif abs(from_bytes - state.next_offset) <= self.slack:
+            state.streak += 1
+            self.sequential += 1
+        else:
+            # The viewer seeked, whatever was being read ahead is useless now
+            if state.task is not None and not state.task.done():
+                self.cancelled += 1
+            state.cancel()
+            state.streak = 0
+            self.seeks += 1
+        state.next_offset = until_bytes + 1
+
+        if until_bytes + 1 >= file_size:
+            # Read to the end ("bytes=N-", what most players send): the parts after the first one
+            # are fetched while it streams, so the stream finds them cached
+            first_part = from_bytes // PART_SIZE + 1
+        elif state.streak:
+            first_part = (until_bytes + 1) // PART_SIZE
+        else:
+            return
+        last_part = min((file_size - 1) // PART_SIZE, first_part + self.parts - 1)
+        if first_part > last_part:
+            return
+        if state.task is not None and not state.task.done():
+            return
+        if self._tasks >= self.max_tasks:
+            return
+        state.task = asyncio.ensure_future(self._read_ahead(streamer, index, file_id, file_size, first_part, last_part))
+
+    def cancel(self, ip: str, file_id: FileId) -> None:
+        key = cache_key(file_id)
+        state = self._states.peek((ip, key)) if key else None
+        if state is not None and state.task is not None and not state.task.done():
+            self.cancelled += 1
+            state.cancel()
+
+    async def _read_ahead(self, streamer, index: int, file_id: FileId, file_size: int,
+                          first_part: int, last_part: int) -> None:
+        self._tasks += 1
+        self.started += 1
+        work_loads[index] += 1
+        try:
+            for part_index in range(first_part, last_part + 1):
+                if await streamer.fill_part(file_id, part_index, BULK):
+                    self.parts_fetched += 1
+                elif not chunk_cache.has_part(file_id, file_size, part_index):
+                    break
+        except Exception as e:
+            logging.debug(f"Readahead of {cache_key(file_id)} stopped: {e}")
+        finally:
+            self._tasks -= 1
+            work_loads[index] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "parts": self.parts,
+            "tracked": len(self._states),
+            "active": self._tasks,
+            "sequential_requests": self.sequential,
+            "seeks": self.seeks,
+            "started": self.started,
+            "cancelled": self.cancelled,
+            "parts_fetched": self.parts_fetched,
+        }
+
+
+readahead = ReadaheadTracker(Var.READAHEAD_PARTS, Var.READAHEAD_MAX_TASKS, Var.READAHEAD_TRACKED)
@@ -0,0 +1,109 @@
+# Priority scheduling of upstream GetFile calls
+# Interactive playback (inline responses) gets free slots before bulk downloads,
+# bulk is still served at least once every `starvation_limit` grants
+
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Tuple
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = ("interactive", "bulk")
+
+
+class FetchScheduler:
+    """
+    Limits the concurrent GetFile calls of one client and hands out free slots by priority.
+    attributes:
+        slots: concurrent calls allowed, 0 disables scheduling.
+        starvation_limit: interactive grants in a row while bulk fetches wait before one bulk fetch goes first.
+
+    functions:
+        slot: async context manager holding one slot of the given priority.
+    """
+
+    def __init__(self, slots: int, starvation_limit: int = 4):
+        self.slots = slots
+        self.starvation_limit = max(1, starvation_limit)
+        self.active = 0
+        self._queues: Tuple[Deque[asyncio.Future], ...] = (deque(), deque())
+        self._streak = 0
+        self.granted = [0, 0]
+        self.waited = [0, 0]
+        self.wait_time = [0.0, 0.0]
+
+    async def acquire(self, priority: int) -> None:
+        if not self.slots:
+            return
+        if self.active < self.slots and not any(self._queues):
+            self._grant(priority)
+            return
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority]
+        queue.append(future)
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over right as the waiter got cancelled
+                self.release()
+            else:
+                try:
+                    queue.remove(future)
+                except ValueError:
+                    pass
+            raise
+        self.waited[priority] += 1
+        self.wait_time[priority] += time.monotonic() - started
+
+    def release(self) -> None:
+        if not self.slots:
+            return
+        self.active -= 1
+        while self.active < self.slots:
+            priority = self._next_priority()
+            if priority is None:
+                return
+            future = self._queues[priority].popleft()
+            if future.done():
+                continue
+            self._grant(priority)
+            future.set_result(None)
+
+    def _next_priority(self):
+        interactive, bulk = self._queues
+        if bulk and (not interactive or self._streak >= self.starvation_limit):
+            return BULK
+        if interactive:
+            return INTERACTIVE
+        return None
+
+    def _grant(self, priority: int) -> None:
+        self.active += 1
+        self.granted[priority] += 1
+        if priority == BULK:
+            self._streak = 0
+        elif self._queues[BULK]:
+            self._streak += 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = BULK):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"slots": self.slots, "active": self.active}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            waited = self.waited[priority]
+            stats[name] = {
+                "granted": self.granted[priority],
+                "waiting": len(self._queues[priority]),
+                "avg_wait_ms": round(self.wait_time[priority] / waited * 1000, 2) if waited else 0.0,
+            }
+        return stats
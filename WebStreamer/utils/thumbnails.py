@@ -0,0 +1,79 @@
+# Telegram thumbnails of media files, kept in a small in-memory cache
+# A thumbnail is addressed like the file itself, with the size letter of the thumbnail
+# (Telegram's "s" 100px, "m" 320px, "x" 800px...) in the location's thumb_size.
+
+import copy
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.vars import Var
+from .cache import ByteLRUCache
+
+THUMBNAIL_SIZES = frozenset("smxywabcdij")
+# Thumbnails are a few dozen KB, anything bigger than this isn't a thumbnail
+MAX_THUMBNAIL_SIZE = 1024 * 1024
+
+
+def thumbnail_file_id(file_id: FileId, size: str) -> Optional[FileId]:
+    """FileId of the thumbnail `size` of a media file, None if it can't have one"""
+    if size not in THUMBNAIL_SIZES or file_id.file_type == FileType.CHAT_PHOTO:
+        return None
+    thumbnail = copy.copy(file_id)
+    thumbnail.thumbnail_size = size
+    # Unknown size, the streaming engine reads until Telegram returns a short part
+    setattr(thumbnail, "file_size", 0)
+    return thumbnail
+
+
+def image_type(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+class ThumbnailCache:
+    """
+    Byte-bounded LRU of thumbnails, concurrent misses for the same thumbnail share one fetch.
+    Files without the requested thumbnail are remembered as empty entries.
+    attributes:
+        max_bytes: memory budget, 0 disables caching (thumbnails are still served).
+
+    functions:
+        get_or_fetch: returns the cached thumbnail or awaits the fetcher.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._cache = ByteLRUCache(max_bytes)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.fetches = 0
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[bytes]]) -> bytes:
+        data = self._cache.get(key)
+        if data is not None:
+            return data
+        future = self._inflight.get(key)
+        if future is None:
+            self.fetches += 1
+            future = asyncio.ensure_future(fetch())
+            self._inflight[key] = future
+
+            def _store(fut: asyncio.Future):
+                self._inflight.pop(key, None)
+                if not fut.cancelled() and fut.exception() is None:
+                    self._cache.set(key, fut.result())
+                elif not fut.cancelled():
+                    logging.debug(f"Failed to fetch thumbnail {key}: {fut.exception()}")
+
+            future.add_done_callback(_store)
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats.update({"fetches": self.fetches, "inflight": len(self._inflight)})
+        return stats
+
+
+thumbnail_cache = ThumbnailCache(Var.THUMB_CACHE_SIZE * 1024 * 1024)
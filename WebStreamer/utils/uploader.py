@@ -0,0 +1,295 @@
+# Uploads of HTTP streams into BIN_CHANNEL
+# The stream is cut into 512 KiB parts that are sent with SaveFilePart/SaveBigFilePart while it arrives,
+# several at once, so a file is never held whole in memory or written to disk.
+# Telegram ties the parts of an upload to the account sending them, so one upload can't be spread over
+# several bots: parts go out in parallel over a pool of media sessions of the least loaded client.
+
+import os
+import math
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from pyrogram import Client, raw
+from pyrogram.errors import FloodWait, RPCError
+from pyrogram.session import Session
+from pyrogram.types import Message
+from WebStreamer.vars import Var
+from WebStreamer.bot import multi_clients, work_loads
+
+UPLOAD_PART_SIZE = 512 * 1024
+# Files up to this size are sent with SaveFilePart, bigger ones with SaveBigFilePart
+SMALL_FILE_SIZE = 10 * 1024 * 1024
+PART_RETRIES = 3
+
+# save_part(SaveFilePart or SaveBigFilePart) sends one part, returns Telegram's answer
+SavePart = Callable[[raw.core.TLObject], Awaitable[bool]]
+
+
+class UploadError(Exception):
+    """The uploaded stream is unusable (wrong size, empty...), Telegram failures are raised as IOError"""
+
+
+class PartUploader:
+    """
+    Sends a stream of bytes to Telegram as upload parts, a few parts at once.
+    Writers wait while `parallel` parts are queued, so memory stays at about parallel * 512 KiB.
+    attributes:
+        file_size: announced size, None if unknown. Streams of unknown size are sent as big files
+            with -1 parts until the last part, which announces the total.
+        received: bytes written so far.
+        uploaded: bytes Telegram acknowledged.
+        acked_parts: number of leading parts Telegram acknowledged, a resumed upload starts after them.
+
+    functions:
+        write: adds bytes to the upload.
+        finish: sends what's left and returns the InputFile to attach to SendMedia.
+        close: stops the workers, for uploads that are given up.
+    """
+
+    def __init__(self, save_part: SavePart, file_name: str, file_size: Optional[int] = None, parallel: int = 8,
+                 upload_id: Optional[int] = None, first_part: int = 0):
+        self.save_part = save_part
+        self.file_name = file_name
+        self.file_size = file_size
+        self.upload_id = upload_id or int.from_bytes(os.urandom(8), "little", signed=True)
+        # Resuming only works for big files of known size, small files are checked with the MD5 of all of their data
+        if first_part and (file_size is None or file_size <= SMALL_FILE_SIZE):
+            raise ValueError("Only big files of known size can be resumed")
+        self.received = first_part * UPLOAD_PART_SIZE
+        self.uploaded = 0
+        self.acked_parts = first_part
+        self._acked = set()
+        # Small or big, None while a stream of unknown size is still under SMALL_FILE_SIZE
+        self.big: Optional[bool] = None if file_size is None else file_size > SMALL_FILE_SIZE
+        self._md5 = hashlib.md5()
+        self._buffer = bytearray()
+        # Full parts not queued yet, the last part of a stream of unknown size is only sent at the end
+        self._held: List[bytes] = []
+        self._parts = first_part
+        self._queue: asyncio.Queue = asyncio.Queue(max(1, parallel))
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(max(1, parallel))]
+        self._error: Optional[BaseException] = None
+
+    @property
+    def total_parts(self) -> int:
+        if self.file_size is None:
+            return -1
+        return max(1, math.ceil(self.file_size / UPLOAD_PART_SIZE))
+
+    def _request(self, part_index: int, data: bytes, total_parts: int) -> raw.core.TLObject:
+        if self.big:
+            return raw.functions.upload.SaveBigFilePart(
+                file_id=self.upload_id, file_part=part_index, file_total_parts=total_parts, bytes=data
+            )
+        return raw.functions.upload.SaveFilePart(file_id=self.upload_id, file_part=part_index, bytes=data)
+
+    async def _send(self, part_index: int, data: bytes, total_parts: int) -> None:
+        request = self._request(part_index, data, total_parts)
+        for attempt in range(PART_RETRIES):
+            try:
+                if await self.save_part(request):
+                    self.uploaded += len(data)
+                    self._acked.add(part_index)
+                    while self.acked_parts in self._acked:
+                        self._acked.discard(self.acked_parts)
+                        self.acked_parts += 1
+                    return
+                error = IOError(f"Telegram refused part {part_index}")
+            except FloodWait as e:
+                error = e
+                await asyncio.sleep(e.value)
+            except (RPCError, OSError, asyncio.TimeoutError) as e:
+                error = e
+                await asyncio.sleep(attempt + 1)
+            logging.debug(f"Upload part {part_index} of {self.file_name} failed (attempt {attempt + 1}): {error}")
+        raise IOError(f"Part {part_index} couldn't be uploaded: {error}")
+
+    async def _worker(self) -> None:
+        while True:
+            part_index, data, total_parts = await self._queue.get()
+            try:
+                if self._error is None:
+                    await self._send(part_index, data, total_parts)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    async def _queue_part(self, data: bytes, total_parts: int) -> None:
+        self._check()
+        await self._queue.put((self._parts, data, total_parts))
+        self._parts += 1
+
+    async def write(self, data: bytes) -> None:
+        self.received += len(data)
+        if self.file_size is not None and self.received > self.file_size:
+            raise UploadError(f"Got more than the announced {self.file_size} bytes")
+        if not self.big:
+            self._md5.update(data)
+        self._buffer += data
+        while len(self._buffer) >= UPLOAD_PART_SIZE:
+            self._held.append(bytes(self._buffer[:UPLOAD_PART_SIZE]))
+            del self._buffer[:UPLOAD_PART_SIZE]
+        if self.big is None and self.received > SMALL_FILE_SIZE:
+            self.big = True
+        if self.big is None:
+            return
+        # With an unknown size the last full part may turn out to be the end of the file
+        keep = 1 if self.file_size is None else 0
+        while len(self._held) > keep:
+            await self._queue_part(self._held.pop(0), self.total_parts)
+
+    async def finish(self) -> raw.base.InputFile:
+        if self.file_size is not None and self.received != self.file_size:
+            raise UploadError(f"Got {self.received} of the announced {self.file_size} bytes")
+        if not self.received:
+            raise UploadError("The file is empty")
+        if self.big is None:
+            self.big = False
+        if self._buffer:
+            self._held.append(bytes(self._buffer))
+            self._buffer.clear()
+        total_parts = self._parts + len(self._held)
+        # Nothing is left when a resumed upload had sent every part already
+        if self._held:
+            for data in self._held[:-1]:
+                await self._queue_part(data, self.total_parts)
+            if self.file_size is None and self.big:
+                # The part announcing the total goes last
+                await self._queue.join()
+            await self._queue_part(self._held[-1], total_parts)
+            self._held.clear()
+        await self._queue.join()
+        self._check()
+        self.close()
+        if self.big:
+            return raw.types.InputFileBig(id=self.upload_id, parts=total_parts, name=self.file_name)
+        return raw.types.InputFile(id=self.upload_id, parts=total_parts, name=self.file_name,
+                                   md5_checksum=self._md5.hexdigest())
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+
+
+# Upload sessions of every client, by client name
+_upload_sessions: Dict[str, List[Session]] = {}
+_upload_sessions_lock: Optional[asyncio.Lock] = None
+
+
+async def get_upload_sessions(client: Client, count: int) -> List[Session]:
+    """Media sessions on the client's own DC that upload parts are sent on, created on first use"""
+    from .custom_dl import create_session_safe
+
+    global _upload_sessions_lock
+    sessions = _upload_sessions.get(client.name)
+    if sessions is None:
+        if _upload_sessions_lock is None:
+            _upload_sessions_lock = asyncio.Lock()
+        async with _upload_sessions_lock:
+            sessions = _upload_sessions.get(client.name)
+            if sessions is None:
+                sessions = []
+                for _ in range(max(1, count)):
+                    session = create_session_safe(
+                        client,
+                        await client.storage.dc_id(),
+                        await client.storage.auth_key(),
+                        await client.storage.test_mode(),
+                        is_media=True
+                    )
+                    await session.start()
+                    sessions.append(session)
+                logging.debug(f"Created {len(sessions)} upload sessions for {client.name}")
+                _upload_sessions[client.name] = sessions
+    return sessions
+
+
+async def send_to_bin_channel(client: Client, input_file: raw.base.InputFile, file_name: str,
+                              mime_type: str) -> Message:
+    """Posts an uploaded file to BIN_CHANNEL as a document"""
+    result = await client.invoke(raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(Var.BIN_CHANNEL),
+        media=raw.types.InputMediaUploadedDocument(
+            file=input_file,
+            mime_type=mime_type,
+            attributes=[raw.types.DocumentAttributeFilename(file_name=file_name)],
+            force_file=True,
+        ),
+        message="",
+        random_id=client.rnd_id(),
+    ))
+    for update in result.updates:
+        if isinstance(update, (raw.types.UpdateNewChannelMessage, raw.types.UpdateNewMessage)):
+            return await Message._parse(
+                client, update.message,
+                {user.id: user for user in result.users},
+                {chat.id: chat for chat in result.chats},
+            )
+    raise IOError("Telegram didn't return the posted message")
+
+
+class ChannelUpload:
+    """
+    Uploads into BIN_CHANNEL with one client, the least loaded one when created.
+    All parts of a file have to be sent by the same client, so a resumed upload keeps its ChannelUpload.
+    attributes:
+        index: the client's index in multi_clients.
+
+    functions:
+        save_part: sends a part on the client's upload session with the fewest parts in flight.
+        post: posts an uploaded file to BIN_CHANNEL, returns the message indexed like any posted media.
+    """
+
+    def __init__(self):
+        if not multi_clients:
+            raise IOError("No client is connected")
+        self.index = min(work_loads, key=work_loads.get)
+        self.client: Client = multi_clients[self.index]
+        self._in_flight: List[int] = []
+
+    async def save_part(self, request: raw.core.TLObject) -> bool:
+        sessions = await get_upload_sessions(self.client, Var.UPLOAD_SESSIONS)
+        if len(self._in_flight) != len(sessions):
+            self._in_flight = [0] * len(sessions)
+        session = self._in_flight.index(min(self._in_flight))
+        self._in_flight[session] += 1
+        try:
+            return await sessions[session].invoke(request)
+        finally:
+            self._in_flight[session] -= 1
+
+    async def post(self, input_file: raw.base.InputFile, file_name: str, mime_type: str) -> Message:
+        from WebStreamer.bot.plugins.media_handler import index_media
+
+        message = await send_to_bin_channel(self.client, input_file, file_name, mime_type)
+        index_media(self.client, message, message.document)
+        return message
+
+
+async def upload_stream(chunks: AsyncIterator[bytes], file_name: str, file_size: Optional[int],
+                        mime_type: str) -> Message:
+    """
+    Uploads a byte stream with the least loaded client and posts it to BIN_CHANNEL.
+    Returns the channel message, already indexed like any posted media.
+    """
+    target = ChannelUpload()
+    work_loads[target.index] += 1
+    try:
+        uploader = PartUploader(target.save_part, file_name, file_size, Var.UPLOAD_PARTS_IN_FLIGHT)
+        try:
+            async for chunk in chunks:
+                await uploader.write(chunk)
+            input_file = await uploader.finish()
+        finally:
+            uploader.close()
+        message = await target.post(input_file, file_name, mime_type)
+    finally:
+        work_loads[target.index] -= 1
+    logging.info(f"Uploaded {file_name} ({uploader.received} bytes) as message {message.id} with {target.client.name}")
+    return message
@@ -0,0 +1,123 @@
+# Upload-time warm-up of new media
+# When a video or audio file is posted, its first and last MiBs (MP4 players need the moov atom,
+# which often sits at the end) are fetched into the chunk cache and the media session for its DC is built,
+# so the first viewer doesn't start cold.
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+from pyrogram.file_id import FileId
+from WebStreamer.vars import Var
+from WebStreamer.bot import work_loads
+from .chunk_cache import chunk_cache, cache_key, PART_SIZE
+from .scheduler import BULK
+
+
+def warmup_parts(file_size: int, head: int, tail: int) -> List[int]:
+    """Indexes of the 1 MiB parts covering the first `head` and last `tail` MiB of a file"""
+    if file_size <= 0:
+        return []
+    last_part = (file_size - 1) // PART_SIZE
+    parts = list(range(min(head, last_part + 1)))
+    for part_index in range(max(0, last_part - tail + 1), last_part + 1):
+        if part_index >= len(parts):
+            parts.append(part_index)
+    return parts
+
+
+class WarmupQueue:
+    """
+    Bounded queue of files to warm up, drained by low priority background workers.
+    attributes:
+        enabled: warm-up is opt-in.
+        head: MiB fetched from the start of a file.
+        tail: MiB fetched from the end of a file.
+        max_queued: files waiting at once, new uploads are dropped when the queue is full.
+        workers: files warmed up at once.
+
+    functions:
+        enqueue: queues a file for warm-up, returns False if it was dropped.
+    """
+
+    def __init__(self, enabled: bool, head: int, tail: int, max_queued: int = 100, workers: int = 1):
+        self.enabled = enabled
+        self.head = head
+        self.tail = tail
+        self.max_queued = max_queued
+        self.workers = max(1, workers)
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self.queued = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        self.parts_fetched = 0
+
+    def enqueue(self, file_id: FileId, streamer, index: int) -> bool:
+        if not self.enabled:
+            return False
+        key = cache_key(file_id)
+        if key is None or key in self._queued:
+            return False
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queued)
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        try:
+            self._queue.put_nowait((key, file_id, streamer, index))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self._queued.add(key)
+        self.queued += 1
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key, file_id, streamer, index = await self._queue.get()
+            try:
+                await self._warm_up(file_id, streamer, index)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.debug(f"Warm-up of {key} failed: {e}")
+            finally:
+                self._queued.discard(key)
+                self._queue.task_done()
+
+    async def _warm_up(self, file_id: FileId, streamer, index: int) -> None:
+        work_loads[index] += 1
+        try:
+            await streamer.generate_media_session(streamer.client, file_id)
+            if not chunk_cache.enabled:
+                return
+            file_size = getattr(file_id, "file_size", 0)
+            for part_index in warmup_parts(file_size, self.head, self.tail):
+                if await streamer.fill_part(file_id, part_index, BULK):
+                    self.parts_fetched += 1
+                elif not chunk_cache.has_part(file_id, file_size, part_index):
+                    return
+        finally:
+            work_loads[index] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "head_mib": self.head,
+            "tail_mib": self.tail,
+            "waiting": self._queue.qsize() if self._queue is not None else 0,
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "parts_fetched": self.parts_fetched,
+        }
+
+
+warmup_queue = WarmupQueue(
+    Var.WARMUP_ON_UPLOAD,
+    Var.WARMUP_HEAD_MIB,
+    Var.WARMUP_TAIL_MIB,
+    max_queued=Var.WARMUP_QUEUE_SIZE,
+    workers=Var.WARMUP_WORKERS,
+)
@@ -0,0 +1,230 @@
+# ZIP bundles of several files, streamed on the fly
+# Files are stored (no compression) in a ZIP64 archive whose layout only depends on the names and sizes,
+# so the archive size is known before the first byte is sent and any byte range of it can be produced.
+# CRC-32s are computed while the data streams and written in data descriptors and the central directory.
+
+import zlib
+import struct
+import asyncio
+from typing import Any, AsyncGenerator, Callable, Dict, Hashable, List, Optional, Tuple
+from pyrogram.file_id import FileId
+from WebStreamer.vars import Var
+from .cache import LRUCache
+
+# read(file_id, from_bytes, until_bytes) yields the inclusive byte range of a file
+FileReader = Callable[[FileId, int, int], AsyncGenerator[bytes, None]]
+
+ZIP_VERSION = 45  # 4.5, ZIP64
+# Bit 3: CRC in a data descriptor after the data, bit 11: UTF-8 names
+ZIP_FLAGS = 0x0808
+# The archive has to be byte-identical on every request so ranges can be resumed, 1980-01-01 00:00
+ZIP_DOS_TIME = 0
+ZIP_DOS_DATE = (1 << 5) | 1
+ZIP64_EXTRA_LOCAL = 20
+ZIP64_EXTRA_CENTRAL = 28
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+DATA_DESCRIPTOR = struct.Struct("<IIQQ")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+ZIP64_LOCATOR = struct.Struct("<IIQI")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<IHHHHIIH")
+
+
+class ZipEntry:
+    """
+    A file of a bundle.
+    attributes:
+        name: path inside the archive.
+        file_id: FileId to stream the file with.
+        size: file size in bytes.
+        offset: position of the entry's local header in the archive.
+    """
+    __slots__ = ("name", "file_id", "size", "offset", "crc")
+
+    def __init__(self, name: str, file_id: FileId, size: int):
+        self.name = name
+        self.file_id = file_id
+        self.size = size
+        self.offset = 0
+        self.crc: Optional[int] = None
+
+    @property
+    def crc_key(self) -> Hashable:
+        return self.file_id.dc_id, self.file_id.media_id, self.file_id.thumbnail_size, self.size
+
+    def local_header(self) -> bytes:
+        name = self.name.encode()
+        return LOCAL_HEADER.pack(
+            0x04034B50, ZIP_VERSION, ZIP_FLAGS, 0, ZIP_DOS_TIME, ZIP_DOS_DATE,
+            0, 0xFFFFFFFF, 0xFFFFFFFF, len(name), ZIP64_EXTRA_LOCAL,
+        ) + name + struct.pack("<HHQQ", 0x0001, 16, self.size, self.size)
+
+    def data_descriptor(self) -> bytes:
+        return DATA_DESCRIPTOR.pack(0x08074B50, self.crc, self.size, self.size)
+
+    def central_header(self) -> bytes:
+        name = self.name.encode()
+        return CENTRAL_HEADER.pack(
+            0x02014B50, ZIP_VERSION, ZIP_VERSION, ZIP_FLAGS, 0, ZIP_DOS_TIME, ZIP_DOS_DATE,
+            self.crc, 0xFFFFFFFF, 0xFFFFFFFF, len(name), ZIP64_EXTRA_CENTRAL, 0, 0, 0, 0, 0xFFFFFFFF,
+        ) + name + struct.pack("<HHQQQ", 0x0001, 24, self.size, self.size, self.offset)
+
+
+def unique_names(names: List[str]) -> List[str]:
+    """Makes names safe to extract and unique, "a.mp4" twice becomes "a.mp4" and "a (1).mp4" """
+    seen = set()
+    result = []
+    for name in names:
+        name = name.replace("\\", "_").replace("/", "_").strip(". ") or "file"
+        candidate, counter = name, 0
+        while candidate.lower() in seen:
+            counter += 1
+            stem, dot, extension = name.rpartition(".")
+            candidate = f"{stem} ({counter}).{extension}" if dot and stem else f"{name} ({counter})"
+        seen.add(candidate.lower())
+        result.append(candidate)
+    return result
+
+
+class ZipBundle:
+    """
+    Layout of a stored ZIP64 archive and a generator of any byte range of it.
+    attributes:
+        entries: the files, in archive order.
+        size: total archive size.
+
+    functions:
+        stream: yields the inclusive byte range start-end of the archive.
+    """
+    _end_size = ZIP64_END.size + ZIP64_LOCATOR.size + END_OF_CENTRAL_DIRECTORY.size
+
+    def __init__(self, files: List[Tuple[str, FileId, int]]):
+        names = unique_names([name for name, _, _ in files])
+        self.entries = [ZipEntry(name, file_id, size) for name, (_, file_id, size) in zip(names, files)]
+        # (start, length, kind, entry) of every part of the archive, kind is "header", "data" or "descriptor"
+        self._segments: List[Tuple[int, int, str, Optional[ZipEntry]]] = []
+        position = 0
+        for entry in self.entries:
+            entry.offset = position
+            for kind, length in (("header", len(entry.local_header())), ("data", entry.size),
+                                 ("descriptor", DATA_DESCRIPTOR.size)):
+                if length:
+                    self._segments.append((position, length, kind, entry))
+                    position += length
+        self.central_offset = position
+        self.central_size = sum(CENTRAL_HEADER.size + len(e.name.encode()) + ZIP64_EXTRA_CENTRAL for e in self.entries)
+        self._segments.append((position, self.central_size + self._end_size, "central", None))
+        self.size = position + self.central_size + self._end_size
+
+    def _end_records(self) -> bytes:
+        count = len(self.entries)
+        zip64_end_offset = self.central_offset + self.central_size
+        return (
+            ZIP64_END.pack(0x06064B50, ZIP64_END.size - 12, ZIP_VERSION, ZIP_VERSION, 0, 0,
+                           count, count, self.central_size, self.central_offset)
+            + ZIP64_LOCATOR.pack(0x07064B50, 0, zip64_end_offset, 1)
+            + END_OF_CENTRAL_DIRECTORY.pack(0x06054B50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0)
+        )
+
+    async def _crc(self, entry: ZipEntry, read: FileReader, until: int) -> int:
+        """CRC-32 of the first until + 1 bytes of an entry"""
+        crc = received = 0
+        if until < 0:
+            return crc
+        chunks = read(entry.file_id, 0, until)
+        try:
+            async for chunk in chunks:
+                crc = zlib.crc32(chunk, crc)
+                received += len(chunk)
+        finally:
+            await chunks.aclose()
+        if received != until + 1:
+            raise IOError(f"{entry.name} ended after {received} of {entry.size} bytes")
+        return crc
+
+    async def _full_crc(self, entry: ZipEntry, read: FileReader) -> int:
+        if entry.crc is None:
+            entry.crc = crc_cache.get(entry.crc_key)
+        if entry.crc is None:
+            entry.crc = await crc_cache.get_or_compute(entry.crc_key, lambda: self._crc(entry, read, entry.size - 1))
+        return entry.crc
+
+    async def stream(self, start: int, end: int, read: FileReader) -> AsyncGenerator[bytes, None]:
+        for position, length, kind, entry in self._segments:
+            if position + length <= start or position > end:
+                continue
+            first = max(start, position) - position
+            last = min(end, position + length - 1) - position
+            if kind == "header":
+                yield entry.local_header()[first:last + 1]
+            elif kind == "descriptor":
+                await self._full_crc(entry, read)
+                yield entry.data_descriptor()[first:last + 1]
+            elif kind == "central":
+                for other in self.entries:
+                    await self._full_crc(other, read)
+                directory = b"".join(other.central_header() for other in self.entries) + self._end_records()
+                yield directory[first:last + 1]
+            else:
+                # Data is checksummed on the way unless the CRC is already known, a range that starts
+                # inside the file first checksums the bytes before it
+                if entry.crc is None:
+                    entry.crc = crc_cache.get(entry.crc_key)
+                crc = None
+                if entry.crc is None:
+                    crc = await self._crc(entry, read, first - 1)
+                received = 0
+                chunks = read(entry.file_id, first, last)
+                try:
+                    async for chunk in chunks:
+                        if crc is not None:
+                            crc = zlib.crc32(chunk, crc)
+                        received += len(chunk)
+                        yield chunk
+                finally:
+                    await chunks.aclose()
+                if received != last - first + 1:
+                    raise IOError(f"{entry.name} ended after {first + received} of {entry.size} bytes")
+                if crc is not None and last == entry.size - 1:
+                    entry.crc = crc
+                    crc_cache.set(entry.crc_key, crc)
+
+
+class CRCCache(LRUCache):
+    """
+    CRC-32s of whole files, keyed by (dc, media id, thumbnail size, size). Concurrent computations of the same CRC are shared.
+
+    functions:
+        get_or_compute: returns the cached CRC or awaits compute().
+    """
+
+    def __init__(self, max_size: int):
+        super().__init__(max_size=max_size)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.computed = 0
+
+    async def get_or_compute(self, key: Hashable, compute: Callable) -> int:
+        crc = self.get(key)
+        if crc is not None:
+            return crc
+        future = self._inflight.get(key)
+        if future is None:
+            self.computed += 1
+            future = asyncio.ensure_future(compute())
+            self._inflight[key] = future
+
+            def _store(fut: asyncio.Future):
+                self._inflight.pop(key, None)
+                if not fut.cancelled() and fut.exception() is None:
+                    self.set(key, fut.result())
+
+            future.add_done_callback(_store)
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({"computed": self.computed, "inflight": len(self._inflight)})
+        return stats
+
+
+crc_cache = CRCCache(Var.BUNDLE_CRC_CACHE_SIZE)
@@ -52,3 +52,126 @@ class Var(object):
     # Toggle to enable/disable sending download links to channels
     # If False, bot still listens to channels but won't respond with links
     SEND_LINKS_TO_CHANNELS = environ.get("SEND_LINKS_TO_CHANNELS", "true").lower() == "true"
+
+    # File metadata cache (entries keyed by channel_id/message_id)
+    METADATA_CACHE_SIZE = int(environ.get("METADATA_CACHE_SIZE", "10000"))
+    METADATA_CACHE_TTL = int(environ.get("METADATA_CACHE_TTL", "1800"))  # 30 minutes
+    METADATA_CACHE_STALE_TTL = int(environ.get("METADATA_CACHE_STALE_TTL", "600"))  # served while refreshing
+
+    # Load and cache statistics on /stats, disabled unless STATS_SECRET is set (sent as a Bearer token)
+    STATS_SECRET = str(environ.get("STATS_SECRET", ""))
+
+    # Persistent metadata index, a SQLite file path (empty, the default, disables it)
+    METADATA_DB = str(environ.get("METADATA_DB", ""))
+    METADATA_DB_FLUSH_INTERVAL = float(environ.get("METADATA_DB_FLUSH_INTERVAL", "2"))
+    METADATA_REF_MAX_AGE = int(environ.get("METADATA_REF_MAX_AGE", "86400"))  # reuse stored references for 1 day
+
+    # Maximum number of messages resolved by one /link/batch request
+    BATCH_LINK_MAX_ITEMS = int(environ.get("BATCH_LINK_MAX_ITEMS", "50000"))
+
+    # Window (ms) in which concurrent get_messages lookups for one chat are merged, 0 disables it
+    GET_MESSAGES_BATCH_WINDOW = float(environ.get("GET_MESSAGES_BATCH_WINDOW", "5"))
+
+    # Peer resolution cache, negative results expire sooner so channels can recover
+    PEER_CACHE_TTL = int(environ.get("PEER_CACHE_TTL", "86400"))
+    PEER_NEGATIVE_TTL = int(environ.get("PEER_NEGATIVE_TTL", "300"))
+    PEER_PREWARM_TIMEOUT = int(environ.get("PEER_PREWARM_TIMEOUT", "60"))  # startup waits this long at most
+
+    # Parsed /dl URLs kept in memory so repeated Range requests skip decoding
+    DL_DESCRIPTOR_CACHE_SIZE = int(environ.get("DL_DESCRIPTOR_CACHE_SIZE", "4096"))
+
+    # Signed link tokens: use them for posted links, and optionally let them expire (seconds, 0 = never)
+    SIGNED_LINKS = environ.get("SIGNED_LINKS", "false").lower() == "true"
+    LINK_TOKEN_TTL = int(environ.get("LINK_TOKEN_TTL", "0"))
+
+    # Local disk cache of streamed parts (size in MB, 0 disables it and is the default), fully cached ranges are sent with sendfile
+    CHUNK_CACHE_DIR = str(environ.get("CHUNK_CACHE_DIR", "chunk_cache"))
+    CHUNK_CACHE_SIZE = int(environ.get("CHUNK_CACHE_SIZE", "0"))
+    # Behind nginx, hand cached files off with X-Accel-Redirect to this internal location (e.g. /cached/)
+    ACCEL_REDIRECT_PREFIX = str(environ.get("ACCEL_REDIRECT_PREFIX", ""))
+
+    # Per-IP limits (0 disables each): requests per minute and burst per route, concurrent /dl streams,
+    # and a bandwidth ceiling per stream in KiB/s. Only trust X-Forwarded-For when behind a proxy.
+    DL_RATE_LIMIT = float(environ.get("DL_RATE_LIMIT", "0"))
+    DL_RATE_BURST = int(environ.get("DL_RATE_BURST", "0"))
+    DL_MAX_STREAMS_PER_IP = int(environ.get("DL_MAX_STREAMS_PER_IP", "0"))
+    DL_STREAM_BANDWIDTH = int(environ.get("DL_STREAM_BANDWIDTH", "0"))
+    LINK_RATE_LIMIT = float(environ.get("LINK_RATE_LIMIT", "0"))
+    LINK_RATE_BURST = int(environ.get("LINK_RATE_BURST", "0"))
+    TRUST_PROXY_HEADERS = environ.get("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+    # Concurrent GetFile calls per client (0, the default, disables scheduling). Inline playback gets free
+    # slots first, bulk downloads go first after BULK_STARVATION_LIMIT interactive grants in a row.
+    GETFILE_SLOTS_PER_CLIENT = int(environ.get("GETFILE_SLOTS_PER_CLIENT", "0"))
+    BULK_STARVATION_LIMIT = int(environ.get("BULK_STARVATION_LIMIT", "4"))
+
+    # Hedged GetFile (opt-in): a part slower than this latency percentile is requested again on a
+    # second media session, at most HEDGE_BUDGET extra requests per request (0.05 = 5%)
+    HEDGE_REQUESTS = environ.get("HEDGE_REQUESTS", "false").lower() == "true"
+    HEDGE_PERCENTILE = float(environ.get("HEDGE_PERCENTILE", "95"))
+    HEDGE_BUDGET = float(environ.get("HEDGE_BUDGET", "0.05"))
+    HEDGE_MIN_DELAY = int(environ.get("HEDGE_MIN_DELAY", "200"))  # ms
+
+    # Size (KiB) of the first GetFile of a stream, later parts double up to 1 MiB. Rounded to a power of two.
+    FIRST_PART_SIZE = int(environ.get("FIRST_PART_SIZE", "64"))
+
+    # Readahead for sequential players: 1 MiB parts fetched into the chunk cache ahead of the
+    # next Range request (0, the default, disables it), readaheads running at once, and (IP, file) pairs tracked
+    READAHEAD_PARTS = int(environ.get("READAHEAD_PARTS", "0"))
+    READAHEAD_MAX_TASKS = int(environ.get("READAHEAD_MAX_TASKS", "32"))
+    READAHEAD_TRACKED = int(environ.get("READAHEAD_TRACKED", "10000"))
+
+    # Slow readers: a stream whose client drains slower than SLOW_READER_RATE KiB/s (measured once it
+    # spent SLOW_READER_GRACE seconds waiting on the client) is fed from the chunk cache, which is filled
+    # at full speed up to SLOW_READER_WINDOW MiB ahead. 0 (the default) disables it, it also needs the chunk cache.
+    SLOW_READER_RATE = int(environ.get("SLOW_READER_RATE", "0"))
+    SLOW_READER_GRACE = float(environ.get("SLOW_READER_GRACE", "10"))
+    SLOW_READER_WINDOW = int(environ.get("SLOW_READER_WINDOW", "32"))
+
+    # Upload-time warm-up: the first WARMUP_HEAD_MIB and last WARMUP_TAIL_MIB MiB of newly posted
+    # video and audio files are fetched into the chunk cache by low priority background workers
+    WARMUP_ON_UPLOAD = environ.get("WARMUP_ON_UPLOAD", "false").lower() == "true"
+    WARMUP_HEAD_MIB = int(environ.get("WARMUP_HEAD_MIB", "4"))
+    WARMUP_TAIL_MIB = int(environ.get("WARMUP_TAIL_MIB", "2"))
+    WARMUP_QUEUE_SIZE = int(environ.get("WARMUP_QUEUE_SIZE", "100"))
+    WARMUP_WORKERS = int(environ.get("WARMUP_WORKERS", "1"))
+
+    # Time-based seeking (/seek and ?t= on /dl): parsed MP4/Matroska indexes kept in memory,
+    # and the largest moov box or Cues element read to build one (MiB)
+    MEDIA_INDEX_CACHE_SIZE = int(environ.get("MEDIA_INDEX_CACHE_SIZE", "1000"))
+    MEDIA_INDEX_MAX_SIZE = int(environ.get("MEDIA_INDEX_MAX_SIZE", "16"))
+
+    # Thumbnails served on /thumb are kept in memory up to THUMB_CACHE_SIZE MiB
+    THUMB_CACHE_SIZE = int(environ.get("THUMB_CACHE_SIZE", "64"))
+
+    # ZIP bundles on /bundle: most files per bundle and CRC-32s of streamed files kept for resumed downloads
+    BUNDLE_MAX_FILES = int(environ.get("BUNDLE_MAX_FILES", "100"))
+    BUNDLE_CRC_CACHE_SIZE = int(environ.get("BUNDLE_CRC_CACHE_SIZE", "10000"))
+
+    # Prefetch jobs (POST /prefetch) pull whole files into the chunk cache with every client,
+    # PREFETCH_BANDWIDTH KiB/s shared by all of them (0 for no limit). Disabled unless PREFETCH_SECRET
+    # is set, submitting a job needs "Authorization: Bearer <secret>" on top of a signed link.
+    PREFETCH_BANDWIDTH = int(environ.get("PREFETCH_BANDWIDTH", "8192"))
+    PREFETCH_PARTS_PER_CLIENT = int(environ.get("PREFETCH_PARTS_PER_CLIENT", "2"))
+    PREFETCH_SECRET = str(environ.get("PREFETCH_SECRET", ""))
+
+    # HTTP uploads into BIN_CHANNEL on POST /upload, disabled unless UPLOAD_SECRET is set (sent as a Bearer token).
+    # Parts go out over UPLOAD_SESSIONS media sessions of one client, UPLOAD_PARTS_IN_FLIGHT at a time.
+    UPLOAD_SECRET = str(environ.get("UPLOAD_SECRET", ""))
+    UPLOAD_MAX_SIZE = int(environ.get("UPLOAD_MAX_SIZE", "2000"))  # MiB
+    UPLOAD_SESSIONS = int(environ.get("UPLOAD_SESSIONS", "4"))
+    UPLOAD_PARTS_IN_FLIGHT = int(environ.get("UPLOAD_PARTS_IN_FLIGHT", "8"))
+
+    # Remote URL ingest on POST /ingest (same UPLOAD_SECRET as /upload). Each job downloads
+    # INGEST_CONNECTIONS ranges of INGEST_SEGMENT_SIZE MiB at once and keeps at most
+    # INGEST_BUFFER_SEGMENTS segments ahead of its upload.
+    INGEST_CONNECTIONS = int(environ.get("INGEST_CONNECTIONS", "4"))
+    INGEST_SEGMENT_SIZE = int(environ.get("INGEST_SEGMENT_SIZE", "2"))  # MiB
+    INGEST_BUFFER_SEGMENTS = int(environ.get("INGEST_BUFFER_SEGMENTS", "8"))
+    INGEST_RETRIES = int(environ.get("INGEST_RETRIES", "3"))
+    INGEST_CONCURRENCY = int(environ.get("INGEST_CONCURRENCY", "2"))
+
+    # Opt-in: map duplicate files (same file_unique_id when posted, same SHA-256 when uploaded) onto the first copy,
+    # the mapping is kept in memory and in METADATA_DB if set. An upload sent with "X-Content-SHA256" of a
+    # known file is only hashed to check it, it isn't uploaded to Telegram again.
+    DEDUP = environ.get("DEDUP", "false").lower() == "true"
@@ -0,0 +1,36 @@
+"""
+Shared setup of the test scripts. WebStreamer reads its config on import, so every test module imports
+this first: pytest loads it by itself, and the scripts import it so they still run on their own.
+"""
+
+import os
+import tempfile
+from types import SimpleNamespace
+
+for key, value in {"API_ID": "1", "API_HASH": "x", "BOT_TOKEN": "1:x",
+                   "BIN_CHANNEL": "-1001", "BIN_CHANNEL_WITHOUT_MINUS": "1001"}.items():
+    os.environ.setdefault(key, value)
+
+from pyrogram.file_id import FileId, FileType  # noqa: E402 - after the config
+
+
+def make_file_id(media_id, file_size, file_type=FileType.DOCUMENT):
+    """A FileId carrying its size, as the streaming code expects"""
+    file_id = FileId(file_type=file_type, dc_id=4, media_id=media_id, access_hash=1, file_reference=b"ref")
+    setattr(file_id, "file_size", file_size)
+    return file_id
+
+
+def make_message(message_id, media_id, file_name="file.bin", file_size=1000, mime_type="application/octet-stream"):
+    """A channel post with a document, shaped like pyrogram's Message"""
+    document = SimpleNamespace(file_id=make_file_id(media_id, file_size).encode(), file_unique_id=f"AgAD{media_id}",
+                               file_name=file_name, file_size=file_size, mime_type=mime_type)
+    return SimpleNamespace(id=message_id, empty=False, document=document)
+
+
+async def use_temp_chunk_cache(max_parts=64):
+    """Points the shared chunk cache at a fresh directory"""
+    from WebStreamer.utils.chunk_cache import chunk_cache, PART_SIZE
+    chunk_cache.directory = tempfile.mkdtemp()
+    chunk_cache.max_bytes = max_parts * PART_SIZE
+    await chunk_cache.load()
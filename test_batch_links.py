@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the batch link endpoint validates its input, enforces its limit and resolves messages in bulk
+"""
+
+import json
+import asyncio
+
+from conftest import make_message
+
+from aiohttp.test_utils import TestClient, TestServer
+from WebStreamer import Var
+from WebStreamer.server import web_server
+from WebStreamer.server.stream_routes import class_cache, parse_batch_payload
+from WebStreamer.bot import multi_clients, work_loads
+
+CHANNEL = -100290
+
+
+class FakeClient:
+    name = "batch"
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.calls = []
+
+    async def get_messages(self, chat_id, message_ids):
+        self.calls.append((chat_id, list(message_ids)))
+        return [self.messages.get(message_id) for message_id in message_ids]
+
+
+async def post_batch(payload, messages=None, **kwargs):
+    client = FakeClient(messages or {})
+    multi_clients.clear()
+    multi_clients[0] = client
+    work_loads.clear()
+    work_loads[0] = 0
+    class_cache.clear()
+    async with TestClient(TestServer(web_server())) as http:
+        response = await http.post("/link/batch", json=payload, **kwargs)
+        text = await response.text()
+    return response.status, text, client
+
+
+def test_parse_batch_payload():
+    # Pairs are grouped by channel in order, repeated messages are resolved once
+    groups = parse_batch_payload({"items": [[-1, 5], [-2, 7], {"channel_id": -1, "message_id": 3}, [-1, 5]]})
+    assert groups == {-1: [5, 3], -2: [7]}
+    assert parse_batch_payload([["-1", "9"]]) == {-1: [9]}
+    assert parse_batch_payload({"channel_id": -1, "start": 10, "end": 12}) == {-1: [10, 11, 12]}
+    for payload in ({"channel_id": -1, "start": 5, "end": 1},
+                    {"channel_id": -1, "start": 1, "end": Var.BATCH_LINK_MAX_ITEMS + 1},
+                    {"channel_id": -1},
+                    {"items": [[-1]]},
+                    {"items": [["x", 1]]}):
+        try:
+            parse_batch_payload(payload)
+        except (ValueError, KeyError, TypeError):
+            continue
+        raise AssertionError(payload)
+
+
+def test_links_resolved_in_bulk():
+    async def run():
+        messages = {1: make_message(1, 291, "one.mp4", 2048, "video/mp4"), 3: make_message(3, 293, "three.bin")}
+        status, text, client = await post_batch({"items": [[CHANNEL, 1], [CHANNEL, 2], [CHANNEL, 3]]}, messages)
+        assert status == 200
+        lines = [json.loads(line) for line in text.splitlines()]
+        assert [line["message_id"] for line in lines] == [1, 2, 3]
+        assert lines[0]["success"] and lines[0]["file_info"]["file_name"] == "one.mp4"
+        assert lines[0]["file_info"]["file_size"] == 2048 and "/dl/" in lines[0]["download_url"]
+        assert lines[1] == {"channel_id": CHANNEL, "message_id": 2, "success": False, "error": "File not found"}
+        assert lines[2]["success"]
+        # One multi-id get_messages call for the whole channel
+        assert client.calls == [(CHANNEL, [1, 2, 3])]
+
+        # Resolved messages come from the metadata cache afterwards
+        _, text, client = await post_batch({"channel_id": CHANNEL, "start": 1, "end": 3}, messages)
+        assert client.calls == [(CHANNEL, [2])]
+        assert [json.loads(line)["success"] for line in text.splitlines()] == [True, True, False]
+
+    asyncio.run(run())
+
+
+def test_invalid_requests_and_limit():
+    async def run():
+        status, text, client = await post_batch(None, data="not json")
+        assert status == 400 and json.loads(text)["error"] == "Invalid batch request"
+        status, _, _ = await post_batch({"channel_id": CHANNEL, "start": 3, "end": 1})
+        assert status == 400
+
+        limit = Var.BATCH_LINK_MAX_ITEMS
+        Var.BATCH_LINK_MAX_ITEMS = 2
+        try:
+            status, text, client = await post_batch({"items": [[CHANNEL, 7], [CHANNEL, 8], [-100291, 7]]})
+            assert status == 413 and "limit is 2" in json.loads(text)["error"]
+            assert not client.calls
+        finally:
+            Var.BATCH_LINK_MAX_ITEMS = limit
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_parse_batch_payload()
+    test_links_resolved_in_bulk()
+    test_invalid_requests_and_limit()
+    print("✅ All batch link tests passed!")
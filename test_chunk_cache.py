@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the disk chunk cache stores, serves and evicts file parts
+"""
+
+import os
+import asyncio
+import tempfile
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.utils.chunk_cache import ChunkCache, PART_SIZE
+
+FILE_ID = FileId(file_type=FileType.VIDEO, dc_id=4, media_id=42, access_hash=1, file_reference=b"ref")
+DATA = os.urandom(2 * PART_SIZE + 1000)
+
+
+def parts():
+    return [DATA[i:i + PART_SIZE] for i in range(0, len(DATA), PART_SIZE)]
+
+
+def test_store_and_read_parts():
+    async def run():
+        cache = ChunkCache(tempfile.mkdtemp(), 64 * PART_SIZE)
+        await cache.load()
+        assert await cache.read_part(FILE_ID, len(DATA), 0) is None
+        for index, part in enumerate(parts()):
+            await cache.write_part(FILE_ID, len(DATA), index, part)
+        assert await cache.read_part(FILE_ID, len(DATA), 2) == DATA[2 * PART_SIZE:]
+        path = cache.covered_path(FILE_ID, len(DATA), 10, len(DATA) - 1)
+        with open(path, "rb") as f:
+            assert f.read() == DATA
+        # A different size means a different (or corrected) file
+        assert cache.covered_path(FILE_ID, len(DATA) + 1, 0, 10) is None
+
+    asyncio.run(run())
+
+
+def test_incomplete_parts_are_not_stored():
+    async def run():
+        cache = ChunkCache(tempfile.mkdtemp(), 64 * PART_SIZE)
+        await cache.load()
+        await cache.write_part(FILE_ID, len(DATA), 0, parts()[0][:100])
+        await cache.write_part(FILE_ID, len(DATA), 1, parts()[1])
+        assert not cache.has_part(FILE_ID, len(DATA), 0)
+        assert cache.covered_path(FILE_ID, len(DATA), PART_SIZE, 2 * PART_SIZE - 1)
+        assert cache.covered_path(FILE_ID, len(DATA), 0, PART_SIZE) is None
+
+    asyncio.run(run())
+
+
+def test_index_survives_restart_and_evicts():
+    async def run():
+        directory = tempfile.mkdtemp()
+        cache = ChunkCache(directory, 64 * PART_SIZE)
+        await cache.load()
+        await cache.write_part(FILE_ID, len(DATA), 1, parts()[1])
+        restarted = ChunkCache(directory, 64 * PART_SIZE)
+        await restarted.load()
+        assert restarted.has_part(FILE_ID, len(DATA), 1)
+        assert restarted.total_bytes == PART_SIZE
+
+        other = FileId(file_type=FileType.VIDEO, dc_id=4, media_id=43, access_hash=1, file_reference=b"ref")
+        restarted.max_bytes = PART_SIZE
+        await restarted.write_part(other, PART_SIZE, 0, parts()[0])
+        assert not restarted.has_part(FILE_ID, len(DATA), 1)
+        assert restarted.has_part(other, PART_SIZE, 0)
+        assert sorted(os.listdir(directory)) == ["4_43.bin", "4_43.parts"]
+
+    asyncio.run(run())
+
+
+def test_concurrent_writes_keep_every_part_on_restart():
+    async def run():
+        directory = tempfile.mkdtemp()
+        cache = ChunkCache(directory, 64 * PART_SIZE)
+        await cache.load()
+        await asyncio.gather(*(cache.write_part(FILE_ID, len(DATA), index, part)
+                               for index, part in enumerate(parts())))
+        restarted = ChunkCache(directory, 64 * PART_SIZE)
+        await restarted.load()
+        assert restarted.covered_path(FILE_ID, len(DATA), 0, len(DATA) - 1)
+        assert sorted(os.listdir(directory)) == ["4_42.bin", "4_42.parts"]
+
+    asyncio.run(run())
+
+
+def test_pinned_files_are_not_evicted():
+    async def run():
+        directory = tempfile.mkdtemp()
+        cache = ChunkCache(directory, PART_SIZE)
+        await cache.load()
+        await cache.write_part(FILE_ID, len(DATA), 0, parts()[0])
+        other = FileId(file_type=FileType.VIDEO, dc_id=4, media_id=43, access_hash=1, file_reference=b"ref")
+        with cache.pinned("4_42"):
+            # Over budget until the file being served is released
+            await cache.write_part(other, PART_SIZE, 0, parts()[0])
+            assert cache.has_part(FILE_ID, len(DATA), 0) and cache.total_bytes == 2 * PART_SIZE
+        third = FileId(file_type=FileType.VIDEO, dc_id=4, media_id=44, access_hash=1, file_reference=b"ref")
+        await cache.write_part(third, PART_SIZE, 0, parts()[0])
+        assert sorted(os.listdir(directory)) == ["4_44.bin", "4_44.parts"]
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_store_and_read_parts()
+    test_incomplete_parts_are_not_stored()
+    test_index_survives_restart_and_evicts()
+    test_concurrent_writes_keep_every_part_on_restart()
+    test_pinned_files_are_not_evicted()
+    print("✅ All chunk cache tests passed!")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test script to verify duplicate files map onto their first copy and the mapping survives a restart
+"""
+
+import os
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from WebStreamer.utils.dedup import DedupIndex, CanonicalFile
+from WebStreamer.utils.metadata_store import metadata_store
+from WebStreamer.utils.metadata import file_metadata, remember_file_id, alias_metadata
+from pyrogram.file_id import FileId, FileType
+
+SHA256 = "ab" * 32
+
+
+def posted(message_id, unique_id="AgADAQ", channel_id=-1001):
+    document = SimpleNamespace(file_unique_id=unique_id, file_id=f"file-{message_id}", file_size=1234,
+                               mime_type="video/mp4", file_name=f"copy-{message_id}.mp4")
+    return SimpleNamespace(id=message_id, chat=SimpleNamespace(id=channel_id), document=document)
+
+
+def test_duplicates_map_onto_first_copy():
+    async def run():
+        index = DedupIndex(True)
+        first = await index.claim("unique", "AgADAQ", CanonicalFile.from_message(posted(1)))
+        assert first.locator == (-1001, 1)
+        # Another client handling the same message isn't a lookup
+        assert (await index.claim("unique", "AgADAQ", CanonicalFile.from_message(posted(1)))).locator == (-1001, 1)
+        copy = await index.claim("unique", "AgADAQ", CanonicalFile.from_message(posted(7, channel_id=-1002)))
+        assert copy.locator == (-1001, 1) and copy.file_name == "copy-1.mp4"
+        other = await index.claim("unique", "AgADAg", CanonicalFile.from_message(posted(8, "AgADAg")))
+        assert other.locator == (-1001, 8)
+        stats = index.stats()
+        assert stats["lookups"] == 3 and stats["hits"] == 1 and stats["hit_rate"] == 0.3333
+        assert stats["unique"] == {"lookups": 3, "hits": 1}
+        assert await index.lookup("sha256", SHA256) is None
+        # Dedup off, every file is its own canonical file
+        assert (await DedupIndex(False).claim("unique", "AgADAQ", CanonicalFile.from_message(posted(7)))).locator == (-1001, 7)
+
+    asyncio.run(run())
+
+
+def test_mapping_survives_restart():
+    async def run():
+        metadata_store.path = os.path.join(tempfile.mkdtemp(), "metadata.db")
+        await metadata_store.start()
+        try:
+            index = DedupIndex(True)
+            await index.claim("sha256", SHA256, CanonicalFile.from_message(posted(3)))
+            # A concurrent upload of the same content loses, the first claim is kept
+            assert (await index.claim("sha256", SHA256, CanonicalFile.from_message(posted(4)))).locator == (-1001, 3)
+
+            restarted = DedupIndex(True)
+            canonical = await restarted.lookup("sha256", SHA256)
+            assert canonical is not None and canonical.locator == (-1001, 3)
+            assert canonical.file_id == "file-3" and canonical.file_size == 1234
+            assert (await restarted.claim("sha256", SHA256, CanonicalFile.from_message(posted(5)))).locator == (-1001, 3)
+            assert restarted.stats()["sha256"] == {"lookups": 2, "hits": 2}
+        finally:
+            await metadata_store.close()
+            metadata_store.path = ""
+
+    asyncio.run(run())
+
+
+def test_duplicate_shares_canonical_metadata():
+    def file_id(access_hash):
+        value = FileId(file_type=FileType.DOCUMENT, dc_id=4, media_id=5, access_hash=access_hash, file_reference=b"r")
+        setattr(value, "unique_id", "AgADBQ")
+        setattr(value, "file_name", f"copy-{access_hash}.mp4")
+        return value
+
+    remember_file_id(-1001, 21, "bot1", file_id(1))
+    remember_file_id(-1002, 22, "bot2", file_id(2))
+    canonical = alias_metadata(-1002, 22, -1001, 21)
+    assert file_metadata.peek((-1002, 22)) is canonical is file_metadata.peek((-1001, 21))
+    assert sorted(canonical.file_ids) == ["bot1", "bot2"] and canonical.file_name == "copy-1.mp4"
+    # Later references of the duplicate land in the shared entry
+    remember_file_id(-1002, 22, "bot3", file_id(3))
+    assert canonical.file_id_for("bot3").access_hash == 3
+    # Without a cached canonical entry, one is made from the duplicate under the canonical name
+    remember_file_id(-1002, 23, "bot1", file_id(4))
+    made = alias_metadata(-1002, 23, -1001, 24, "first.mp4")
+    assert file_metadata.peek((-1001, 24)) is made and made.file_name == "first.mp4"
+
+
+if __name__ == "__main__":
+    test_duplicates_map_onto_first_copy()
+    test_duplicate_shares_canonical_metadata()
+    test_mapping_survives_restart()
+    print("✅ All dedup tests passed!")
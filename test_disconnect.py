@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script to verify a stream's in-flight GetFile is cancelled as soon as the viewer disconnects
+"""
+
+import os
+import asyncio
+import importlib
+
+from conftest import make_file_id
+
+from aiohttp.test_utils import TestServer
+from pyrogram import raw
+from WebStreamer.server import web_server
+from WebStreamer.bot import multi_clients, work_loads
+from WebStreamer.utils import ByteStreamer
+from WebStreamer.utils.rate_limit import dl_limiter
+
+# The package exports the route table under the module's name
+stream_routes = importlib.import_module("WebStreamer.server.stream_routes")
+
+MiB = 1024 * 1024
+DATA = os.urandom(8 * MiB)
+FILE_ID = make_file_id(41, len(DATA)).encode()
+
+
+class SlowSession:
+    """Media session whose GetFile calls take a while, like a far away DC"""
+
+    def __init__(self):
+        self.calls = 0
+        self.inflight = 0
+        self.cancelled = 0
+
+    async def invoke(self, query):
+        self.calls += 1
+        self.inflight += 1
+        try:
+            await asyncio.sleep(0.3)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.inflight -= 1
+        return raw.types.upload.File(type=raw.types.storage.FilePartial(), mtime=0,
+                                     bytes=DATA[query.offset:query.offset + query.limit])
+
+
+class FakeClient:
+    name = "disconnect"
+
+    def __init__(self):
+        self.media_sessions = {4: SlowSession()}
+
+
+def test_disconnect_cancels_upstream_fetch():
+    async def run():
+        client = FakeClient()
+        session = client.media_sessions[4]
+        multi_clients.clear()
+        multi_clients[0] = client
+        work_loads.clear()
+        work_loads[0] = 0
+        stream_routes.class_cache.clear()
+        stream_routes.class_cache[client] = ByteStreamer(client)
+        stream_routes.DISCONNECT_POLL_INTERVAL = 0.05
+        disconnected = stream_routes.stream_stats["disconnected"]
+
+        server = TestServer(web_server())
+        await server.start_server()
+        try:
+            reader, writer = await asyncio.open_connection(server.host, server.port)
+            writer.write(f"GET /dl/AgADKQ/{FILE_ID}/{len(DATA)}/video.mp4 HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+            await writer.drain()
+            received = 0
+            while received < 300000:
+                received += len(await reader.read(65536))
+            assert work_loads[0] == 1 and dl_limiter.stats()["active_streams"] == 1
+
+            # The viewer goes away while the next part is being fetched
+            writer.close()
+            await asyncio.sleep(0.2)
+            assert session.cancelled == 1 and session.inflight == 0
+            assert work_loads[0] == 0
+            assert dl_limiter.stats()["active_streams"] == 0
+            assert stream_routes.stream_stats["disconnected"] == disconnected + 1
+            # Nothing else is fetched for it
+            calls = session.calls
+            await asyncio.sleep(0.4)
+            assert session.calls == calls
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_disconnect_cancels_upstream_fetch()
+    print("✅ All disconnect tests passed!")
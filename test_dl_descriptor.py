@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Test script to verify /dl URLs resolve to the right download descriptor and which ones are cached
+"""
+
+import asyncio
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from aiohttp.test_utils import make_mocked_request
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.server.stream_routes import dl_descriptors, resolve_descriptor
+from WebStreamer.utils import get_token_link
+from WebStreamer.utils.metadata import FileMetadata, unique_index
+
+FILE_ID = FileId(file_type=FileType.VIDEO, dc_id=4, media_id=77, access_hash=1, file_reference=b"ref").encode()
+DEFAULT_SIZE = 1024 * 1024 * 1024
+
+
+def dl_request(unique_id, size, file_name, route="dl"):
+    match_info = {"unique_file_id": unique_id, "file_id": FILE_ID, "size": str(size), "filename": file_name}
+    return make_mocked_request("GET", f"/{route}/{unique_id}/{FILE_ID}/{size}/{file_name}", match_info=match_info)
+
+
+def test_unknown_size_not_in_index():
+    async def run():
+        # Nothing to look the file up by: the default size is served and the descriptor isn't kept
+        for _ in range(2):
+            descriptor = await resolve_descriptor(dl_request("AgADmiss", 0, "clip.mp4"))
+            assert descriptor.file_size == DEFAULT_SIZE
+            assert descriptor.file_id.file_size == DEFAULT_SIZE
+            assert descriptor.file_name == "clip.mp4" and descriptor.mime_type == "video/mp4"
+            assert f"AgADmiss/{FILE_ID}/0/clip.mp4" not in dl_descriptors
+
+        # Once the index knows the file its real properties are used and cached
+        unique_index.set("AgADmiss", FileMetadata("AgADmiss", 5000, "video/x-matroska", "real.mkv", 4))
+        descriptor = await resolve_descriptor(dl_request("AgADmiss", 0, "clip.mp4"))
+        assert descriptor.file_size == 5000 and descriptor.file_id.file_size == 5000
+        assert descriptor.file_name == "real.mkv" and descriptor.mime_type == "video/x-matroska"
+        assert f"AgADmiss/{FILE_ID}/0/clip.mp4" in dl_descriptors
+
+    asyncio.run(run())
+
+
+def test_descriptor_cache_keys():
+    async def run():
+        first = await resolve_descriptor(dl_request("AgADkey", 4096, "movie.mkv"))
+        assert first.file_size == 4096 and first.mime_type == "video/x-matroska"
+        assert first.file_id.file_size == 4096 and first.file_id.media_id == 77
+        assert f"AgADkey/{FILE_ID}/4096/movie.mkv" in dl_descriptors
+        # Repeated requests, and /seek URLs of the same file, reuse the parsed entry
+        assert await resolve_descriptor(dl_request("AgADkey", 4096, "movie.mkv")) is first
+        assert await resolve_descriptor(dl_request("AgADkey", 4096, "movie.mkv", route="seek")) is first
+        # Any other part of the URL is another entry
+        renamed = await resolve_descriptor(dl_request("AgADkey", 4096, "other.mp4"))
+        assert renamed is not first and renamed.file_name == "other.mp4" and renamed.mime_type == "video/mp4"
+        resized = await resolve_descriptor(dl_request("AgADkey", 8192, "movie.mkv"))
+        assert resized is not first and resized.file_size == 8192
+
+        # Signed tokens carry everything already, they don't go through the cache
+        entries = len(dl_descriptors)
+        url = get_token_link(FileId.decode(FILE_ID), "token.mp4", 1234, "video/mp4", -1001, 5)
+        token = url.split("/")[-2]
+        match_info = {"token": token, "filename": "token.mp4"}
+        request = make_mocked_request("GET", f"/dl/{token}/token.mp4", match_info=match_info)
+        descriptor = await resolve_descriptor(request)
+        assert descriptor.file_size == 1234 and descriptor.file_name == "token.mp4"
+        assert len(dl_descriptors) == entries
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_unknown_size_not_in_index()
+    test_descriptor_cache_keys()
+    print("✅ All download descriptor tests passed!")
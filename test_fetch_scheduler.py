@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test script to verify GetFile slots go to interactive streams first without starving bulk downloads
+"""
+
+import asyncio
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from WebStreamer.utils.scheduler import FetchScheduler, INTERACTIVE, BULK
+
+
+async def run_fetches(scheduler, priorities):
+    order = []
+    gate = asyncio.Event()
+
+    async def fetch(name, priority):
+        async with scheduler.slot(priority):
+            await gate.wait()
+            order.append(name)
+
+    # Occupy the only slot so everything else queues up in arrival order
+    blocker = asyncio.ensure_future(fetch("blocker", BULK))
+    await asyncio.sleep(0)
+    tasks = [asyncio.ensure_future(fetch(name, priority)) for name, priority in priorities]
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(blocker, *tasks)
+    return order[1:]
+
+
+def test_interactive_goes_first():
+    order = asyncio.run(run_fetches(FetchScheduler(1, starvation_limit=10), [
+        ("bulk1", BULK), ("bulk2", BULK), ("play1", INTERACTIVE), ("play2", INTERACTIVE),
+    ]))
+    assert order == ["play1", "play2", "bulk1", "bulk2"], order
+
+
+def test_bulk_is_not_starved():
+    order = asyncio.run(run_fetches(FetchScheduler(1, starvation_limit=2), [
+        ("bulk1", BULK), *[(f"play{i}", INTERACTIVE) for i in range(5)],
+    ]))
+    assert order.index("bulk1") == 2, order
+
+
+def test_cancelled_waiter_frees_its_place():
+    async def run():
+        scheduler = FetchScheduler(1)
+        await scheduler.acquire(BULK)
+        waiter = asyncio.ensure_future(scheduler.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        assert scheduler.active == 0
+        async with scheduler.slot(BULK):
+            assert scheduler.active == 1
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_interactive_goes_first()
+    test_bulk_is_not_starved()
+    test_cancelled_waiter_frees_its_place()
+    print("✅ All fetch scheduler tests passed!")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Test script to verify slow requests are hedged within the budget and the losing call is cancelled
+"""
+
+import asyncio
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from WebStreamer.utils.hedging import HedgePolicy
+
+
+async def answer(value, delay, log=None):
+    try:
+        await asyncio.sleep(delay)
+        return value
+    except asyncio.CancelledError:
+        if log is not None:
+            log.append(value)
+        raise
+
+
+async def train(policy, count=50):
+    for _ in range(count):
+        await policy.run("dc4", lambda: answer("fast", 0), lambda: answer("backup", 0))
+
+
+def test_slow_request_is_hedged_and_loser_cancelled():
+    async def run():
+        policy = HedgePolicy(True, percentile=95, budget=1.0, min_delay=0.01)
+        await train(policy)
+        cancelled = []
+        result = await policy.run("dc4", lambda: answer("slow", 5, cancelled), lambda: answer("backup", 0))
+        assert result == "backup"
+        await asyncio.sleep(0)
+        assert cancelled == ["slow"]
+        assert (policy.hedges, policy.hedge_wins) == (1, 1)
+
+    asyncio.run(run())
+
+
+def test_budget_caps_hedges():
+    async def run():
+        policy = HedgePolicy(True, percentile=95, budget=0.05, min_delay=0.01)
+        await train(policy, 20)
+        for _ in range(5):
+            assert await policy.run("dc4", lambda: answer("slow", 0.03), lambda: answer("backup", 0))
+        # 25 requests at 5% only ever earn one hedge
+        assert policy.hedges == 1
+
+    asyncio.run(run())
+
+
+def test_disabled_policy_never_hedges():
+    async def run():
+        policy = HedgePolicy(False, min_delay=0.01)
+        await train(policy)
+        assert await policy.run("dc4", lambda: answer("slow", 0.05), lambda: answer("backup", 0)) == "slow"
+        assert policy.hedges == 0
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_slow_request_is_hedged_and_loser_cancelled()
+    test_budget_caps_hedges()
+    test_disabled_policy_never_hedges()
+    print("✅ All hedging tests passed!")
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Test script to verify remote files are mirrored with parallel ranged downloads and resumed after failures
+"""
+
+import os
+import asyncio
+from types import SimpleNamespace
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.utils.ingest import IngestManager
+from WebStreamer.utils.uploader import UPLOAD_PART_SIZE, SMALL_FILE_SIZE
+
+DATA = os.urandom(SMALL_FILE_SIZE + 13 * UPLOAD_PART_SIZE + 99)
+
+
+class Source:
+    """A file server with Range support that can be told to fail requests past an offset"""
+
+    def __init__(self, ranges=True):
+        self.ranges = ranges
+        self.active = 0
+        self.max_active = 0
+        self.requested = []
+        self.fail_from = None
+
+    async def handle(self, request):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.005)
+            headers = {"Content-Type": "video/mp4"}
+            if not self.ranges or not request.http_range.start and request.http_range.stop is None:
+                return web.Response(body=DATA, headers=headers)
+            first, stop = request.http_range.start, min(request.http_range.stop or len(DATA), len(DATA))
+            self.requested.append(first)
+            if self.fail_from is not None and first >= self.fail_from:
+                return web.Response(status=503)
+            headers["Content-Range"] = f"bytes {first}-{stop - 1}/{len(DATA)}"
+            return web.Response(status=206, body=DATA[first:stop], headers=headers)
+        finally:
+            self.active -= 1
+
+
+class FakeTarget:
+    """Stands in for a client uploading into BIN_CHANNEL"""
+
+    def __init__(self):
+        self.parts = {}
+        self.sent = []
+        self.posted = None
+
+    async def save_part(self, request):
+        await asyncio.sleep(0.001)
+        self.sent.append(request.file_part)
+        self.parts[request.file_part] = request.bytes
+        return True
+
+    async def post(self, input_file, file_name, mime_type):
+        self.posted = (input_file, file_name, mime_type)
+        file_id = FileId(file_type=FileType.DOCUMENT, dc_id=4, media_id=1, access_hash=1, file_reference=b"r")
+        document = SimpleNamespace(file_id=file_id.encode(), file_unique_id="AgADAQ", file_name=file_name,
+                                   file_size=len(DATA), mime_type=mime_type)
+        return SimpleNamespace(id=9, chat=SimpleNamespace(id=-1001), document=document)
+
+    def data(self):
+        return b"".join(self.parts[i] for i in sorted(self.parts))
+
+
+async def serve(source):
+    app = web.Application()
+    app.router.add_get("/files/{name}", source.handle)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+async def wait_for(manager, job, states=("done", "failed")):
+    for _ in range(1000):
+        if job.state in states:
+            return job
+        await asyncio.sleep(0.01)
+    raise TimeoutError(job.status())
+
+
+def make_manager(target, **kwargs):
+    return IngestManager(connections=4, segment_size=2 * UPLOAD_PART_SIZE, window=6, retries=2,
+                         target_factory=lambda: target, retry_delay=0, **kwargs)
+
+
+def test_parallel_ranged_ingest():
+    async def run():
+        source, target = Source(), FakeTarget()
+        server = await serve(source)
+        manager = make_manager(target)
+        try:
+            job = manager.submit(str(server.make_url("/files/movie.mp4")))
+            await wait_for(manager, job)
+            assert job.state == "done", job.error
+            assert target.data() == DATA
+            input_file, file_name, mime_type = target.posted
+            assert file_name == "movie.mp4" and mime_type == "video/mp4"
+            assert input_file.parts == len(target.parts)
+            assert 1 < source.max_active <= 4
+            assert job.status()["progress"] == 1.0 and job.link.endswith("/movie.mp4")
+        finally:
+            await manager.close()
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_failed_job_resumes_after_acknowledged_parts():
+    async def run():
+        source, target = Source(), FakeTarget()
+        source.fail_from = 8 * UPLOAD_PART_SIZE
+        server = await serve(source)
+        manager = make_manager(target)
+        try:
+            job = manager.submit(str(server.make_url("/files/movie.mp4")), "mirror.mp4")
+            await wait_for(manager, job)
+            assert job.state == "failed" and job.attempts == 2
+            assert job.acked_parts == 8
+            upload_id = job.upload_id
+            target.sent.clear()
+            source.fail_from = None
+            manager.resume(job.job_id)
+            await wait_for(manager, job, ("done",))
+            # Only the parts after the acknowledged ones were sent again, under the same upload id
+            assert min(target.sent) == 8 and job.upload_id == upload_id
+            assert target.data() == DATA and target.posted[1] == "mirror.mp4"
+        finally:
+            await manager.close()
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_source_without_ranges():
+    async def run():
+        source, target = Source(ranges=False), FakeTarget()
+        server = await serve(source)
+        manager = make_manager(target)
+        try:
+            job = manager.submit(str(server.make_url("/files/plain.bin")))
+            await wait_for(manager, job)
+            assert job.state == "done", job.error
+            assert not job.ranged and target.data() == DATA
+            try:
+                manager.submit("file:///etc/passwd")
+                assert False, "file URL"
+            except ValueError:
+                pass
+        finally:
+            await manager.close()
+            await server.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_parallel_ranged_ingest()
+    test_failed_job_resumes_after_acknowledged_parts()
+    test_source_without_ranges()
+    print("✅ All ingest tests passed!")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Test script to verify signed link tokens round-trip and reject tampering
+"""
+
+import time
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.server.exceptions import InvalidHash
+from WebStreamer.utils.cryptography import encode_link_token, decode_link_token
+
+FILE_ID = FileId(
+    file_type=FileType.VIDEO,
+    dc_id=4,
+    media_id=5678901234567,
+    access_hash=-123456789012,
+    file_reference=bytes(range(29)),
+)
+
+
+def test_round_trip():
+    token = decode_link_token(encode_link_token(FILE_ID, 4 * 1024 ** 3, "video/mp4", -1001234567890, 99))
+    assert token.file_id.media_id == FILE_ID.media_id
+    assert token.file_id.access_hash == FILE_ID.access_hash
+    assert token.file_id.file_reference == FILE_ID.file_reference
+    assert token.file_id.dc_id == 4
+    assert token.file_size == 4 * 1024 ** 3
+    assert token.mime_type == "video/mp4"
+    assert (token.channel_id, token.message_id) == (-1001234567890, 99)
+
+
+def test_unknown_mime_is_guessed_later():
+    token = decode_link_token(encode_link_token(FILE_ID, 10, "application/x-custom"))
+    assert token.mime_type is None
+    assert token.channel_id is None
+
+
+def test_tampered_token_is_rejected():
+    token = encode_link_token(FILE_ID, 10, "video/mp4")
+    tampered = ("B" if token[10] == "A" else "A").join([token[:10], token[11:]])
+    for bad in (tampered, token[:-4], "not-a-token"):
+        try:
+            decode_link_token(bad)
+        except InvalidHash:
+            continue
+        raise AssertionError(f"accepted {bad}")
+
+
+def test_expired_token_is_rejected():
+    valid = encode_link_token(FILE_ID, 10, expires_at=time.time() + 60)
+    assert decode_link_token(valid).expires_at > time.time()
+    expired = encode_link_token(FILE_ID, 10, expires_at=time.time() - 1)
+    try:
+        decode_link_token(expired)
+    except InvalidHash:
+        return
+    raise AssertionError("accepted an expired token")
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_unknown_mime_is_guessed_later()
+    test_tampered_token_is_rejected()
+    test_expired_token_is_rejected()
+    print("✅ All link token tests passed!")
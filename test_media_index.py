@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Test script to verify MP4 and Matroska seek indexes are built from the container headers alone
+"""
+
+import struct
+import asyncio
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from WebStreamer.utils.media_index import build_media_index, load_media_index, media_indexes, empty_indexes
+
+MAX_INDEX_BYTES = 16 * 1024 * 1024
+
+
+class BytesReader:
+    """Serves reads from a bytes object and counts what was read"""
+
+    def __init__(self, data):
+        self.data = data
+        self.bytes_read = 0
+
+    async def __call__(self, offset, length):
+        chunk = self.data[offset:offset + length]
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def index_of(data):
+    reader = BytesReader(data)
+    index = asyncio.run(build_media_index(reader, len(data), MAX_INDEX_BYTES))
+    return index, reader
+
+
+# ---------------------------------------------------------------- MP4
+
+def box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload, version=0):
+    return box(box_type, struct.pack(">I", version << 24) + payload)
+
+
+def table(box_type, fmt, rows):
+    return full_box(box_type, struct.pack(">I", len(rows)) + b"".join(struct.pack(fmt, *row) for row in rows))
+
+
+def mp4_track(handler, timescale, deltas, sync, per_chunk, sizes, chunk_offsets):
+    stbl = box(b"stbl", b"".join([
+        table(b"stts", ">II", deltas),
+        table(b"stss", ">I", [(sample,) for sample in sync]) if sync else b"",
+        table(b"stsc", ">III", [(1, per_chunk, 1)]),
+        full_box(b"stsz", struct.pack(">II", 0, len(sizes)) + b"".join(struct.pack(">I", s) for s in sizes)),
+        table(b"stco", ">I", [(offset,) for offset in chunk_offsets]),
+    ]))
+    mdhd = full_box(b"mdhd", struct.pack(">IIII", 0, 0, timescale, sum(c * d for c, d in deltas)) + b"\0" * 4)
+    hdlr = full_box(b"hdlr", b"\0" * 4 + handler + b"\0" * 13)
+    return box(b"trak", box(b"mdia", mdhd + hdlr + box(b"minf", stbl)))
+
+
+def make_mp4():
+    """20 video samples of 0.5 s with a keyframe every 4, 4 samples per chunk, moov after a large mdat"""
+    ftyp = box(b"ftyp", b"isom\0\0\0\0isom")
+    mdat_start = len(ftyp) + 8
+    chunk_offsets = [mdat_start + chunk * 100000 for chunk in range(5)]
+    mdat = box(b"mdat", b"\0" * 5 * 100000)
+    mvhd = full_box(b"mvhd", struct.pack(">IIII", 0, 0, 1000, 10000) + b"\0" * 80)
+    audio = mp4_track(b"soun", 44100, [(40, 11025)], [], 8, [10] * 40, [mdat_start + 50000 + i for i in range(5)])
+    video = mp4_track(b"vide", 1000, [(20, 500)], [1, 5, 9, 13, 17], 4, [100 + i for i in range(20)], chunk_offsets)
+    return ftyp + mdat + box(b"moov", mvhd + audio + video), chunk_offsets
+
+
+def test_mp4_index():
+    data, chunk_offsets = make_mp4()
+    index, reader = index_of(data)
+    assert index.container == "mp4"
+    assert index.duration == 10.0
+    # Keyframes at samples 1, 5, 9, ... start the chunks of 4 samples
+    assert index.times == [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert index.offsets == chunk_offsets
+    assert index.seek(5.3) == (4.0, chunk_offsets[2])
+    assert index.seek(0) == (0.0, chunk_offsets[0])
+    assert index.seek(99) == (8.0, chunk_offsets[4])
+    # Only box headers and the moov were read, not the media data
+    assert reader.bytes_read < 2000, reader.bytes_read
+
+
+# ---------------------------------------------------------------- Matroska
+
+def element(element_id, payload):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return id_bytes + b"\x01" + len(payload).to_bytes(7, "big") + payload
+
+
+def uint(element_id, value, width=8):
+    return element(element_id, value.to_bytes(width, "big"))
+
+
+def make_mkv():
+    """Clusters every 2 s with the Cues after them, found through the SeekHead"""
+    ebml = element(0x1A45DFA3, element(0x4282, b"matroska"))
+    info = element(0x1549A966, uint(0x2AD7B1, 1000000) + element(0x4489, struct.pack(">d", 10000.0)))
+
+    def seek_head(info_position, cues_position):
+        return element(0x114D9B74, b"".join(
+            element(0x4DBB, element(0x53AB, element_id.to_bytes(4, "big")) + uint(0x53AC, position))
+            for element_id, position in ((0x1549A966, info_position), (0x1C53BB6B, cues_position))
+        ))
+
+    head_size = len(seek_head(0, 0))
+    clusters = [element(0x1F43B675, uint(0xE7, time) + b"\0" * 5000) for time in range(0, 10000, 2000)]
+    cluster_positions = []
+    position = head_size + len(info)
+    for cluster in clusters:
+        cluster_positions.append(position)
+        position += len(cluster)
+    cues = element(0x1C53BB6B, b"".join(
+        element(0xBB, uint(0xB3, time) + element(0xB7, uint(0xF7, 1, 1) + uint(0xF1, cluster_position)))
+        for time, cluster_position in zip(range(0, 10000, 2000), cluster_positions)
+    ))
+    segment = seek_head(head_size, position) + info + b"".join(clusters) + cues
+    segment_start = len(ebml) + 12
+    return ebml + element(0x18538067, segment), [segment_start + p for p in cluster_positions]
+
+
+def test_matroska_index():
+    data, cluster_offsets = make_mkv()
+    index, reader = index_of(data)
+    assert index.container == "matroska"
+    assert index.duration == 10.0
+    assert index.times == [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert index.offsets == cluster_offsets
+    assert index.seek(7.9) == (6.0, cluster_offsets[3])
+    # The clusters themselves are never read
+    assert reader.bytes_read < 1000, reader.bytes_read
+
+
+def test_unsupported_files_have_no_index():
+    for data in (b"plain text, not a video" * 100, b""):
+        index, _ = index_of(data)
+        assert not index and index.container is None
+    # A cut off MP4 without its moov
+    data, _ = make_mp4()
+    index, _ = index_of(data[:200000])
+    assert not index
+
+
+def test_only_usable_indexes_are_kept():
+    async def run():
+        data, _ = make_mp4()
+        # Unknown size: nothing is read and nothing is remembered
+        reader = BytesReader(data)
+        index = await load_media_index("sized-later", reader, 0, MAX_INDEX_BYTES)
+        assert not index and reader.bytes_read == 0
+        assert "sized-later" not in media_indexes and "sized-later" not in empty_indexes
+        # Once the size is known the index is built and kept
+        index = await load_media_index("sized-later", reader, len(data), MAX_INDEX_BYTES)
+        assert index and "sized-later" in media_indexes
+        reader.bytes_read = 0
+        assert await load_media_index("sized-later", reader, len(data), MAX_INDEX_BYTES) is index
+        assert reader.bytes_read == 0
+
+        # A file without an index is only remembered until its short TTL runs out
+        reader = BytesReader(b"plain text, not a video" * 100)
+        assert not await load_media_index("plain", reader, len(reader.data), MAX_INDEX_BYTES)
+        assert "plain" not in media_indexes and "plain" in empty_indexes
+        read = reader.bytes_read
+        assert not await load_media_index("plain", reader, len(reader.data), MAX_INDEX_BYTES)
+        assert reader.bytes_read == read
+        empty_indexes.pop("plain")
+        assert not await load_media_index("plain", reader, len(reader.data), MAX_INDEX_BYTES)
+        assert reader.bytes_read > read
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_mp4_index()
+    test_matroska_index()
+    test_unsupported_files_have_no_index()
+    test_only_usable_indexes_are_kept()
+    print("✅ All media index tests passed!")
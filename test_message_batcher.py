@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test script to verify concurrent message lookups are merged into multi-id get_messages calls
+"""
+
+import asyncio
+
+from conftest import make_message
+
+from WebStreamer.utils.file_properties import MessageBatcher, GET_MESSAGES_LIMIT
+
+
+class FakeClient:
+    name = "batcher"
+
+    def __init__(self, failing_chats=()):
+        self.failing_chats = failing_chats
+        self.calls = []
+
+    async def get_messages(self, chat_id, message_ids):
+        self.calls.append((chat_id, message_ids))
+        await asyncio.sleep(0.01)
+        if chat_id in self.failing_chats:
+            raise RuntimeError(f"Telegram says no to {chat_id}")
+        if isinstance(message_ids, int):
+            return make_message(message_ids, message_ids)
+        # Like Telegram, message 404 doesn't exist
+        return [make_message(message_id, message_id) if message_id != 404 else None for message_id in message_ids]
+
+
+def test_concurrent_lookups_are_merged():
+    async def run():
+        batcher = MessageBatcher(0.02)
+        client = FakeClient()
+        lookups = [(-1, 1), (-1, 2), (-1, 2), (-2, 1), (-1, 404), (-1, 3)]
+        messages = await asyncio.gather(*(batcher.get_message(client, chat, message) for chat, message in lookups))
+        # One request per chat, each message asked for once
+        assert sorted(client.calls) == [(-2, [1]), (-1, [1, 2, 404, 3])]
+        assert [m and m.id for m in messages] == [1, 2, 2, 1, None, 3]
+        assert messages[1] is messages[2]
+        assert batcher.stats()["lookups"] == 6 and batcher.stats()["requests"] == 2
+
+        # The next lookup after the window starts a new batch
+        assert (await batcher.get_message(client, -1, 5)).id == 5
+        assert client.calls[-1] == (-1, [5])
+
+    asyncio.run(run())
+
+
+def test_full_batch_is_sent_at_once():
+    async def run():
+        # The window would hold the batch for a minute, filling it up sends it right away
+        batcher = MessageBatcher(60)
+        client = FakeClient()
+        ids = list(range(1, GET_MESSAGES_LIMIT + 1))
+        messages = await asyncio.wait_for(
+            asyncio.gather(*(batcher.get_message(client, -1, message_id) for message_id in ids)), timeout=5
+        )
+        assert [m.id for m in messages] == ids
+        assert client.calls == [(-1, ids)]
+
+    asyncio.run(run())
+
+
+def test_errors_reach_every_waiter_of_the_batch():
+    async def run():
+        batcher = MessageBatcher(0.02)
+        client = FakeClient(failing_chats=(-9,))
+        lookups = [batcher.get_message(client, -9, 1), batcher.get_message(client, -9, 2),
+                   batcher.get_message(client, -9, 2), batcher.get_message(client, -1, 1)]
+        results = await asyncio.gather(*lookups, return_exceptions=True)
+        for result in results[:3]:
+            assert isinstance(result, RuntimeError) and "-9" in str(result)
+        # Another chat's batch is unaffected
+        assert results[3].id == 1
+
+    asyncio.run(run())
+
+
+def test_no_window_disables_batching():
+    async def run():
+        batcher = MessageBatcher(0)
+        client = FakeClient()
+        messages = await asyncio.gather(batcher.get_message(client, -1, 1), batcher.get_message(client, -1, 2))
+        assert [m.id for m in messages] == [1, 2]
+        assert sorted(client.calls) == [(-1, 1), (-1, 2)]
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_concurrent_lookups_are_merged()
+    test_full_batch_is_sent_at_once()
+    test_errors_reach_every_waiter_of_the_batch()
+    test_no_window_disables_batching()
+    print("✅ All message batcher tests passed!")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the LRU+TTL metadata cache behaviour
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.utils.cache import LRUCache, MetadataCache
+from WebStreamer.utils import ByteStreamer
+from WebStreamer.utils.metadata import file_metadata, remember_file_id
+from WebStreamer.utils.metadata_store import metadata_store
+
+
+def test_lru_eviction():
+    """Least recently used entries are evicted first"""
+    cache = LRUCache(max_size=2)
+    cache.set((1, 1), "a")
+    cache.set((2, 1), "b")
+    assert cache.get((1, 1)) == "a"
+    cache.set((3, 1), "c")
+    assert (2, 1) not in cache
+    assert cache.get((1, 1)) == "a"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_keys_do_not_collide_across_channels():
+    """The same message id in two channels is two entries"""
+    cache = LRUCache(max_size=10)
+    cache.set((-1001, 5), "first")
+    cache.set((-1002, 5), "second")
+    assert cache.get((-1001, 5)) == "first"
+    assert cache.get((-1002, 5)) == "second"
+
+
+def test_concurrent_misses_share_one_load():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "meta"
+
+    async def run():
+        cache = MetadataCache(max_size=10, ttl=60, stale_ttl=60)
+        results = await asyncio.gather(*[cache.get_or_load("k", loader) for _ in range(10)])
+        assert results == ["meta"] * 10
+        assert await cache.get_or_load("k", loader) == "meta"
+        return cache
+
+    cache = asyncio.run(run())
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_stale_entries_are_served_while_refreshing():
+    values = iter(["old", "new"])
+
+    async def loader():
+        return next(values)
+
+    async def run():
+        cache = MetadataCache(max_size=10, ttl=0.05, stale_ttl=10)
+        assert await cache.get_or_load("k", loader) == "old"
+        time.sleep(0.06)
+        # Expired but inside the stale window: old value now, refreshed in the background
+        assert await cache.get_or_load("k", loader) == "old"
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert await cache.get_or_load("k", loader) == "new"
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.stats()["stale_hits"] == 1
+    assert cache.stats()["refreshes"] == 1
+
+
+def test_refresh_keeps_file_ids_of_other_clients():
+    """A refresh loaded from the persistent store is merged into the cached entry"""
+    def file_id(access_hash):
+        value = FileId(file_type=FileType.DOCUMENT, dc_id=4, media_id=9, access_hash=access_hash, file_reference=b"r")
+        setattr(value, "file_id", value.encode())
+        setattr(value, "unique_id", "AgADCQ")
+        setattr(value, "file_size", 10)
+        return value
+
+    async def run():
+        metadata_store.path = os.path.join(tempfile.mkdtemp(), "metadata.db")
+        await metadata_store.start()
+        try:
+            cached = remember_file_id(-1001, 31, "bot1", file_id(1))
+            remember_file_id(-1001, 31, "bot2", file_id(2))
+            await metadata_store.flush()
+            refreshed = await ByteStreamer(SimpleNamespace(name="bot3")).generate_file_metadata(31, -1001)
+            assert refreshed is cached is file_metadata.peek((-1001, 31))
+            assert sorted(refreshed.file_ids) == ["bot1", "bot2"]
+        finally:
+            await metadata_store.close()
+            metadata_store.path = ""
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_lru_eviction()
+    test_keys_do_not_collide_across_channels()
+    test_concurrent_misses_share_one_load()
+    test_stale_entries_are_served_while_refreshing()
+    test_refresh_keeps_file_ids_of_other_clients()
+    print("✅ All metadata cache tests passed!")
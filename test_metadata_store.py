@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script to verify resolved files round-trip through the persistent SQLite metadata index
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+
+from conftest import make_file_id
+
+from WebStreamer import Var
+from WebStreamer.utils.metadata import (
+    file_metadata, load_stored_metadata, load_stored_metadata_many, lookup_by_unique_id, remember_file_id, unique_index
+)
+from WebStreamer.utils.metadata_store import MetadataStore, metadata_store
+
+
+def record(message_id, unique_id="AgADAQ", ref_time=None, channel_id=-1001, **overrides):
+    file_id = make_file_id(message_id, 100 * message_id).encode()
+    values = {"channel_id": channel_id, "message_id": message_id, "unique_id": unique_id, "file_id": file_id,
+              "file_size": 100 * message_id, "mime_type": "video/mp4", "file_name": f"{message_id}.mp4",
+              "dc_id": 4, "client_key": "bot1", "ref_time": ref_time or time.time()}
+    values.update(overrides)
+    return values
+
+
+def test_records_survive_restart():
+    async def run():
+        path = os.path.join(tempfile.mkdtemp(), "metadata.db")
+        store = MetadataStore(path, flush_interval=60)
+        await store.start()
+        first, second = record(1, ref_time=1000.0), record(2, ref_time=2000.0)
+        store.put(first)
+        store.put(second)
+        store.put(record(3, unique_id="AgADAw", channel_id=-1002))
+        # Readable before the batched write
+        assert await store.get(-1001, 1) == first
+        # A later record of the same message replaces the earlier one
+        renamed = record(2, ref_time=2000.0, file_name="renamed.mp4")
+        store.put(renamed)
+        await store.close()
+
+        restarted = MetadataStore(path, flush_interval=60)
+        await restarted.start()
+        try:
+            assert await restarted.get(-1001, 1) == first
+            assert (await restarted.get(-1001, 2))["file_name"] == "renamed.mp4"
+            assert await restarted.get(-1001, 4) is None
+            # The most recently resolved message of a file
+            assert (await restarted.get_by_unique_id("AgADAQ"))["message_id"] == 2
+            assert await restarted.get_by_unique_id("AgADzz") is None
+            assert sorted(await restarted.get_many(-1001, [1, 2, 3, 4])) == [1, 2]
+            assert sorted(await restarted.channel_ids()) == [-1002, -1001]
+            pages = [[row["message_id"] for row in rows] async for rows in restarted.iter_pages(page_size=2, limit=3)]
+            assert pages == [[3, 2], [1]]
+
+            # Dedup keys keep the first file that claimed them
+            claimed = await restarted.claim_canonical({"key": "sha256:ab", "channel_id": -1001, "message_id": 1})
+            assert claimed["message_id"] == 1
+            again = await restarted.claim_canonical({"key": "sha256:ab", "channel_id": -1001, "message_id": 2})
+            assert again["message_id"] == 1
+            assert (await restarted.get_canonical("sha256:ab"))["message_id"] == 1
+        finally:
+            await restarted.close()
+
+    asyncio.run(run())
+
+
+def test_disabled_store():
+    async def run():
+        store = MetadataStore("")
+        await store.start()
+        assert not store.enabled
+        store.put(record(1))
+        assert await store.get(-1001, 1) is None
+        assert await store.get_many(-1001, [1]) == {}
+        assert await store.claim_canonical({"key": "k", "message_id": 1}) == {"key": "k", "message_id": 1}
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_resolved_files_are_loaded_back():
+    async def run():
+        metadata_store.path = os.path.join(tempfile.mkdtemp(), "metadata.db")
+        await metadata_store.start()
+        try:
+            file_id = make_file_id(51, 5100)
+            for name, value in (("file_id", file_id.encode()), ("unique_id", "AgADMw"),
+                                ("mime_type", "video/mp4"), ("file_name", "fifty-one.mp4")):
+                setattr(file_id, name, value)
+            remember_file_id(-1001, 51, "bot1", file_id)
+            await metadata_store.flush()
+            # As after a restart, only the store knows the file
+            file_metadata.pop((-1001, 51))
+            unique_index.pop("AgADMw")
+
+            loaded = await load_stored_metadata(-1001, 51)
+            assert (loaded.unique_id, loaded.file_size, loaded.file_name) == ("AgADMw", 5100, "fifty-one.mp4")
+            stored_id = loaded.file_id_for("bot1")
+            assert stored_id.media_id == 51 and stored_id.file_size == 5100
+            assert sorted(await load_stored_metadata_many(-1001, [50, 51])) == [51]
+            assert (await lookup_by_unique_id("AgADMw")).file_size == 5100
+
+            # References too old to be used aren't loaded
+            max_age = Var.METADATA_REF_MAX_AGE
+            Var.METADATA_REF_MAX_AGE = -1
+            try:
+                assert await load_stored_metadata(-1001, 51) is None
+            finally:
+                Var.METADATA_REF_MAX_AGE = max_age
+        finally:
+            await metadata_store.close()
+            metadata_store.path = ""
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_records_survive_restart()
+    test_disabled_store()
+    test_resolved_files_are_loaded_back()
+    print("✅ All metadata store tests passed!")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script to verify adaptive GetFile part sizes respect Telegram's limits and return the right bytes
+"""
+
+import os
+import random
+import asyncio
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from pyrogram import raw
+from pyrogram.file_id import FileId, FileType
+import WebStreamer.server.stream_routes  # noqa: F401 - resolves the import cycle of utils
+from WebStreamer.bot import work_loads
+from WebStreamer.utils.custom_dl import ByteStreamer, get_part_range, FIRST_PART_SIZE
+
+MiB = 1024 * 1024
+DATA = os.urandom(5 * MiB + 4321)
+FILE_ID = FileId(file_type=FileType.VIDEO, dc_id=4, media_id=7, access_hash=1, file_reference=b"ref")
+setattr(FILE_ID, "file_size", len(DATA))
+
+
+class TelegramLikeSession:
+    def __init__(self):
+        self.calls = []
+
+    async def invoke(self, query):
+        offset, limit = query.offset, query.limit
+        assert limit % 4096 == 0 and MiB % limit == 0, limit
+        assert offset % limit == 0, (offset, limit)
+        assert offset // MiB == (offset + limit - 1) // MiB, (offset, limit)
+        self.calls.append((offset, limit))
+        return raw.types.upload.File(type=raw.types.storage.FilePartial(), mtime=0,
+                                     bytes=DATA[offset:offset + limit])
+
+
+class FakeClient:
+    name = "test"
+
+    def __init__(self):
+        self.media_sessions = {4: TelegramLikeSession()}
+
+
+async def read_range(streamer, from_bytes, until_bytes):
+    data = b""
+    async for chunk in streamer.yield_file(FILE_ID, 0, from_bytes, until_bytes):
+        data += chunk
+    return data
+
+
+def test_random_ranges():
+    async def run():
+        work_loads[0] = 0
+        streamer = ByteStreamer(FakeClient())
+        rng = random.Random(7)
+        for _ in range(200):
+            start = rng.randrange(len(DATA))
+            end = min(len(DATA) - 1, start + rng.choice([0, 1, 4095, 70000, MiB, 3 * MiB]))
+            assert await read_range(streamer, start, end) == DATA[start:end + 1], (start, end)
+        assert work_loads[0] == 0
+
+    asyncio.run(run())
+
+
+def test_first_part_is_small_then_ramps_up():
+    async def run():
+        work_loads[0] = 0
+        client = FakeClient()
+        await read_range(ByteStreamer(client), 3 * MiB + 100, len(DATA) - 1)
+        limits = [limit for _, limit in client.media_sessions[4].calls]
+        assert limits[0] == FIRST_PART_SIZE
+        assert limits[-2] == MiB
+        assert limits == sorted(limits[:-1]) + limits[-1:]
+
+    asyncio.run(run())
+
+
+def test_small_ranges_fetch_little():
+    assert get_part_range(100, 199, MiB) == (0, 4096)
+    assert get_part_range(MiB - 10, MiB - 1, 64 * 1024) == (MiB - 4096, 4096)
+
+
+if __name__ == "__main__":
+    test_random_ranges()
+    test_first_part_is_small_then_ramps_up()
+    test_small_ranges_fetch_little()
+    print("✅ All part sizing tests passed!")
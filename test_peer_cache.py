@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Test script to verify peer resolution is cached for a while, failures fail fast until they expire
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from conftest import make_message
+
+from WebStreamer.server.exceptions import PeerIdInvalid
+from WebStreamer.utils.file_properties import get_messages_resolving_peer
+from WebStreamer.utils.peer_cache import PeerCache, peer_cache
+
+CHAT = -1001234567
+
+
+class FakeClient:
+    def __init__(self, name, reachable=True):
+        self.name = name
+        self.reachable = reachable
+        self.resolves = 0
+        self.invokes = 0
+        self.restored = []
+        self.storage = SimpleNamespace(update_peers=self.update_peers)
+
+    async def resolve_peer(self, chat_id):
+        self.resolves += 1
+        await asyncio.sleep(0.01)
+        if not self.reachable:
+            raise KeyError(chat_id)
+        return SimpleNamespace(channel_id=chat_id, access_hash=77)
+
+    async def invoke(self, query):
+        self.invokes += 1
+        if not self.reachable:
+            raise RuntimeError("CHANNEL_INVALID")
+        return SimpleNamespace()
+
+    async def get_chat(self, chat_id):
+        if not self.reachable:
+            raise RuntimeError("CHANNEL_INVALID")
+
+    async def update_peers(self, peers):
+        self.restored.extend(peers)
+
+
+def test_resolved_peers_are_cached_until_they_expire():
+    async def run():
+        cache = PeerCache(ttl=0.2, negative_ttl=60)
+        client = FakeClient("peers")
+        # Concurrent requests share one resolution
+        assert all(await asyncio.gather(*(cache.resolve(client, CHAT) for _ in range(5))))
+        assert client.resolves == 1
+        assert await cache.resolve(client, CHAT)
+        assert client.resolves == 1 and cache.stats()["hits"] >= 1
+        # Each client has its own entry
+        other = FakeClient("other")
+        assert await cache.resolve(other, CHAT) and other.resolves == 1
+
+        await asyncio.sleep(0.25)
+        assert await cache.resolve(client, CHAT)
+        assert client.resolves == 2
+
+    asyncio.run(run())
+
+
+def test_forced_resolve_reuses_the_cached_hash_once():
+    async def run():
+        cache = PeerCache(ttl=60, negative_ttl=60)
+        client = FakeClient("forced")
+        assert await cache.resolve(client, CHAT)
+        # Telegram rejected the stored peer: the cached access hash is put back into the session first
+        assert await cache.resolve(client, CHAT, force=True)
+        assert client.restored == [(CHAT, 77, "channel", [], None)] and client.invokes == 0
+        # A second rejection runs the full chain
+        assert await cache.resolve(client, CHAT, force=True)
+        assert client.invokes == 1
+
+    asyncio.run(run())
+
+
+def test_unresolvable_peers_fail_fast_until_they_expire():
+    async def run():
+        cache = PeerCache(ttl=60, negative_ttl=0.2)
+        client = FakeClient("unreachable", reachable=False)
+        assert not await cache.resolve(client, CHAT)
+        assert cache.is_unresolvable(client, CHAT)
+        attempts = client.resolves, client.invokes
+        assert not await cache.resolve(client, CHAT)
+        assert (client.resolves, client.invokes) == attempts
+        assert cache.stats()["unresolvable"] == 1
+
+        await asyncio.sleep(0.25)
+        client.reachable = True
+        assert not cache.is_unresolvable(client, CHAT)
+        assert await cache.resolve(client, CHAT)
+
+        # A chat the client later receives an update from is known again at once
+        cache.failed.set(cache._key(client, -1009), True)
+        cache.mark_seen(client, -1009)
+        assert not cache.is_unresolvable(client, -1009)
+
+    asyncio.run(run())
+
+
+def test_lookups_resolve_peer_once_and_skip_known_failures():
+    async def run():
+        client = FakeClient("lookups")
+        calls = []
+
+        async def get_messages(chat_id, message_ids):
+            calls.append(message_ids)
+            if len(calls) == 1:
+                raise RuntimeError("Telegram says: [400 PEER_ID_INVALID]")
+            return make_message(message_ids, 1)
+
+        client.get_messages = get_messages
+        message = await get_messages_resolving_peer(client, CHAT, 5)
+        assert message.id == 5 and calls == [5, 5]
+
+        peer_cache.failed.set(peer_cache._key(client, -1005), True)
+        try:
+            await get_messages_resolving_peer(client, -1005, 5)
+        except PeerIdInvalid:
+            pass
+        else:
+            raise AssertionError("expected PeerIdInvalid")
+        assert calls == [5, 5]
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_resolved_peers_are_cached_until_they_expire()
+    test_forced_resolve_reuses_the_cached_hash_once()
+    test_unresolvable_peers_fail_fast_until_they_expire()
+    test_lookups_resolve_peer_once_and_skip_known_failures()
+    print("✅ All peer cache tests passed!")
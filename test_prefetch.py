@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test script to verify prefetch jobs pull whole files into the chunk cache and resume after a restart
+"""
+
+import asyncio
+
+from conftest import make_file_id, use_temp_chunk_cache
+from WebStreamer.bot import multi_clients, work_loads
+from WebStreamer.utils.chunk_cache import chunk_cache, PART_SIZE
+from WebStreamer.utils.custom_dl import ByteStreamer
+from WebStreamer.utils.prefetch import PrefetchManager
+
+
+class FakeStreamer:
+    def __init__(self):
+        self.fetched = []
+
+    async def cache_part(self, file_id, part_index, priority):
+        await asyncio.sleep(0.001)
+        self.fetched.append(part_index)
+        size = min(PART_SIZE, file_id.file_size - part_index * PART_SIZE)
+        await chunk_cache.write_part(file_id, file_id.file_size, part_index, b"\0" * size)
+        return True
+
+    # Fills of the same part are shared exactly like with a real streamer
+    fill_part = ByteStreamer.fill_part
+
+
+async def setup_cache():
+    await use_temp_chunk_cache()
+    multi_clients.clear()
+    multi_clients.update({0: "a", 1: "b"})
+    work_loads.update({0: 0, 1: 0})
+
+
+async def wait_for(manager, job):
+    for _ in range(500):
+        if manager.get(job.job_id).state in ("done", "failed"):
+            return manager.get(job.job_id)
+        await asyncio.sleep(0.01)
+    raise TimeoutError(job.job_id)
+
+
+def test_whole_file_is_cached():
+    async def run():
+        await setup_cache()
+        streamer = FakeStreamer()
+        manager = PrefetchManager(0)
+        await manager.start(lambda index: streamer)
+        file_id = make_file_id(1, 5 * PART_SIZE + 7)
+        job = manager.submit(file_id, "a.bin")
+        # Submitted twice while queued, one job
+        assert manager.submit(make_file_id(1, 5 * PART_SIZE + 7), "a.bin") is job
+        job = await wait_for(manager, job)
+        assert job.state == "done", job.error
+        assert sorted(streamer.fetched) == list(range(6))
+        status = job.status()
+        assert status["parts_cached"] == 6 and status["progress"] == 1.0
+        assert chunk_cache.covered_path(file_id, file_id.file_size, 0, file_id.file_size - 1)
+        assert work_loads == {0: 0, 1: 0}
+        assert manager.stats()["done"] == 1
+
+    asyncio.run(run())
+
+
+def test_restart_resumes_missing_parts():
+    async def run():
+        await setup_cache()
+        file_id = make_file_id(2, 4 * PART_SIZE)
+        # A previous run cached two parts and saved its job before stopping
+        for index in (0, 2):
+            await chunk_cache.write_part(file_id, file_id.file_size, index, b"\0" * PART_SIZE)
+        manager = PrefetchManager(0)
+        await manager.start(lambda index: FakeStreamer())
+        job = manager.submit(file_id, "b.bin")
+        manager._runner.cancel()
+        job.state = "running"
+        await manager._save(job)
+        assert job.status()["parts_cached"] == 2
+
+        streamer = FakeStreamer()
+        restarted = PrefetchManager(0)
+        await restarted.start(lambda index: streamer)
+        resumed = await wait_for(restarted, job)
+        assert resumed.state == "done" and resumed.name == "b.bin"
+        assert sorted(streamer.fetched) == [1, 3]
+        assert resumed.status()["fetched_bytes"] == 2 * PART_SIZE
+
+    asyncio.run(run())
+
+
+def test_rejected_files():
+    async def run():
+        await setup_cache()
+        manager = PrefetchManager(0)
+        try:
+            manager.submit(make_file_id(3, PART_SIZE))
+            assert False, "not started"
+        except RuntimeError:
+            pass
+        await manager.start(lambda index: FakeStreamer())
+        for file_size in (0, 65 * PART_SIZE):
+            try:
+                manager.submit(make_file_id(3, file_size))
+                assert False, file_size
+            except ValueError:
+                pass
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_whole_file_is_cached()
+    test_restart_resumes_missing_parts()
+    test_rejected_files()
+    print("✅ All prefetch tests passed!")
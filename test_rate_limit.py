@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test script to verify per-IP request limits, the concurrent stream cap and the per-stream bandwidth ceiling
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from WebStreamer.server.stream_routes import CachedFileResponse, stream_admission
+from WebStreamer.utils.rate_limit import RouteLimiter
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_token_bucket():
+    limiter = RouteLimiter("test", rate=60, burst=2)
+    assert limiter.check("1.1.1.1") == 0
+    assert limiter.check("1.1.1.1") == 0
+    # One request per second once the burst is used up
+    assert 0.9 < limiter.check("1.1.1.1") <= 1.0
+    assert limiter.limited == 1
+    # Every IP has its own bucket
+    assert limiter.check("2.2.2.2") == 0
+
+
+def test_stream_cap_under_concurrent_admission():
+    async def run():
+        limiter = RouteLimiter("test", max_streams=2)
+        release = asyncio.Event()
+
+        @stream_admission(limiter)
+        async def handler(request):
+            # Awaits before the body starts, as descriptor resolution does
+            await asyncio.sleep(0.05)
+            response = web.StreamResponse()
+            await response.prepare(request)
+            await release.wait()
+            await response.write(b"data")
+            return response
+
+        server = await serve(handler)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async def fetch():
+                    async with session.get(server.make_url("/file")) as response:
+                        await response.read()
+                        return response.status
+
+                fetches = [asyncio.ensure_future(fetch()) for _ in range(5)]
+                await asyncio.sleep(0.2)
+                assert limiter.stats()["active_streams"] == 2
+                release.set()
+                statuses = sorted(await asyncio.gather(*fetches))
+                assert statuses == [200, 200, 429, 429, 429], statuses
+            assert limiter.stats()["active_streams"] == 0
+            assert limiter.stats()["active_ips"] == 0
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_slot_released_when_handler_fails():
+    async def run():
+        limiter = RouteLimiter("test", max_streams=1)
+
+        @stream_admission(limiter)
+        async def handler(request):
+            raise web.HTTPBadRequest()
+
+        server = await serve(handler)
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(3):
+                    async with session.get(server.make_url("/file")) as response:
+                        assert response.status == 400
+            assert limiter.stats()["active_streams"] == 0
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_cached_file_holds_slot_until_sent():
+    async def run():
+        limiter = RouteLimiter("test", max_streams=1)
+        path = os.path.join(tempfile.mkdtemp(), "data")
+        with open(path, "wb") as f:
+            f.write(os.urandom(100000))
+        seen = []
+
+        class WatchedResponse(CachedFileResponse):
+            async def prepare(self, request):
+                # Sent after the handler returned, the slot is still taken
+                seen.append(limiter.stats()["active_streams"])
+                return await super().prepare(request)
+
+        @stream_admission(limiter)
+        async def handler(request):
+            return WatchedResponse("key", path)
+
+        server = await serve(handler)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(server.make_url("/file")) as response:
+                    assert response.status == 200
+                    assert len(await response.read()) == 100000
+            assert seen == [1]
+            assert limiter.stats()["active_streams"] == 0
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_bandwidth_ceiling():
+    async def run():
+        limiter = RouteLimiter("test", bandwidth=40000)
+
+        async def body():
+            for _ in range(6):
+                yield b"\0" * 10000
+
+        started = time.monotonic()
+        sent = sum([len(chunk) async for chunk in limiter.throttle(body())])
+        # The first second's worth goes out at once, the rest at 40000 bytes per second
+        assert sent == 60000
+        assert time.monotonic() - started >= 0.45
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_token_bucket()
+    test_stream_cap_under_concurrent_admission()
+    test_slot_released_when_handler_fails()
+    test_cached_file_holds_slot_until_sent()
+    test_bandwidth_ceiling()
+    print("✅ All rate limit tests passed!")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test script to verify slow clients are moved off the live GetFile stream onto the chunk cache
+"""
+
+import os
+import socket
+import asyncio
+import importlib
+
+from conftest import make_file_id, use_temp_chunk_cache
+
+from aiohttp.test_utils import TestServer
+from pyrogram import raw
+from WebStreamer import Var
+from WebStreamer.server import web_server
+from WebStreamer.bot import multi_clients, work_loads
+from WebStreamer.utils import ByteStreamer
+from WebStreamer.utils.chunk_cache import chunk_cache, PART_SIZE
+
+# The package exports the route table under the module's name
+stream_routes = importlib.import_module("WebStreamer.server.stream_routes")
+
+DATA = os.urandom(6 * PART_SIZE + 1000)
+FILE_ID = make_file_id(42, len(DATA)).encode()
+
+
+class FakeSession:
+    def __init__(self):
+        self.offsets = []
+
+    async def invoke(self, query):
+        self.offsets.append(query.offset)
+        await asyncio.sleep(0.001)
+        return raw.types.upload.File(type=raw.types.storage.FilePartial(), mtime=0,
+                                     bytes=DATA[query.offset:query.offset + query.limit])
+
+
+class FakeClient:
+    name = "slow"
+
+    def __init__(self):
+        self.media_sessions = {4: FakeSession()}
+
+
+async def small_send_buffer(request, response):
+    # Keep what the server can queue up small, so the writes wait on the client almost at once
+    request.transport.set_write_buffer_limits(high=16384)
+    request.transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+
+
+async def connect(server, receive_buffer):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, (server.host, server.port))
+    return await asyncio.open_connection(sock=sock)
+
+
+def test_slow_reader_moves_to_chunk_cache():
+    async def run():
+        await use_temp_chunk_cache()
+        client = FakeClient()
+        session = client.media_sessions[4]
+        multi_clients.clear()
+        multi_clients[0] = client
+        work_loads.clear()
+        work_loads[0] = 0
+        stream_routes.class_cache.clear()
+        stream_routes.class_cache[client] = ByteStreamer(client)
+        Var.SLOW_READER_RATE, Var.SLOW_READER_GRACE, Var.SLOW_READER_WINDOW = 1024, 0.3, 2
+        slow_readers = stream_routes.stream_stats["slow_readers"]
+
+        app = web_server()
+        app.on_response_prepare.append(small_send_buffer)
+        server = TestServer(app)
+        await server.start_server()
+        reader, writer = await connect(server, 4096)
+        try:
+            writer.write(f"GET /dl/AgADKg/{FILE_ID}/{len(DATA)}/f.bin HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+            await writer.drain()
+            await reader.readuntil(b"\r\n\r\n")
+
+            # Trickle at about 160 KiB/s until the server gives up on the live stream
+            body = b""
+            for _ in range(100):
+                body += await reader.read(8192)
+                if stream_routes.stream_stats["slow_readers"] > slow_readers:
+                    break
+                await asyncio.sleep(0.05)
+            assert stream_routes.stream_stats["slow_readers"] == slow_readers + 1
+
+            # The client stops reading: the cache is filled up to the window ahead, then nothing holds
+            # the client's work load or fetches further
+            await asyncio.sleep(0.5)
+            assert work_loads[0] == 0
+            fetched = len(session.offsets)
+            await asyncio.sleep(0.2)
+            assert len(session.offsets) == fetched
+            assert chunk_cache.stats()["part_stores"] >= 2
+            assert max(session.offsets) < len(body) + (Var.SLOW_READER_WINDOW + 2) * PART_SIZE
+
+            # Catching up, the rest comes from the chunk cache intact
+            writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+            while len(body) < len(DATA):
+                chunk = await asyncio.wait_for(reader.read(1 << 20), timeout=5)
+                assert chunk
+                body += chunk
+            assert body == DATA
+            writer.close()
+            await asyncio.sleep(0.1)
+            assert work_loads[0] == 0
+        finally:
+            # Closed first, the server would wait on a handler writing to a client that stopped reading
+            writer.close()
+            await server.close()
+            Var.SLOW_READER_RATE = 0
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_slow_reader_moves_to_chunk_cache()
+    print("✅ All slow reader tests passed!")
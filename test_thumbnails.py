@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Test script to verify thumbnails are addressed correctly and cached within their byte budget
+"""
+
+import asyncio
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.utils.cache import ByteLRUCache
+from WebStreamer.utils.custom_dl import ByteStreamer
+from WebStreamer.utils.thumbnails import ThumbnailCache, thumbnail_file_id, image_type
+
+FILE_ID = FileId(file_type=FileType.VIDEO, dc_id=4, media_id=42, access_hash=1, file_reference=b"ref")
+
+
+def test_thumbnail_location():
+    thumbnail = thumbnail_file_id(FILE_ID, "m")
+    location = asyncio.run(ByteStreamer.get_location(thumbnail))
+    assert location.thumb_size == "m" and location.id == 42
+    # The media file itself is left alone
+    assert FILE_ID.thumbnail_size == ""
+    assert thumbnail_file_id(FILE_ID, "huge") is None
+    assert image_type(b"\xff\xd8\xff") == "image/jpeg"
+    assert image_type(b"RIFF\0\0\0\0WEBPVP8 ") == "image/webp"
+
+
+def test_byte_budget():
+    cache = ByteLRUCache(max_bytes=100)
+    cache.set("a", b"x" * 20)
+    cache.set("b", b"x" * 20)
+    cache.get("a")
+    cache.set("c", b"x" * 20)
+    cache.set("d", b"x" * 20)
+    cache.set("e", b"x" * 25)
+    # "b" was the least recently used one
+    assert "b" not in cache and "a" in cache
+    assert cache.total_bytes == 85
+    # Larger than a quarter of the budget, not cached at all
+    cache.set("big", b"x" * 26)
+    assert "big" not in cache and cache.total_bytes == 85
+    cache.set("a", b"")
+    assert cache.total_bytes == 65 and cache.get("a") == b""
+
+
+def test_concurrent_misses_share_a_fetch():
+    async def run():
+        cache = ThumbnailCache(1024 * 1024)
+        fetches = []
+
+        async def fetch():
+            fetches.append(1)
+            await asyncio.sleep(0.01)
+            return b"\xff\xd8thumb"
+
+        results = await asyncio.gather(*[cache.get_or_fetch("m", fetch) for _ in range(10)])
+        assert results == [b"\xff\xd8thumb"] * 10
+        assert await cache.get_or_fetch("m", fetch) == b"\xff\xd8thumb"
+        assert len(fetches) == 1
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_thumbnail_location()
+    test_byte_budget()
+    test_concurrent_misses_share_a_fetch()
+    print("✅ All thumbnail tests passed!")
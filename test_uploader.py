@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script to verify streamed uploads are cut into the parts Telegram expects, sent in parallel and in bounded memory
+"""
+
+import os
+import asyncio
+import hashlib
+
+import conftest  # noqa: F401 - sets the config WebStreamer reads on import
+
+from pyrogram import raw
+from WebStreamer.utils.uploader import PartUploader, UploadError, UPLOAD_PART_SIZE, SMALL_FILE_SIZE
+
+
+class FakeTelegram:
+    """Stores the parts it's sent and tracks how many are in flight"""
+
+    def __init__(self, fail_once=()):
+        self.parts = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_once = set(fail_once)
+
+    async def __call__(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.002)
+            if request.file_part in self.fail_once:
+                self.fail_once.discard(request.file_part)
+                raise OSError("connection lost")
+            self.requests.append(request)
+            self.parts[request.file_part] = request.bytes
+            return True
+        finally:
+            self.in_flight -= 1
+
+    def data(self):
+        return b"".join(self.parts[i] for i in sorted(self.parts))
+
+
+async def upload(data, file_size, telegram, chunk_size=100000, parallel=4):
+    uploader = PartUploader(telegram, "a.bin", file_size, parallel)
+    try:
+        for position in range(0, len(data), chunk_size):
+            await uploader.write(data[position:position + chunk_size])
+        return await uploader.finish()
+    finally:
+        uploader.close()
+
+
+def test_big_file_in_parallel():
+    data = os.urandom(SMALL_FILE_SIZE + 3 * UPLOAD_PART_SIZE + 17)
+    telegram = FakeTelegram(fail_once={2})
+    input_file = asyncio.run(upload(data, len(data), telegram))
+    assert isinstance(input_file, raw.types.InputFileBig)
+    assert input_file.parts == len(telegram.parts) == 24
+    assert telegram.data() == data
+    assert all(isinstance(r, raw.functions.upload.SaveBigFilePart) and r.file_total_parts == 24 for r in telegram.requests)
+    assert all(len(telegram.parts[i]) == UPLOAD_PART_SIZE for i in range(23))
+    assert 1 < telegram.max_in_flight <= 4
+
+
+def test_stream_of_unknown_size():
+    data = os.urandom(SMALL_FILE_SIZE + UPLOAD_PART_SIZE)
+    telegram = FakeTelegram()
+    input_file = asyncio.run(upload(data, None, telegram))
+    assert isinstance(input_file, raw.types.InputFileBig) and input_file.parts == 21
+    assert telegram.data() == data
+    # Every part but the last one says the total is unknown, the last one is sent after all others
+    assert [r.file_total_parts for r in telegram.requests] == [-1] * 20 + [21]
+    assert telegram.requests[-1].file_part == 20
+
+    # A short stream turns out to be a small file
+    small = os.urandom(UPLOAD_PART_SIZE * 2 + 5)
+    telegram = FakeTelegram()
+    input_file = asyncio.run(upload(small, None, telegram))
+    assert isinstance(input_file, raw.types.InputFile) and input_file.parts == 3
+    assert input_file.md5_checksum == hashlib.md5(small).hexdigest()
+    assert telegram.data() == small
+
+
+def test_wrong_sizes():
+    data = os.urandom(1000)
+    for announced in (999, 1001):
+        try:
+            asyncio.run(upload(data, announced, FakeTelegram()))
+            assert False, announced
+        except UploadError:
+            pass
+    try:
+        asyncio.run(upload(b"", None, FakeTelegram()))
+        assert False, "empty"
+    except UploadError:
+        pass
+
+
+if __name__ == "__main__":
+    test_big_file_in_parallel()
+    test_stream_of_unknown_size()
+    test_wrong_sizes()
+    print("✅ All upload tests passed!")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script to verify new uploads get their head and tail warmed up into the chunk cache
+"""
+
+import asyncio
+
+from conftest import make_file_id, use_temp_chunk_cache
+from WebStreamer.bot import work_loads
+from WebStreamer.utils.chunk_cache import chunk_cache, PART_SIZE
+from WebStreamer.utils.custom_dl import ByteStreamer
+from WebStreamer.utils.warmup import WarmupQueue, warmup_parts
+
+
+class FakeStreamer:
+    client = "fake"
+
+    def __init__(self):
+        self.sessions = 0
+        self.fetched = []
+
+    async def generate_media_session(self, client, file_id):
+        self.sessions += 1
+
+    async def cache_part(self, file_id, part_index, priority):
+        self.fetched.append(part_index)
+        size = min(PART_SIZE, file_id.file_size - part_index * PART_SIZE)
+        await chunk_cache.write_part(file_id, file_id.file_size, part_index, b"\0" * size)
+        return True
+
+    # Fills of the same part are shared exactly like with a real streamer
+    fill_part = ByteStreamer.fill_part
+
+
+def test_warmup_parts():
+    assert warmup_parts(10 * PART_SIZE + 5, 2, 2) == [0, 1, 9, 10]
+    # Head and tail overlap on small files
+    assert warmup_parts(3 * PART_SIZE, 2, 2) == [0, 1, 2]
+    assert warmup_parts(100, 4, 2) == [0]
+    assert warmup_parts(0, 4, 2) == []
+
+
+def test_head_and_tail_are_cached():
+    async def run():
+        await use_temp_chunk_cache()
+        work_loads[0] = 0
+        queue = WarmupQueue(True, head=2, tail=1)
+        streamer = FakeStreamer()
+        file_id = make_file_id(1, 6 * PART_SIZE + 10)
+        assert queue.enqueue(file_id, streamer, 0)
+        # Queued twice (e.g. one update per client), warmed up once
+        assert not queue.enqueue(file_id, streamer, 0)
+        await queue._queue.join()
+        assert streamer.fetched == [0, 1, 6]
+        assert streamer.sessions == 1
+        assert chunk_cache.covered_path(file_id, file_id.file_size, 6 * PART_SIZE, 6 * PART_SIZE + 9)
+        assert work_loads[0] == 0
+        assert queue.stats()["completed"] == 1
+
+    asyncio.run(run())
+
+
+def test_full_queue_drops_uploads():
+    async def run():
+        queue = WarmupQueue(True, head=1, tail=1, max_queued=1)
+        streamer = FakeStreamer()
+        assert queue.enqueue(make_file_id(2, PART_SIZE), streamer, 0)
+        # The worker hasn't picked up the first file yet
+        assert not queue.enqueue(make_file_id(3, PART_SIZE), streamer, 0)
+        assert queue.stats()["dropped"] == 1
+        assert not WarmupQueue(False, 1, 1).enqueue(make_file_id(4, PART_SIZE), streamer, 0)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_warmup_parts()
+    test_head_and_tail_are_cached()
+    test_full_queue_drops_uploads()
+    print("✅ All warm-up tests passed!")